@@ -1,16 +1,78 @@
 import io
+import os
+import time
+import asyncio
+import json
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, BinaryIO, Callable, Tuple, Union
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2 import PageObject, PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, ContentStream, DictionaryObject, NameObject
+from core.cache import SizedLRUCache
+from core.metrics import metrics
+
+TEMPLATE_PATH = "data/f1040_template.pdf"
+# Drafts are built in memory up to this size, then spill to a temp file
+DRAFT_SPOOL_MAX_MEMORY = 4 * 1024 * 1024
+
+# Rendered drafts by draft_key(): users regenerate the same draft while
+# reviewing, and a repeat is served from here (or answered 304) unrendered
+DRAFT_CACHE_MB = float(os.getenv("DRAFT_CACHE_MB", "32"))
+draft_cache = SizedLRUCache(max_bytes=int(DRAFT_CACHE_MB * 1024 * 1024))
+
+# reportlab and PyPDF2 are CPU-bound and synchronous: drafts are built on a
+# small dedicated pool (threads, so they share one parsed template) and the
+# event loop keeps serving auth and reconcile. At most DRAFT_WORKERS drafts
+# build at once; the rest wait in the pool's queue.
+DRAFT_WORKERS = int(os.getenv("DRAFT_WORKERS", "4"))
+_draft_executor = ThreadPoolExecutor(max_workers=DRAFT_WORKERS, thread_name_prefix="draft")
 
 class DraftingAgent:
+    """Fills the 1040 template with a return's values.
+
+    The template is read and parsed once, and the static "DRAFT" watermark is
+    rendered and merged into its first page once, in __init__. Each draft
+    only renders the per-return text overlay, so create one agent and reuse it.
+    """
+
     def __init__(self, template_path: str):
         self.template_path = template_path
+        with open(template_path, "rb") as f:
+            template_bytes = f.read()
+        # Changes whenever the template file does, so draft_key() does too
+        self.template_version = hashlib.sha256(template_bytes).hexdigest()[:16]
+        template = PdfReader(io.BytesIO(template_bytes))
 
-    def create_overlay(self, data: dict):
+        # Static layer: the template with the watermark merged into its first
+        # page, content wrapped in q/Q so the overlay starts from a clean
+        # graphics state. Written out and read back once, so every stream in
+        # it is an indirect object a draft can reference without copying.
+        first_page = template.pages[0]
+        first_page.merge_page(PdfReader(self.create_watermark()).pages[0])
+        static = ContentStream(first_page.get_contents(), template)
+        static.operations.insert(0, ([], b"q"))
+        static.operations.append(([], b"Q"))
+        first_page[NameObject("/Contents")] = static
+        writer = PdfWriter()
+        for page in template.pages:
+            writer.add_page(page)
+        packet = io.BytesIO()
+        writer.write(packet)
+        self._template = PdfReader(packet)
+        # PdfReader resolves objects lazily from one stream; drafts copy from
+        # it under this lock
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def create_watermark():
         packet = io.BytesIO()
         can = canvas.Canvas(packet, pagesize=letter)
-        
+
         # --- Watermark (Psychological Value) ---
         can.setFont("Helvetica-Bold", 60)
         can.setStrokeColorRGB(0.8, 0.8, 0.8)
@@ -21,42 +83,129 @@ class DraftingAgent:
         can.drawCentredString(0, 0, "DRAFT - NOT FOR FILING")
         can.restoreState()
 
+        can.showPage()
+        can.save()
+        packet.seek(0)
+        return packet
+
+    @staticmethod
+    def overlay_fields(data: dict) -> dict:
+        """The values create_overlay() draws, as drawn."""
+        return {
+            "filing_status": data.get("filing_status"),
+            "wages": f"{data.get('wages', 0):,.0f}",
+            "agi": f"{data.get('agi', 0):,.0f}",
+        }
+
+    def draft_key(self, data: dict) -> str:
+        """Content hash of the draft generate() would produce: the template
+        version plus the values drawn on it, so returns that differ only in
+        fields the draft does not show (or in cents) share a key."""
+        payload = json.dumps([self.template_version, self.overlay_fields(data)], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+    def create_overlay(self, data: dict):
+        packet = io.BytesIO()
+        can = canvas.Canvas(packet, pagesize=letter)
+
         # --- Mapping Data to 1040 Coordinates ---
-        # Note: These coordinates (x, y) require some fine-tuning 
+        # Note: These coordinates (x, y) require some fine-tuning
         # based on your specific 1040 PDF template.
         can.setFont("Helvetica", 10)
         can.setFillColorRGB(0, 0, 0)
-        
+
+        data = self.overlay_fields(data)
+
         # Example: Filing Status (Checkboxes)
-        if data.get("filing_status") == "Single":
+        if data["filing_status"] == "Single":
             can.drawString(65, 715, "X")
-        elif data.get("filing_status") == "Married filing jointly":
+        elif data["filing_status"] == "Married filing jointly":
             can.drawString(135, 715, "X")
 
         # Example: Income Lines
-        can.drawString(440, 560, f"{data.get('wages', 0):,.0f}") # Line 1z
-        can.drawString(440, 435, f"{data.get('agi', 0):,.0f}")   # Line 11
-        
+        can.drawString(440, 560, data["wages"]) # Line 1z
+        can.drawString(440, 435, data["agi"])   # Line 11
+
         can.showPage()
         can.save()
         packet.seek(0)
         return packet
 
-    def generate(self, data: dict, output_path: str):
-        overlay_packet = self.create_overlay(data)
-        overlay_pdf = PdfReader(overlay_packet)
-        template_pdf = PdfReader(open(self.template_path, "rb"))
-        
-        output = PdfWriter()
-        
-        # Merge overlay with the first page of the template
-        page = template_pdf.pages[0]
-        page.merge_page(overlay_pdf.pages[0])
-        output.add_page(page)
-        
-        # Add remaining pages from template if they exist
-        for i in range(1, len(template_pdf.pages)):
-            output.add_page(template_pdf.pages[i])
-
-        with open(output_path, "wb") as f:
-            output.write(f)
\ No newline at end of file
+    def draft_page(self, data: dict) -> PageObject:
+        """The first template page with this return's overlay on top.
+
+        Rather than merge_page, which re-parses the template's content stream
+        on every call, the page is a shallow copy of the cached one whose
+        content is [static layer, overlay] and whose fonts add the overlay's.
+        The cached page is never modified."""
+        overlay = PdfReader(self.create_overlay(data)).pages[0]
+        with self._lock:
+            static_page = self._template.pages[0]
+            resources = DictionaryObject(static_page["/Resources"])
+            fonts = DictionaryObject(resources["/Font"].get_object())
+        fonts.update(overlay["/Resources"]["/Font"].get_object())
+        resources[NameObject("/Font")] = fonts
+
+        page = PageObject(self._template)
+        page.update(static_page)
+        page[NameObject("/Contents")] = ArrayObject([static_page.raw_get("/Contents"), overlay.raw_get("/Contents")])
+        page[NameObject("/Resources")] = resources
+        return page
+
+    def append(self, writer: PdfWriter, page: PageObject) -> None:
+        """Add a draft_page() and the rest of the template to `writer`."""
+        # add_page copies each page into the writer; PdfReader resolves
+        # objects lazily from one stream, so copy under the lock
+        with self._lock:
+            writer.add_page(page)
+            # Add remaining pages from template if they exist
+            for template_page in self._template.pages[1:]:
+                writer.add_page(template_page)
+
+    def generate(self, data: dict, output: Union[str, BinaryIO]):
+        """Write the draft to `output`: a path or a writable binary file."""
+        writer = PdfWriter()
+        self.append(writer, self.draft_page(data))
+
+        if isinstance(output, str):
+            with open(output, "wb") as f:
+                writer.write(f)
+        else:
+            writer.write(output)
+
+    def render(self, data: dict) -> Tuple[BinaryIO, int]:
+        """The draft in a per-call spooled temp file (memory up to
+        DRAFT_SPOOL_MAX_MEMORY, disk beyond), rewound, and its size in bytes.
+        The caller closes it."""
+        spool = tempfile.SpooledTemporaryFile(max_size=DRAFT_SPOOL_MAX_MEMORY)
+        try:
+            self.generate(data, spool)
+        except BaseException:
+            spool.close()
+            raise
+        size = spool.tell()
+        spool.seek(0)
+        return spool, size
+
+
+async def run_drafting(fn: Callable[..., Any], *args) -> Any:
+    """fn(*args) on the drafting pool. Time spent queued for a worker and
+    time spent building are recorded apart, as draft.queue_wait_ms and
+    draft.build_ms (labelled with fn's name)."""
+    submitted = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        metrics.observe("draft.queue_wait_ms", (started - submitted) * 1000, op=fn.__name__)
+        try:
+            return fn(*args)
+        finally:
+            metrics.observe("draft.build_ms", (time.perf_counter() - started) * 1000, op=fn.__name__)
+
+    return await asyncio.get_running_loop().run_in_executor(_draft_executor, timed)
+
+
+@lru_cache(maxsize=None)
+def shared_drafter(template_path: str = TEMPLATE_PATH) -> DraftingAgent:
+    """One agent per template for the whole process, built on first use."""
+    return DraftingAgent(template_path)
@@ -1,95 +1,451 @@
-import openai
-import pdfplumber
-import io
+import asyncio
 import json
 import os
-from typing import Dict, Any
+import copy
+import time
+import logging
+from typing import Dict, Any, Optional
+from core.cache import SizedLRUCache
+from core.llm import LLMUnavailable, chat_completion, configured_api_key, get_client
+from core.metrics import StageTimer, add_count, current_timer, metrics, stage
+from agents.layout_extractor import LayoutExtractor
+from agents.extraction_validation import TAXMATH_CHECK_FIELDS, form_tax_year, taxmath_checks, validate_extraction
+from core.tax_math import TaxMath
+from agents.prompt_compaction import PAGE_BREAK, PAGE_HEADER_RE, compact_text, count_tokens
+from core.pdf_utils import PdfSource, extract_relevant_pages_async
+
+EXTRACTION_MODEL = "gpt-4o"  # Recommended for high-accuracy extraction
+# Tiered routing: the fast model answers first; its output escalates to
+# EXTRACTION_MODEL only when it fails schema or arithmetic validation
+EXTRACTION_FAST_MODEL = os.getenv("EXTRACTION_FAST_MODEL", "gpt-4o-mini")
+EXTRACTION_ROUTING = os.getenv("EXTRACTION_ROUTING", "true").lower() in ("1", "true", "yes")
+# Cross-check lines 11/15/24 against TaxMath and re-read only inconsistent fields
+EXTRACTION_VERIFY = os.getenv("EXTRACTION_VERIFY", "true").lower() in ("1", "true", "yes")
+# Bump whenever the prompt or post-processing changes; cached results are keyed on it
+PROMPT_VERSION = "1040-v4"
+
+SYSTEM_PROMPT = "You are a professional Tax Data Extraction Agent. You provide high-accuracy JSON data from tax documents."
+
+FIELD_INSTRUCTIONS = {
+    "filing_status": "(e.g., 'Single', 'Married filing jointly')",
+    "dependents_count": "(Count of individuals in the Dependents table on Page 1)",
+    "wages": "(Line 1z)",
+    "tax_exempt_interest": "(Line 2a)",
+    "taxable_interest": "(Line 2b)",
+    "ordinary_dividends": "(Line 3b)",
+    "capital_gain_or_loss": "(Line 7)",
+    "total_income": "(Line 9)",
+    "adjustments_to_income": "(Line 10)",
+    "agi": "(Line 11)",
+    "deduction_type": "(Check Line 12. If the box 'Itemized deductions (from Schedule A)' is checked, return 'Itemized'. Otherwise, return 'Standard'.)",
+    "total_deductions": "(The dollar amount on Line 12)",
+    "taxable_income": "(Line 15)",
+    "child_tax_credit": "(Line 19)",
+    "total_tax": "(Line 24)",
+    "refund_amount": "(Line 34)",
+    "owed_amount": "(Line 37)",
+    "other_income": "(Line 8)",
+    "other_income_description": "(If Line 8 > 0, describe the source from Schedule 1, e.g., 'Gambling', 'State Refund', 'Business Income/Loss', 'Rental Income', 'Unemployment Compensation', 'Hobby Income')",
+    "qbi_deduction": "(Line 13)",
+    "self_employment_tax": "(Line 23 or Schedule 2, Line 4)",
+    "schedule_2_total": "(Line 17)",
+    "schedule_3_total": "(Line 20)",
+    "w2_withholding": "(Line 25a)",
+    "withholding_1099": "(Line 25b)",
+    "estimated_tax_payments": "(Line 26)",
+}
+
+FIELD_GROUPS = [
+    ("FIELDS TO EXTRACT:", [
+        "filing_status", "dependents_count", "wages", "tax_exempt_interest", "taxable_interest",
+        "ordinary_dividends", "capital_gain_or_loss", "total_income", "adjustments_to_income", "agi",
+        "deduction_type", "total_deductions",
+        "taxable_income", "child_tax_credit", "total_tax", "refund_amount", "owed_amount",
+    ]),
+    ("SPECIAL CATEGORIES (Return null if value is 0.0 or not present):", [
+        "other_income", "other_income_description", "qbi_deduction",
+        "self_employment_tax", "schedule_2_total", "schedule_3_total",
+    ]),
+    ("PAYMENTS:", ["w2_withholding", "withholding_1099", "estimated_tax_payments"]),
+]
+ALL_FIELDS = [f for _, group in FIELD_GROUPS for f in group]
+
+# Sectioned mode: independent field groups extracted concurrently, each from
+# the page types that carry them
+EXTRACTION_SECTIONS = {
+    "household": ["filing_status", "dependents_count"],
+    "income": [
+        "wages", "tax_exempt_interest", "taxable_interest", "ordinary_dividends",
+        "capital_gain_or_loss", "other_income", "other_income_description",
+        "total_income", "adjustments_to_income", "agi",
+    ],
+    "deductions_tax": [
+        "deduction_type", "total_deductions", "qbi_deduction", "taxable_income",
+        "schedule_2_total", "child_tax_credit", "schedule_3_total", "self_employment_tax", "total_tax",
+    ],
+    "payments": ["w2_withholding", "withholding_1099", "estimated_tax_payments", "refund_amount", "owed_amount"],
+}
+FIELD_SECTION = {f: name for name, fields in EXTRACTION_SECTIONS.items() for f in fields}
+SECTION_PAGE_TYPES = {
+    "household": {"1040_p1"},
+    "income": {"1040_p1", "schedule_1"},
+    "deductions_tax": {"1040_p1", "1040_p2", "schedule_2", "schedule_3"},
+    "payments": {"1040_p2", "w2"},
+}
+EXTRACTION_SECTIONED = os.getenv("EXTRACTION_SECTIONED", "false").lower() in ("1", "true", "yes")
+# Send the LLM only line labels with amounts (see agents/prompt_compaction.py)
+EXTRACTION_COMPACT_PROMPT = os.getenv("EXTRACTION_COMPACT_PROMPT", "true").lower() in ("1", "true", "yes")
+
+# Shared across requests: re-uploads of the same PDF (second device, retry,
+# spouse's account) skip the parse and the LLM call
+EXTRACTION_CACHE_MB = float(os.getenv("EXTRACTION_CACHE_MB", "64"))
+extraction_cache = SizedLRUCache(max_bytes=int(EXTRACTION_CACHE_MB * 1024 * 1024))
+
+logger = logging.getLogger(__name__)
+
 
 class ExtractionAgent:
-    def __init__(self, api_key: str = None):
-        # Uses provided key or looks for OPENAI_API_KEY environment variable
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+    def __init__(self, api_key: str = None, use_layout: bool = True, sectioned: bool = None,
+                 compact: bool = None, routing: bool = None, verify: bool = None):
+        # Uses provided key, OPENAI_API_KEY, or a placeholder for OPENAI_BASE_URL
+        self.api_key = api_key or configured_api_key()
         if not self.api_key:
             raise ValueError("OpenAI API Key not found. Please set OPENAI_API_KEY.")
-        self.client = openai.AsyncOpenAI(api_key=self.api_key)
+        self.client = get_client(self.api_key)
+        self.layout = LayoutExtractor() if use_layout else None
+        self.sectioned = EXTRACTION_SECTIONED if sectioned is None else sectioned
+        self.compact = EXTRACTION_COMPACT_PROMPT if compact is None else compact
+        routing = EXTRACTION_ROUTING if routing is None else routing
+        self.models = (EXTRACTION_FAST_MODEL, EXTRACTION_MODEL) if routing else (EXTRACTION_MODEL,)
+        self.verify = EXTRACTION_VERIFY if verify is None else verify
+        self.tax_math = TaxMath()
 
-    async def run(self, pdf_bytes: bytes) -> Dict[str, Any]:
+    async def run(self, pdf_source: PdfSource) -> Dict[str, Any]:
         """
         Orchestrates the extraction: PDF text parsing followed by LLM structuring.
+        `pdf_source` is the PDF bytes or a readable, seekable file handle.
         """
-        # 1. Physical Text Extraction (Focus on Page 1 & 2 of the 1040)
-        raw_text = ""
+        return (await self.extract(pdf_source))["data"]
+
+    async def extract(self, pdf_source: PdfSource, sha256: Optional[str] = None,
+                      tax_year: Optional[int] = None) -> Dict[str, Any]:
+        """Like run(), plus how the data was read: cache_hit, method ("layout",
+        "llm" or "layout_fallback"), model, validation, verification and timings.
+        `sha256` enables the extraction cache; `tax_year` is the record's."""
+        # Stages go on the caller's StageTimer when one is current, so a route
+        # can add its own; otherwise extract() times itself and publishes
+        # extraction.* metrics
+        timer = current_timer()
+        owns_timer = timer is None
+        timer = timer or StageTimer()
+        with timer:
+            result = await self._extract(pdf_source, sha256, tax_year)
+        result["timings"] = timer.as_dict()
+        metrics.incr("extraction.requests", method=result["method"], cache_hit=result["cache_hit"])
+        if owns_timer:
+            timer.publish("extraction")
+        return result
+
+    async def _extract(self, pdf_source: PdfSource, sha256: Optional[str], tax_year: Optional[int]) -> Dict[str, Any]:
+        data_key = ("data", sha256, PROMPT_VERSION, self.models, self.sectioned, self.compact, self.verify, tax_year)
+        text_key = ("text", sha256, self.layout is not None)  # entries carry the layout read
+        if sha256:
+            cached = extraction_cache.get(data_key)
+            if cached is not None:
+                return {
+                    **cached, "data": copy.deepcopy(cached["data"]),
+                    "cache_hit": True, "parse_stats": None, "prompt_stats": None,
+                }
+
+        # A prompt/model bump still reuses the parsed text (and layout read) of a known PDF
+        parse_stats = None
+        parsed_text = extraction_cache.get(text_key) if sha256 else None
+        if parsed_text is not None:
+            raw_text, layout = parsed_text["raw_text"], copy.deepcopy(parsed_text["layout"])
+        else:
+            with stage("parse"):
+                parsed = await self._parse(pdf_source)
+            if "status" in parsed:  # parse error
+                return {
+                    "data": parsed, "raw_text": None, "cache_hit": False,
+                    "method": None, "confidence": None, "parse_stats": None, "prompt_stats": None,
+                    "prompt_version": None, "model": None, "validation": None, "verification": None,
+                }
+            raw_text, parse_stats = parsed["raw_text"], parsed["stats"]
+            add_count("pages", parse_stats["page_count"])
+            add_count("parsed_pages", parse_stats["parsed_pages"])
+
+            # 2. Clean e-filed returns are read straight off the form grid; the
+            # LLM only runs when required fields fall below the confidence threshold
+            with stage("layout"):
+                layout = self.layout.extract(parsed["words"]) if self.layout else None
+            if sha256:
+                size = len(raw_text.encode()) + len(json.dumps(layout))
+                extraction_cache.put(text_key, {"raw_text": raw_text, "layout": copy.deepcopy(layout)}, size)
+
+        if layout and layout["confident"]:
+            llm = {"data": layout["data"], "prompt_stats": None, "model": None, "validation": None,
+                   "verification": None}
+            method = "layout"
+        else:
+            llm, method = await self._llm_extract(raw_text, tax_year), "llm"
+            if llm["data"].get("reason") == "llm_unavailable" and layout:
+                # OpenAI is down or out of time: keep the partial layout read
+                # rather than failing the upload. Not cached, and stored with
+                # no prompt version so /reextract picks it up later.
+                logger.warning(f"[extract] {llm['data']['message']}; using the layout reader's partial result")
+                metrics.incr("extraction.layout_fallbacks")
+                llm = {**llm, "data": layout["data"]}
+                method = "layout_fallback"
+        data = llm["data"]
+
+        result = {
+            "data": data,
+            "raw_text": raw_text,
+            "cache_hit": False,
+            "method": method,
+            "confidence": layout["confidence"] if layout else None,
+            "parse_stats": parse_stats,
+            "prompt_stats": llm["prompt_stats"],
+            "prompt_version": {"llm": PROMPT_VERSION, "layout": "layout"}.get(method),
+            "model": llm["model"],
+            "validation": llm["validation"],
+            "verification": llm["verification"],
+        }
+        if sha256 and data.get("status") != "error" and method != "layout_fallback":
+            size = len(raw_text.encode()) + len(json.dumps(data)) + len(json.dumps(result["confidence"]))
+            extraction_cache.put(data_key, {**result, "data": copy.deepcopy(data)}, size)
+        return result
+
+    async def extract_from_text(self, raw_text: str, tax_year: Optional[int] = None) -> Dict[str, Any]:
+        """Re-run the LLM stage on previously parsed text (no PDF, no cache).
+        Returns {"data", "method", "prompt_stats", "prompt_version", "model",
+        "validation", "verification"}."""
+        return {**await self._llm_extract(raw_text, tax_year), "method": "llm", "prompt_version": PROMPT_VERSION}
+
+    async def _llm_extract(self, raw_text: str, tax_year: Optional[int] = None) -> Dict[str, Any]:
+        """Compact the text, then walk the model tiers until an answer validates
+        (the last tier's answer is kept either way)."""
+        with stage("compact"):
+            prompt_text = compact_text(raw_text) if self.compact else raw_text
+            prompt_stats = {"raw_tokens": count_tokens(raw_text), "prompt_tokens": count_tokens(prompt_text)}
+        logger.info(f"[extract] prompt text {prompt_stats['raw_tokens']} -> {prompt_stats['prompt_tokens']} tokens")
+
+        with stage("llm"):
+            for tier, model in enumerate(self.models):
+                start = time.perf_counter()
+                with stage(f"llm:{model}"):
+                    data = await self._structure(prompt_text, model)
+                metrics.observe("extraction.tier_ms", (time.perf_counter() - start) * 1000, model=model)
+                metrics.incr("extraction.tier_attempts", model=model)
+                problems = validate_extraction(data, ALL_FIELDS)
+                if not problems or tier == len(self.models) - 1 or data.get("reason") == "llm_unavailable":
+                    break
+                metrics.incr("extraction.escalations", model=model)
+                logger.info(f"[extract] {model} failed validation, escalating: "
+                            + "; ".join(p["message"] for p in problems[:3]))
+
+        verification = None
+        if self.verify and data.get("status") != "error":
+            with stage("verify"):
+                # The year printed on the form wins over the record's
+                year = form_tax_year(raw_text) or tax_year
+                data, verification = await self._verify(data, prompt_text, year)
+        return {
+            "data": data, "prompt_stats": prompt_stats, "model": model,
+            "validation": problems, "verification": verification,
+        }
+
+    async def _verify(self, data: Dict[str, Any], prompt_text: str, tax_year: Optional[int] = None):
+        """Recompute AGI, taxable income and total tax with TaxMath from the
+        extracted inputs, on `tax_year`'s parameters (lines the year has no
+        parameters for are not checked). When a line disagrees, only the fields behind it are
+        re-read, in one small prompt on the strong model. Returns the
+        (possibly corrected) data and {"checks", "requeried_fields",
+        "corrected", "consistent", "extra_prompt_tokens", "extra_completion_tokens"}."""
+        checks = taxmath_checks(data, self.tax_math, tax_year)
+        failed = [line for line, check in checks.items() if not check["ok"]]
+        verification = {
+            "checks": checks, "requeried_fields": [], "corrected": {},
+            "consistent": not failed, "extra_prompt_tokens": 0, "extra_completion_tokens": 0,
+        }
+        metrics.incr("extraction.verifications", consistent=not failed)
+        if not failed:
+            return data, verification
+
+        fields = []
+        for line in failed:
+            fields += [f for f in TAXMATH_CHECK_FIELDS[line] if f not in fields]
+        # The recomputed figure is not given: TaxMath's simplified return
+        # must not steer the model's re-read
+        notes = [
+            f"- {line} {FIELD_INSTRUCTIONS[line]} was read as {checks[line]['extracted']:,.0f}, which "
+            f"does not agree with the other values read."
+            for line in failed
+        ]
+        prompt = "\n".join(
+            ["Some values read from this return are inconsistent. Re-read ONLY the fields below "
+             "from the text, exactly as printed.", *notes, "", _build_prompt(prompt_text, fields)]
+        )
+        outer = current_timer()
+        with StageTimer() as requery:  # isolates the re-query's token usage
+            try:
+                answer = await self._complete_json(prompt, EXTRACTION_MODEL)
+            except Exception as e:
+                logger.warning(f"[extract] verification re-query failed: {e}")
+                answer = {}
+        extra_prompt = requery.counts.get("prompt_tokens", 0)
+        extra_completion = requery.counts.get("completion_tokens", 0)
+        if outer is not None:
+            for name, value in requery.counts.items():
+                outer.add_count(name, value)
+
+        corrected = {}
+        for field in fields:
+            if field in answer and answer[field] != data.get(field):
+                corrected[field] = {"from": data.get(field), "to": answer[field]}
+                data[field] = answer[field]
+        data = _post_process(data)
+        checks = taxmath_checks(data, self.tax_math, tax_year)
+        verification.update(
+            checks=checks,
+            requeried_fields=fields,
+            corrected=corrected,
+            consistent=all(check["ok"] for check in checks.values()),
+            extra_prompt_tokens=extra_prompt,
+            extra_completion_tokens=extra_completion,
+        )
+        metrics.incr("extraction.requeries")
+        metrics.incr("extraction.requery_prompt_tokens", extra_prompt)
+        metrics.incr("extraction.corrected_fields", len(corrected))
+        logger.info(f"[extract] TaxMath mismatch on {failed}; re-read {len(fields)} fields, "
+                    f"corrected {sorted(corrected)} for {extra_prompt} extra prompt tokens")
+        return data, verification
+
+    async def _parse(self, pdf_source: PdfSource) -> Dict[str, Any]:
+        """{"raw_text", "words", "stats"} for the relevant pages, or an error dict."""
+        # 1. Physical Text Extraction: pages are fingerprinted first and only
+        # the 1040, Schedule 1/2/3 and W-2 pages are fully parsed, in parallel
+        # on the bounded PDF pool so the event loop stays free.
         try:
-            with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-                # We extract the first 3 pages to catch any Schedule 1/2/3 summaries
-                for page in pdf.pages[:3]:
-                    text = page.extract_text()
-                    if text:
-                        raw_text += text + "\n--- PAGE BREAK ---\n"
+            parsed = await extract_relevant_pages_async(pdf_source, with_words=self.layout is not None)
         except Exception as e:
             return {"status": "error", "reason": "pdf_parsing_failed", "message": str(e)}
+        raw_text = "".join(
+            f"[PAGE {number}: {page_type}]\n{text}{PAGE_BREAK}"
+            for number, page_type, text in zip(parsed["page_numbers"], parsed["page_types"], parsed["pages"])
+            if text
+        )
 
         if not raw_text.strip():
             return {"status": "error", "reason": "no_text_found", "message": "PDF appears to be a scan/image."}
 
-        # 2. AI Structuring Prompt
-        # This prompt is tuned to handle the conditional visibility requirements
-        prompt = f"""
-        Extract the following values from this IRS Form 1040 and its summaries.
-        Return ONLY a JSON object. For missing numeric values, use 0.0 unless specified otherwise.
-
-        FIELDS TO EXTRACT:
-        - filing_status: (e.g., 'Single', 'Married filing jointly')
-        - dependents_count: (Count of individuals in the Dependents table on Page 1)
-        - wages: (Line 1z)
-        - tax_exempt_interest: (Line 2a)
-        - taxable_interest: (Line 2b)
-        - ordinary_dividends: (Line 3b)
-        - capital_gain_or_loss: (Line 7)
-        - agi: (Line 11)
-        - deduction_type: (Check Line 12. If the box 'Itemized deductions (from Schedule A)' is checked, return 'Itemized'. Otherwise, return 'Standard'.)
-        - total_deductions: (The dollar amount on Line 12)
-        - taxable_income: (Line 15)
-        - child_tax_credit (Line 19)
-        - total_tax: (Line 24)
-        - refund_amount: (Line 34)
-        - owed_amount: (Line 37)
-        
-        SPECIAL CATEGORIES (Return null if value is 0.0 or not present):
-        - other_income: (Line 8)
-        - other_income_description: (If Line 8 > 0, describe the source from Schedule 1, e.g., 'Gambling', 'State Refund', 'Business Income/Loss', 'Rental Income', 'Unemployment Compensation', 'Hobby Income')
-        - qbi_deduction: (Line 13)
-        - self_employment_tax: (Line 23 or Schedule 2, Line 4)
-        - schedule_2_total: (Line 17)
-        - schedule_3_total: (Line 20)
-        
-        PAYMENTS:
-        - w2_withholding: (Line 25a)
-        - withholding_1099: (Line 25b)
-        - estimated_tax_payments: (Line 26)
-
-        TEXT TO PARSE:
-        {raw_text}
-        """
+        # The layout reader wants the two 1040 pages, in order
+        words = None
+        if parsed["words"] is not None:
+            by_type = {}
+            for page_type, page_words in zip(parsed["page_types"], parsed["words"]):
+                by_type.setdefault(page_type, page_words)
+            if "1040_p1" in by_type:
+                words = [by_type["1040_p1"], by_type.get("1040_p2", [])]
+            else:
+                words = parsed["words"]
+        return {"raw_text": raw_text, "words": words, "stats": parsed["stats"]}
 
+    async def _structure(self, raw_text: str, model: str = EXTRACTION_MODEL) -> Dict[str, Any]:
+        """LLM structuring of the parsed text into the extraction JSON."""
+        if self.sectioned:
+            return await self._structure_sections(raw_text, model)
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4o", # Recommended for high-accuracy extraction
-                messages=[
-                    {"role": "system", "content": "You are a professional Tax Data Extraction Agent. You provide high-accuracy JSON data from tax documents."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"}
-            )
-            
-            extracted_data = json.loads(response.choices[0].message.content)
-            
-            # Post-processing: Ensure 'null' logic is strictly enforced for UI conditional rendering
-            for field in ["self_employment_tax", "qbi_deduction", "schedule_2_total", "schedule_3_total"]:
-                if extracted_data.get(field) == 0.0:
-                    extracted_data[field] = None
-            
-            return extracted_data
-
+            extracted_data = await self._complete_json(_build_prompt(raw_text, ALL_FIELDS), model)
+        except LLMUnavailable as e:
+            return {"status": "error", "reason": "llm_unavailable", "message": str(e)}
         except Exception as e:
-            return {"status": "error", "reason": "llm_extraction_failed", "message": str(e)}
\ No newline at end of file
+            return {"status": "error", "reason": "llm_extraction_failed", "message": str(e)}
+        return _post_process(extracted_data)
+
+    async def _structure_sections(self, raw_text: str, model: str = EXTRACTION_MODEL) -> Dict[str, Any]:
+        """One smaller, concurrent LLM call per 1040 section; latency is the
+        slowest section rather than one prompt carrying every field."""
+        names = list(EXTRACTION_SECTIONS)
+        prompts = [
+            _build_prompt(_section_text(raw_text, SECTION_PAGE_TYPES[name]), EXTRACTION_SECTIONS[name])
+            for name in names
+        ]
+        results = await asyncio.gather(*(self._complete_json(p, model) for p in prompts), return_exceptions=True)
+
+        errors = [f"{name}: {r}" for name, r in zip(names, results) if isinstance(r, Exception)]
+        if errors:
+            unavailable = any(isinstance(r, LLMUnavailable) for r in results)
+            reason = "llm_unavailable" if unavailable else "llm_extraction_failed"
+            return {"status": "error", "reason": reason, "message": "; ".join(errors)}
+        return _post_process(_merge_sections(dict(zip(names, results))))
+
+    async def _complete_json(self, prompt: str, model: str = EXTRACTION_MODEL) -> Dict[str, Any]:
+        response = await chat_completion(
+            self.client,
+            model=model,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            response_format={"type": "json_object"}
+        )
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            add_count("prompt_tokens", usage.prompt_tokens)
+            add_count("completion_tokens", usage.completion_tokens)
+            metrics.incr("llm.prompt_tokens", usage.prompt_tokens, model=model)
+            metrics.incr("llm.completion_tokens", usage.completion_tokens, model=model)
+        add_count("llm_calls", 1)
+        with stage("json_parse"):
+            return json.loads(response.choices[0].message.content)
+
+
+def _build_prompt(raw_text: str, fields) -> str:
+    # This prompt is tuned to handle the conditional visibility requirements
+    lines = [
+        "Extract the following values from this IRS Form 1040 and its summaries.",
+        "Return ONLY a JSON object. For missing numeric values, use 0.0 unless specified otherwise.",
+    ]
+    for heading, group in FIELD_GROUPS:
+        wanted = [f for f in group if f in fields]
+        if wanted:
+            lines.append("")
+            lines.append(heading)
+            lines.extend(f"- {f}: {FIELD_INSTRUCTIONS[f]}" for f in wanted)
+    lines += ["", "TEXT TO PARSE:", raw_text]
+    return "\n".join(lines)
+
+
+def _section_text(raw_text: str, page_types: set) -> str:
+    """Only the pages a section needs; the whole text when pages are untyped."""
+    kept = []
+    for chunk in raw_text.split(PAGE_BREAK):
+        header = PAGE_HEADER_RE.match(chunk)
+        if header and header.group(2) in page_types:
+            kept.append(chunk)
+    return "".join(c + PAGE_BREAK for c in kept) if kept else raw_text
+
+
+def _merge_sections(partials: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Each field comes from the section that owns it. If the owner left a
+    field empty and another section returned a non-zero value for it, that
+    value is used instead. Any other key a section returns is ignored."""
+    merged: Dict[str, Any] = {}
+    for field in ALL_FIELDS:
+        owner = FIELD_SECTION[field]
+        value = partials[owner].get(field)
+        if value in (None, 0, 0.0, ""):
+            others = [p.get(field) for name, p in partials.items() if name != owner]
+            value = next((v for v in others if v not in (None, 0, 0.0, "")), value)
+        merged[field] = value
+    return merged
+
+
+def _post_process(extracted_data: Dict[str, Any]) -> Dict[str, Any]:
+    # Post-processing: Ensure 'null' logic is strictly enforced for UI conditional rendering
+    for field in ["self_employment_tax", "qbi_deduction", "schedule_2_total", "schedule_3_total"]:
+        if extracted_data.get(field) == 0.0:
+            extracted_data[field] = None
+    return extracted_data
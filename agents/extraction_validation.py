@@ -0,0 +1,170 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from agents.layout_extractor import STANDARD_DEDUCTIONS
+
+# Checks on LLM extraction output, used to decide whether the fast model's
+# answer can be kept or the extraction escalates to the stronger model.
+# Each problem is {"check", "fields", "message"}; an empty list means valid.
+
+FILING_STATUSES = {
+    "single", "married filing jointly", "married filing separately",
+    "head of household", "qualifying surviving spouse",
+}
+DEDUCTION_TYPES = {"Standard", "Itemized"}
+TEXT_FIELDS = {"filing_status", "deduction_type", "other_income_description"}
+INT_FIELDS = {"dependents_count"}
+
+# Forms are filled in whole dollars; allow rounding on each side of an identity
+ARITHMETIC_TOLERANCE = 2.0
+
+
+def _problem(check: str, fields: List[str], message: str) -> Dict[str, Any]:
+    return {"check": check, "fields": fields, "message": message}
+
+
+def _number(value) -> float:
+    return float(value or 0.0)
+
+
+def schema_problems(data: Dict[str, Any], fields: List[str]) -> List[Dict[str, Any]]:
+    problems = []
+    for field in fields:
+        if field not in data:
+            problems.append(_problem("schema", [field], f"{field} is missing"))
+            continue
+        value = data[field]
+        if field in TEXT_FIELDS:
+            if value is not None and not isinstance(value, str):
+                problems.append(_problem("schema", [field], f"{field} should be text, got {value!r}"))
+        elif field in INT_FIELDS:
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                problems.append(_problem("schema", [field], f"{field} should be a count, got {value!r}"))
+        elif value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            problems.append(_problem("schema", [field], f"{field} should be a number, got {value!r}"))
+
+    status = data.get("filing_status")
+    if isinstance(status, str) and status.strip().lower() not in FILING_STATUSES:
+        problems.append(_problem("schema", ["filing_status"], f"unknown filing status {status!r}"))
+    if "deduction_type" in data and data["deduction_type"] not in DEDUCTION_TYPES:
+        problems.append(_problem("schema", ["deduction_type"], f"unknown deduction type {data['deduction_type']!r}"))
+    return problems
+
+
+def arithmetic_problems(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """1040 identities: line 11 = line 9 - line 10, and
+    line 15 = max(0, line 11 - line 12 - line 13); refund and amount owed
+    are mutually exclusive."""
+    problems = []
+    try:
+        agi = _number(data.get("agi"))
+        if "total_income" in data:
+            expected = _number(data.get("total_income")) - _number(data.get("adjustments_to_income"))
+            if abs(agi - expected) > ARITHMETIC_TOLERANCE:
+                problems.append(_problem(
+                    "agi", ["agi", "total_income", "adjustments_to_income"],
+                    f"agi {agi:,.0f} != total income - adjustments {expected:,.0f}",
+                ))
+
+        expected = max(0.0, agi - _number(data.get("total_deductions")) - _number(data.get("qbi_deduction")))
+        taxable = _number(data.get("taxable_income"))
+        if abs(taxable - expected) > ARITHMETIC_TOLERANCE:
+            problems.append(_problem(
+                "taxable_income", ["taxable_income", "agi", "total_deductions", "qbi_deduction"],
+                f"taxable income {taxable:,.0f} != agi - deductions - qbi {expected:,.0f}",
+            ))
+
+        if _number(data.get("refund_amount")) > 0 and _number(data.get("owed_amount")) > 0:
+            problems.append(_problem(
+                "balance", ["refund_amount", "owed_amount"], "both a refund and an amount owed",
+            ))
+    except (TypeError, ValueError):
+        pass  # non-numeric values are reported by schema_problems
+    return problems
+
+
+def validate_extraction(data: Dict[str, Any], fields: List[str]) -> List[Dict[str, Any]]:
+    if data.get("status") == "error":
+        return [_problem("error", [], data.get("message", "extraction failed"))]
+    return schema_problems(data, fields) + arithmetic_problems(data)
+
+
+# --- TaxMath cross-check ---
+# TaxMath runs on a simplified return (no pension, IRA or Social Security
+# lines, ordinary rates on all income), so each check allows
+# max(absolute, relative * expected) before it calls a value inconsistent.
+# AGI is year-independent; taxable income needs the year's standard deduction
+# (STANDARD_DEDUCTIONS); total tax needs TaxMath's own brackets and credits,
+# so it is only checked on returns for TAXMATH_TAX_YEAR.
+TAXMATH_TAX_YEAR = 2025
+TAXMATH_TOLERANCES = {
+    "agi": (100.0, 0.02),
+    "taxable_income": (100.0, 0.05),
+    "total_tax": (150.0, 0.15),
+}
+# "For the year Jan. 1–Dec. 31, 2024" under the 1040 title; the title's own
+# year moves around depending on the text extractor
+FORM_YEAR_RE = re.compile(r"Dec\. 31,\s*(20\d\d)\b|Income Tax Return\s+(20\d\d)\b")
+# The extracted value checked plus the inputs it is computed from: the fields
+# re-read when that check fails
+TAXMATH_CHECK_FIELDS = {
+    "agi": ["agi", "wages", "taxable_interest", "ordinary_dividends", "capital_gain_or_loss",
+            "other_income", "adjustments_to_income"],
+    "taxable_income": ["taxable_income", "total_deductions", "qbi_deduction"],
+    "total_tax": ["total_tax", "child_tax_credit", "schedule_2_total", "schedule_3_total", "self_employment_tax"],
+}
+
+
+def form_tax_year(raw_text: str) -> Optional[int]:
+    """The tax year printed in the 1040 header, if the text has one."""
+    match = FORM_YEAR_RE.search(raw_text or "")
+    return int(match.group(1) or match.group(2)) if match else None
+
+
+def taxmath_expected(data: Dict[str, Any], tax_math, tax_year: Optional[int] = None) -> Dict[str, float]:
+    """Lines 11, 15 and 24 recomputed by TaxMath from the extracted inputs,
+    for the lines `tax_year` has parameters for (see above)."""
+    result = tax_math.run_reconciliation({
+        "filing_status": data.get("filing_status") or "Single",
+        "wages": _number(data.get("wages")),
+        "other_income": _number(data.get("other_income")),
+        "taxable_interest": _number(data.get("taxable_interest")),
+        "ordinary_dividends": _number(data.get("ordinary_dividends")),
+        "capital_gain_or_loss": _number(data.get("capital_gain_or_loss")),
+        "qbi_deduction": _number(data.get("qbi_deduction")),
+        "total_deductions": _number(data.get("total_deductions")),
+        "dependents_count": data.get("dependents_count") or 0,
+        "child_tax_credit": data.get("child_tax_credit"),
+    })
+    # Line 24 = tax after the child tax credit - other credits (line 20)
+    # + Schedule 2 amounts (line 17) + other taxes (line 23)
+    total_tax = (
+        max(0.0, result["total_tax_2025"] - _number(data.get("schedule_3_total")))
+        + _number(data.get("schedule_2_total"))
+        + _number(data.get("self_employment_tax"))
+    )
+    agi = result["agi_2025"] - _number(data.get("adjustments_to_income"))
+    expected = {"agi": agi}
+    standard = STANDARD_DEDUCTIONS.get(str(tax_year), {}).get(data.get("filing_status") or "Single")
+    if standard is not None:
+        deduction = max(_number(data.get("total_deductions")), standard)
+        expected["taxable_income"] = max(0.0, agi - deduction - _number(data.get("qbi_deduction")))
+    if tax_year == TAXMATH_TAX_YEAR:
+        expected["total_tax"] = round(total_tax, 2)
+    return expected
+
+
+def taxmath_checks(data: Dict[str, Any], tax_math, tax_year: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+    """{line: {"extracted", "expected", "ok"}} for AGI and, when `tax_year`
+    allows, taxable income and total tax."""
+    try:
+        expected = taxmath_expected(data, tax_math, tax_year)
+    except (TypeError, ValueError):
+        return {}  # non-numeric inputs: schema validation reports those
+    checks = {}
+    for field, value in expected.items():
+        absolute, relative = TAXMATH_TOLERANCES[field]
+        extracted = _number(data.get(field))
+        tolerance = max(absolute, relative * abs(value))
+        checks[field] = {"extracted": extracted, "expected": value, "ok": abs(extracted - value) <= tolerance}
+    return checks
@@ -1,7 +1,7 @@
-import os
 import json
 from typing import List, Dict, Any, Optional
 from core.tax_math import TaxMath
+from core.llm import configured_api_key
 
 # 2025 contribution limits
 MAX_401K = 23500
@@ -13,7 +13,7 @@ MAX_HSA_FAMILY = 8550
 class OptimizationAgent:
     def __init__(self, math_engine: TaxMath = None, api_key: str = None):
         self.math = math_engine or TaxMath()
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.api_key = api_key or configured_api_key()
 
     def analyze(self, tax_data: dict) -> Dict[str, Any]:
         baseline = self.math.run_reconciliation(tax_data)
@@ -148,8 +148,8 @@ class OptimizationAgent:
             return result
 
         try:
-            import openai
-            client = openai.AsyncOpenAI(api_key=self.api_key)
+            from core.llm import chat_completion, get_client
+            client = get_client(self.api_key)
 
             recs_text = "\n".join(
                 f"- {r['strategy']}: saves ${r['tax_savings']:,.2f} (costs ${r['annual_cost']:,.2f}/yr)"
@@ -166,7 +166,8 @@ Here are the optimization strategies we identified:
 
 Write a 3-4 sentence personalized summary. Be encouraging and specific about the top 2-3 actions. Mention dollar amounts. Do NOT give legal advice or say "consult a tax professional"."""
 
-            response = await client.chat.completions.create(
+            response = await chat_completion(
+                client,
                 model="gpt-4o-mini",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=200,
@@ -0,0 +1,121 @@
+import re
+from typing import List
+
+# Pre-LLM text compaction. The parsed 1040 text is mostly IRS boilerplate
+# (instructions, dot leaders, signature and preparer blocks); the model only
+# needs the line labels that carry an amount, plus the few lines that answer
+# non-numeric fields (filing status, dependents, other income source).
+
+PAGE_BREAK = "\n--- PAGE BREAK ---\n"
+PAGE_HEADER_RE = re.compile(r"\[PAGE (\d+): (\w+)\]")
+
+DOT_LEADER_RE = re.compile(r"(?:\s*\.){2,}(?=\s|$)")
+LABEL_RE = re.compile(r"^\d{1,2}[a-z]?$")
+# Printed amounts usually carry a thousands separator or the trailing/decimal
+# point tax software prints ("185.", "72,000."). Some software prints bare
+# integers ("72000"); those count only as the last label/amount pair on a line,
+# not after "line"/"lines" (line references: "Schedule 1, line 10 8") and
+# not when they could be a label themselves (adjacent labels: "13b 14").
+AMOUNT_RE = re.compile(r"^\(?-?\$?(?:\d{1,3}(?:,\d{3})+(?:\.\d{0,2})?|\d+\.\d{0,2})\)?$")
+BARE_AMOUNT_RE = re.compile(r"^\(?-?\$?\d+\)?$")
+LINE_REFERENCE_WORDS = {"line", "lines"}
+LABEL_AMOUNT_RE = re.compile(r"^\d{1,2}[a-z]? \S+$")  # a label_amounts() result
+
+# Lines kept whole because they answer fields that are not amounts: filing
+# status checkboxes and the dependents table (page 1), the line 12 deduction type
+FILING_LINE_RE = re.compile(
+    r"Filing Status|Married filing|Head of household|Qualifying surviving|\(1\) First name|\(2\) Last name"
+)
+ITEMIZED_LINE_RE = re.compile(r"itemized deductions", re.IGNORECASE)
+
+BOILERPLATE_RE = re.compile(
+    r"Department of the Treasury|OMB No\.|IRS Use Only|Paperwork Reduction Act|Cat\. No\."
+    r"|www\.irs\.gov|see (separate )?instructions\.?$|Under penalties of perjury"
+    r"|Preparer|Designee|signature|Do not write or staple|Keep a copy",
+    re.IGNORECASE,
+)
+
+
+def _clean(line: str) -> str:
+    return " ".join(DOT_LEADER_RE.sub(" ", line).split())
+
+
+def _bare_amount_at_end(tokens: List[str], i: int) -> bool:
+    """tokens[i], tokens[i + 1] is a label and a bare-integer amount ending the line."""
+    return (
+        i + 2 == len(tokens)
+        and BARE_AMOUNT_RE.match(tokens[i + 1]) is not None
+        and not LABEL_RE.match(tokens[i + 1])
+        and (i == 0 or tokens[i - 1].rstrip(",").lower() not in LINE_REFERENCE_WORDS)
+    )
+
+
+def label_amounts(line: str) -> List[str]:
+    """'z Add lines 1a through 1h 1z 72,000.' -> ['1z 72,000.']"""
+    tokens = line.split()
+    return [
+        f"{tokens[i]} {tokens[i + 1]}"
+        for i in range(len(tokens) - 1)
+        if LABEL_RE.match(tokens[i]) and (AMOUNT_RE.match(tokens[i + 1]) or _bare_amount_at_end(tokens, i))
+    ]
+
+
+def _compact_form_page(lines: List[str], first_page: bool) -> List[str]:
+    out = []
+    for line in lines:
+        if ITEMIZED_LINE_RE.search(line) or (first_page and FILING_LINE_RE.search(line)):
+            out.append(line)
+        else:
+            out.extend(label_amounts(line))
+    return out
+
+
+def _compact_other_page(lines: List[str]) -> List[str]:
+    # Schedules and W-2s keep their descriptions (e.g. the Schedule 1 source of
+    # other income) but lose boilerplate and lines without any amount
+    return [
+        line for line in lines
+        if not BOILERPLATE_RE.search(line)
+        and (any(AMOUNT_RE.match(t) or BARE_AMOUNT_RE.match(t) for t in line.split())
+             or PAGE_HEADER_RE.match(line))
+    ]
+
+
+def compact_text(raw_text: str) -> str:
+    """Compact parsed PDF text for the extraction prompt. Page markers
+    ("[PAGE n: type]") and page breaks are preserved, so section page
+    selection works on the result; untyped text gets the generic treatment.
+    If the 1040 pages yield no line amounts at all (a format the rules do not
+    recognise), the raw text is returned rather than a prompt without numbers."""
+    pages = []
+    form_pages = form_amounts = 0
+    for chunk in raw_text.split(PAGE_BREAK):
+        lines = [line for line in (_clean(l) for l in chunk.splitlines()) if line]
+        if not lines:
+            continue
+        header = PAGE_HEADER_RE.match(lines[0])
+        if header and header.group(2).startswith("1040"):
+            body = [lines[0]] + _compact_form_page(lines[1:], header.group(2) == "1040_p1")
+            form_pages += 1
+            form_amounts += sum(1 for line in body[1:] if LABEL_AMOUNT_RE.match(line))
+        else:
+            body = _compact_other_page(lines)
+        pages.append("\n".join(body) + PAGE_BREAK)
+    if form_pages and not form_amounts:
+        return raw_text
+    return "".join(pages)
+
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")  # gpt-4o family
+except Exception:  # not installed, or the encoding file cannot be fetched offline
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Prompt tokens for the gpt-4o family; ~4 characters per token when
+    tiktoken is unavailable."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
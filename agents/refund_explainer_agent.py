@@ -1,6 +1,9 @@
-import os
+import json
+import hashlib
+from math import factorial
 from typing import Dict, Any, List
 from core.tax_math import TaxMath
+from core.llm import configured_api_key
 
 # Fields to walk in 1040 line-item order:
 # income -> structural -> deductions -> taxes -> credits -> payments
@@ -25,11 +28,17 @@ WATERFALL_FIELDS = [
     ("estimated_tax_payments", "estimated tax payments", "payment"),
 ]
 
+ATTRIBUTION_MODES = ("waterfall", "shapley")
+
+# Exact Shapley needs 2^k reconciliations; above this many changed fields
+# fall back to the waterfall walk.
+MAX_SHAPLEY_FIELDS = 12
+
 
 class RefundExplainerAgent:
     def __init__(self, math_engine: TaxMath = None, api_key: str = None):
         self.math = math_engine or TaxMath()
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.api_key = api_key or configured_api_key()
 
     @staticmethod
     def _record_to_recon_dict(record_data: dict) -> dict:
@@ -55,6 +64,12 @@ class RefundExplainerAgent:
             "deduction_type": record_data.get("deduction_type", "Standard"),
         }
 
+    @classmethod
+    def input_hash(cls, record_data: dict) -> str:
+        """Short fingerprint of the reconciliation inputs, for result caching."""
+        recon_input = cls._record_to_recon_dict(record_data)
+        return hashlib.sha256(json.dumps(recon_input, sort_keys=True).encode()).hexdigest()[:16]
+
     @staticmethod
     def _build_explanation(
         label: str, prior_val, current_val, impact: float
@@ -78,54 +93,52 @@ class RefundExplainerAgent:
             f"which {impact_dir} your refund by ~${impact_abs:,.0f}."
         )
 
-    def explain(self, prior_record: dict, current_record: dict) -> Dict[str, Any]:
-        """Pure math-based refund change explanation. No AI needed."""
-        prior_data = self._record_to_recon_dict(prior_record)
-        current_data = self._record_to_recon_dict(current_record)
-
-        baseline_result = self.math.run_reconciliation(prior_data)
-        baseline_balance = baseline_result["balance"]
-
-        final_result = self.math.run_reconciliation(current_data)
-        final_balance = final_result["balance"]
-
-        total_change = round(final_balance - baseline_balance, 2)
+    @staticmethod
+    def _build_driver(field: str, label: str, category: str, prior_val, current_val, impact: float) -> Dict[str, Any]:
+        return {
+            "field": field,
+            "label": label,
+            "category": category,
+            "prior_value": prior_val,
+            "current_value": current_val,
+            "impact_on_balance": impact,
+            "direction": "increased_refund" if impact > 0 else "decreased_refund",
+            "explanation": RefundExplainerAgent._build_explanation(label, prior_val, current_val, impact),
+        }
 
-        # Walk the waterfall: swap one field at a time
+    @staticmethod
+    def _changed_fields(prior_data: dict, current_data: dict) -> List[tuple]:
+        changed = []
+        for field, label, category in WATERFALL_FIELDS:
+            pv = prior_data.get(field) if prior_data.get(field) is not None else 0
+            cv = current_data.get(field) if current_data.get(field) is not None else 0
+            if pv != cv:
+                changed.append((field, label, category))
+        return changed
+
+    def _waterfall_drivers(
+        self, prior_data: dict, current_data: dict, changed: List[tuple],
+        baseline_balance: float, final_balance: float,
+    ) -> tuple:
+        """Swap one field at a time in 1040 order; leftovers go to an interaction bucket."""
         running_data = dict(prior_data)
         running_balance = baseline_balance
         drivers: List[Dict[str, Any]] = []
 
-        for field, label, category in WATERFALL_FIELDS:
+        for field, label, category in changed:
             prior_val = prior_data.get(field)
             current_val = current_data.get(field)
 
-            pv = prior_val if prior_val is not None else 0
-            cv = current_val if current_val is not None else 0
-            if pv == cv:
-                continue
-
             running_data[field] = current_val
             new_result = self.math.run_reconciliation(running_data)
             new_balance = new_result["balance"]
             marginal_impact = round(new_balance - running_balance, 2)
+            running_balance = new_balance
 
             if abs(marginal_impact) < 0.01:
-                running_balance = new_balance
                 continue
 
-            drivers.append({
-                "field": field,
-                "label": label,
-                "category": category,
-                "prior_value": prior_val,
-                "current_value": current_val,
-                "impact_on_balance": marginal_impact,
-                "direction": "increased_refund" if marginal_impact > 0 else "decreased_refund",
-                "explanation": self._build_explanation(label, prior_val, current_val, marginal_impact),
-            })
-
-            running_balance = new_balance
+            drivers.append(self._build_driver(field, label, category, prior_val, current_val, marginal_impact))
 
         # Capture residual interaction effects
         residual = round(final_balance - running_balance, 2)
@@ -145,6 +158,94 @@ class RefundExplainerAgent:
                 ),
             })
 
+        return drivers, len(changed)
+
+    def _shapley_drivers(
+        self, prior_data: dict, current_data: dict, changed: List[tuple],
+        memo: Dict[tuple, Dict[str, Any]],
+    ) -> tuple:
+        """Exact Shapley attribution: average each field's marginal impact over every
+        order of applying the changes. All 2^k coalitions are reconciled in one batch."""
+        k = len(changed)
+        coalitions = []
+        for mask in range(1 << k):
+            row = dict(prior_data)
+            for i, (field, _, _) in enumerate(changed):
+                if mask >> i & 1:
+                    row[field] = current_data.get(field)
+            coalitions.append(row)
+
+        balances = [r["balance"] for r in self.math.run_reconciliation_batch(coalitions, memo)]
+
+        # Weight of a coalition of size s that excludes the player: s!(k-s-1)!/k!
+        weights = [factorial(s) * factorial(k - s - 1) / factorial(k) for s in range(k)]
+
+        drivers: List[Dict[str, Any]] = []
+        for i, (field, label, category) in enumerate(changed):
+            bit = 1 << i
+            value = sum(
+                weights[bin(mask).count("1")] * (balances[mask | bit] - balances[mask])
+                for mask in range(1 << k)
+                if not mask & bit
+            )
+            impact = round(value, 2)
+            if abs(impact) < 0.01:
+                continue
+            drivers.append(self._build_driver(
+                field, label, category, prior_data.get(field), current_data.get(field), impact,
+            ))
+
+        return drivers, len(memo)
+
+    def reconcile_record(self, record_data: dict) -> Dict[str, Any]:
+        """Reconcile one record exactly as explain() does for its endpoints."""
+        return self.math.run_reconciliation(self._record_to_recon_dict(record_data))
+
+    def explain(
+        self, prior_record: dict, current_record: dict, mode: str = "waterfall",
+        prior_result: Dict[str, Any] = None, current_result: Dict[str, Any] = None,
+    ) -> Dict[str, Any]:
+        """Pure math-based refund change explanation. No AI needed.
+
+        mode="waterfall" walks WATERFALL_FIELDS in order (k+2 reconciliations);
+        mode="shapley" computes exact Shapley values over the changed fields (2^k).
+        Pass prior_result/current_result (from reconcile_record) to reuse endpoint
+        reconciliations that were already computed; they are not re-counted.
+        """
+        if mode not in ATTRIBUTION_MODES:
+            raise ValueError(f"Unknown attribution mode '{mode}'")
+
+        prior_data = self._record_to_recon_dict(prior_record)
+        current_data = self._record_to_recon_dict(current_record)
+        endpoint_evaluations = (prior_result is None) + (current_result is None)
+
+        baseline_result = prior_result or self.math.run_reconciliation(prior_data)
+        baseline_balance = baseline_result["balance"]
+
+        final_result = current_result or self.math.run_reconciliation(current_data)
+        final_balance = final_result["balance"]
+
+        total_change = round(final_balance - baseline_balance, 2)
+
+        changed = self._changed_fields(prior_data, current_data)
+        if mode == "shapley" and len(changed) > MAX_SHAPLEY_FIELDS:
+            mode = "waterfall"  # 2^k blows up; fall back to the ordered walk
+
+        if mode == "shapley":
+            # The empty and full coalitions are the two endpoint reconciliations
+            memo = {
+                self.math.memo_key(prior_data): baseline_result,
+                self.math.memo_key(current_data): final_result,
+            }
+            seeded = len(memo)
+            drivers, evaluations = self._shapley_drivers(prior_data, current_data, changed, memo)
+            evaluations += endpoint_evaluations - seeded
+        else:
+            drivers, steps = self._waterfall_drivers(
+                prior_data, current_data, changed, baseline_balance, final_balance,
+            )
+            evaluations = steps + endpoint_evaluations
+
         # Sort by absolute impact descending
         drivers.sort(key=lambda d: abs(d["impact_on_balance"]), reverse=True)
 
@@ -158,21 +259,27 @@ class RefundExplainerAgent:
             "total_change": total_change,
             "total_change_direction": "increased_refund" if total_change > 0 else "decreased_refund",
             "drivers": drivers,
+            "attribution_mode": mode,
+            "evaluations": evaluations,
             "ai_summary": None,
         }
 
     async def explain_with_ai_summary(
-        self, prior_record: dict, current_record: dict
+        self, prior_record: dict, current_record: dict, mode: str = "waterfall",
+        prior_result: Dict[str, Any] = None, current_result: Dict[str, Any] = None,
     ) -> Dict[str, Any]:
         """Run explanation and add an LLM-generated narrative summary."""
-        result = self.explain(prior_record, current_record)
+        result = self.explain(
+            prior_record, current_record, mode=mode,
+            prior_result=prior_result, current_result=current_result,
+        )
 
         if not self.api_key or not result["drivers"]:
             return result
 
         try:
-            import openai
-            client = openai.AsyncOpenAI(api_key=self.api_key)
+            from core.llm import chat_completion, get_client
+            client = get_client(self.api_key)
 
             drivers_text = "\n".join(
                 f"- {d['explanation']}" for d in result["drivers"][:5]
@@ -200,7 +307,8 @@ Key drivers:
 
 Write a 3-4 sentence plain-English summary. Be specific about the biggest factors and mention dollar amounts. Keep the tone neutral and factual. Do NOT give legal or financial advice. Do NOT say "we're here to help" or make any promises about support — this is a self-service tool. Do NOT use filler phrases."""
 
-            response = await client.chat.completions.create(
+            response = await chat_completion(
+                client,
                 model="gpt-4o-mini",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=250,
@@ -1,8 +1,8 @@
-import os
 import logging
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
-from fastapi.responses import FileResponse, JSONResponse
+from typing import Optional
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Depends
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel
@@ -12,15 +12,25 @@ logging.basicConfig(level=logging.INFO)
 
 # Internal Imports
 from agents.insight_agent import InsightAgent
-from agents.drafting_agent import DraftingAgent
+from agents.drafting_agent import draft_cache, run_drafting, shared_drafter
 from core.tax_math import TaxMath
+from core.auth import is_operator
 from core.schemas import TaxYearData, ReconciliationRequest
-from core.database import create_db
+from core.database import create_db, engine
+from core.jobs import job_queue
+from core.uploads import spool_upload, enforce_upload_limit
+from core.metrics import metrics
+from core.usage import scope_request_usage, usage_ledger
+from core.llm import (
+    EXTRACTION_DEADLINE_SECONDS, ClientDisconnected, configured_api_key, deadline, until_disconnected,
+)
 from routes.auth import router as auth_router
 from routes.scenarios import router as scenarios_router
 from routes.insights import router as insights_router
 from routes.life_events import router as life_events_router
 from routes.tax_records import router as tax_records_router
+from routes.usage import router as usage_router
+from routes.drafts import router as drafts_router, iter_file
 
 load_dotenv()
 
@@ -28,7 +38,11 @@ load_dotenv()
 @asynccontextmanager
 async def lifespan(app):
     create_db()
+    await job_queue.start(engine)
+    await usage_ledger.start(engine)
     yield
+    await job_queue.stop()
+    await usage_ledger.stop()
 
 
 app = FastAPI(title="Tax Prep Assistant", version="2.0.0", lifespan=lifespan)
@@ -43,10 +57,17 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
     return JSONResponse(status_code=422, content={"detail": exc.errors()})
 
 
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    """The client went away and its LLM work was cancelled; nobody reads this."""
+    return Response(status_code=499)
+
+
 # 1. Initialize Engines Once
 math_engine = TaxMath()
-API_KEY = os.getenv("OPENAI_API_KEY")
+API_KEY = configured_api_key()
 insighter = InsightAgent()
+drafter = shared_drafter()  # parses the template and renders the watermark once
 
 # Lazy-init extraction agent (requires OpenAI key)
 extractor = None
@@ -62,12 +83,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized uploads before their bodies are read
+app.middleware("http")(enforce_upload_limit)
+# Attribute OpenAI calls to the request path (and user, once authenticated)
+app.middleware("http")(scope_request_usage)
+
 # 3. Include Routers
 app.include_router(auth_router)
 app.include_router(scenarios_router)
 app.include_router(insights_router)
 app.include_router(life_events_router)
 app.include_router(tax_records_router)
+app.include_router(usage_router)
+app.include_router(drafts_router)
 
 
 # --- HEALTH CHECK ---
@@ -77,6 +105,15 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def get_metrics(operator: bool = Depends(is_operator)):
+    """Counters and latency/token summaries (upload.*, extraction.*, llm.*, draft.*).
+    Service-wide, so operators only (X-Operator-Token)."""
+    if not operator:
+        raise HTTPException(status_code=401, detail="Metrics require an operator token")
+    return metrics.snapshot()
+
+
 class AnalysisPayload(BaseModel):
     last_year: dict
     this_year: dict
@@ -84,12 +121,20 @@ class AnalysisPayload(BaseModel):
 # --- ORIGINAL ENDPOINTS (preserved) ---
 
 @app.post("/extract")
-async def extract_tax_data(file: UploadFile = File(...)):
+async def extract_tax_data(request: Request, file: UploadFile = File(...)):
     if not extractor:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY not configured")
-    pdf_bytes = await file.read()
-    data = await extractor.run(pdf_bytes)
-    return {"status": "success", "data": data}
+    upload = await spool_upload(file)
+    with deadline(EXTRACTION_DEADLINE_SECONDS):
+        result = await until_disconnected(request, extractor.extract(upload.file, sha256=upload.sha256))
+    if result["data"].get("reason") == "llm_unavailable":
+        raise HTTPException(status_code=503, detail=result["data"]["message"])
+    return {
+        "status": "success",
+        "data": result["data"],
+        "cache_hit": result["cache_hit"],
+        "extraction_method": result["method"],
+    }
 
 @app.post("/analyze")
 async def analyze_and_calculate(payload: AnalysisPayload):
@@ -126,13 +171,47 @@ async def reconcile_taxes(request: ReconciliationRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate-draft")
-async def generate_draft(data: TaxYearData):
-    drafter = DraftingAgent("data/f1040_template.pdf")
-    output_filename = "tax_draft_2025.pdf"
-    drafter.generate(data.model_dump(), output_filename)
-
-    return FileResponse(
-        output_filename,
-        media_type="application/pdf",
-        filename="Your_Tax_Assistant_Draft.pdf"
-    )
+async def generate_draft(data: TaxYearData, request: Request):
+    """The filled draft, with a strong ETag derived from the template version
+    and the values drawn on it (drafts are byte-for-byte reproducible). A
+    conditional request for the same draft gets 304 without rendering;
+    otherwise it is served from draft_cache, or rendered on the drafting pool
+    (off the event loop) into a per-request spooled buffer and cached.
+    Nothing is written to a shared path."""
+    data = data.model_dump()
+    etag = f'"{drafter.draft_key(data)}"'
+    headers = {
+        "ETag": etag,
+        # Tax data: the browser may keep it, but must revalidate every time
+        "Cache-Control": "private, no-cache",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        metrics.incr("draft.requests", result="not_modified")
+        return Response(status_code=304, headers=headers)
+
+    headers["Content-Disposition"] = 'attachment; filename="Your_Tax_Assistant_Draft.pdf"'
+    content = draft_cache.get(etag)
+    if content is not None:
+        metrics.incr("draft.requests", result="cache_hit")
+        return Response(content, media_type="application/pdf", headers=headers)
+
+    metrics.incr("draft.requests", result="rendered")
+    draft, size = await run_drafting(drafter.render, data)
+    if size > draft_cache.max_bytes:
+        return StreamingResponse(
+            iter_file(draft), media_type="application/pdf",
+            headers={**headers, "Content-Length": str(size)},
+        )
+    with draft:
+        content = draft.read()
+    draft_cache.put(etag, content, size)
+    return Response(content, media_type="application/pdf", headers=headers)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses the weak comparison: W/ prefixes are ignored."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
@@ -0,0 +1,92 @@
+"""Drafts per second for /generate-draft's DraftingAgent.
+
+Compares the original per-request draft (the template parsed and the
+watermark rendered and merged on every draft, reproduced below as
+baseline_generate) with one shared agent that only renders the per-return
+overlay:
+
+    python -m benchmarks.drafting --drafts 50
+"""
+import io
+import os
+import time
+import argparse
+import tempfile
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from PyPDF2 import PdfReader, PdfWriter
+
+from agents.drafting_agent import DraftingAgent
+
+TEMPLATE_PATH = "data/f1040_template.pdf"
+SAMPLE_RETURN = {"filing_status": "Single", "wages": 72000.0, "agi": 69185.0}
+
+
+def baseline_generate(template_path: str, data: dict, output_path: str) -> None:
+    """DraftingAgent.generate as it was before the shared template: one
+    overlay with the watermark and the values, merged into a freshly parsed
+    template."""
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=letter)
+    can.setFont("Helvetica-Bold", 60)
+    can.setStrokeColorRGB(0.8, 0.8, 0.8)
+    can.setFillColorRGB(0.9, 0.9, 0.9)
+    can.saveState()
+    can.translate(300, 450)
+    can.rotate(45)
+    can.drawCentredString(0, 0, "DRAFT - NOT FOR FILING")
+    can.restoreState()
+    can.setFont("Helvetica", 10)
+    can.setFillColorRGB(0, 0, 0)
+    if data.get("filing_status") == "Single":
+        can.drawString(65, 715, "X")
+    elif data.get("filing_status") == "Married filing jointly":
+        can.drawString(135, 715, "X")
+    can.drawString(440, 560, f"{data.get('wages', 0):,.0f}")
+    can.drawString(440, 435, f"{data.get('agi', 0):,.0f}")
+    can.showPage()
+    can.save()
+    packet.seek(0)
+
+    overlay_pdf = PdfReader(packet)
+    with open(template_path, "rb") as f:
+        template_pdf = PdfReader(f)
+        output = PdfWriter()
+        page = template_pdf.pages[0]
+        page.merge_page(overlay_pdf.pages[0])
+        output.add_page(page)
+        for i in range(1, len(template_pdf.pages)):
+            output.add_page(template_pdf.pages[i])
+        with open(output_path, "wb") as out:
+            output.write(out)
+
+
+def drafts_per_second(generate, drafts: int, output_path: str) -> float:
+    start = time.perf_counter()
+    for i in range(drafts):
+        generate({**SAMPLE_RETURN, "wages": SAMPLE_RETURN["wages"] + i}, output_path)
+    return drafts / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--drafts", type=int, default=50)
+    parser.add_argument("--template", default=TEMPLATE_PATH)
+    args = parser.parse_args()
+
+    shared = DraftingAgent(args.template)
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, "draft.pdf")
+        shared.generate(SAMPLE_RETURN, output_path)  # warm-up
+        before = drafts_per_second(
+            lambda data, path: baseline_generate(args.template, data, path), args.drafts, output_path,
+        )
+        after = drafts_per_second(shared.generate, args.drafts, output_path)
+
+    print(f"per-request draft: {before:7.1f} drafts/s")
+    print(f"shared agent:      {after:7.1f} drafts/s  ({after / before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
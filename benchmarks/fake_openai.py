@@ -0,0 +1,196 @@
+"""Local stand-in for the OpenAI chat.completions API.
+
+Serves canned answers for the extraction and AI-summary prompts with a
+configurable latency distribution, error rate and streaming, so the LLM paths
+(routing, verification, hedging, the circuit breaker) can be measured offline
+and reproducibly. Runs on localhost:
+
+    python -m benchmarks.fake_openai --port 8100 --median 2 --p99 20 --error-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 uvicorn app:app
+
+or in-process, through an httpx ASGI transport:
+
+    app = create_app(FakeOpenAIConfig(median=0.01))
+    configure_client("http://stand-in/v1", httpx.AsyncClient(transport=httpx.ASGITransport(app)))
+"""
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from agents.prompt_compaction import count_tokens
+
+# A consistent single filer's return (the same numbers as the e-filed test
+# fixture); extraction prompts get the subset of fields they ask for
+CANNED_EXTRACTION = {
+    "filing_status": "Single", "dependents_count": 0, "wages": 72000.0, "tax_exempt_interest": 0.0,
+    "taxable_interest": 185.0, "ordinary_dividends": 0.0, "capital_gain_or_loss": -3000.0,
+    "total_income": 69185.0, "adjustments_to_income": 0.0, "agi": 69185.0,
+    "deduction_type": "Standard", "total_deductions": 15750.0, "taxable_income": 53435.0,
+    "child_tax_credit": 0.0, "total_tax": 6041.0, "refund_amount": 4759.0, "owed_amount": 0.0,
+    "other_income": 0.0, "other_income_description": None, "qbi_deduction": 0.0,
+    "self_employment_tax": 0.0, "schedule_2_total": 0.0, "schedule_3_total": 0.0,
+    "w2_withholding": 10800.0, "withholding_1099": 0.0, "estimated_tax_payments": 0.0,
+}
+CANNED_SUMMARY = (
+    "Your refund changed mainly because of lower withholding and higher wages. "
+    "The standard deduction rose slightly, which offset part of the difference. "
+    "No credits changed between the two years."
+)
+FIELD_LINE_RE = re.compile(r"^- (\w+): ", re.MULTILINE)
+
+
+@dataclass
+class FakeOpenAIConfig:
+    # Log-normal latency in seconds, set by its median and 99th percentile
+    median: float = 2.0
+    p99: float = 20.0
+    # Share of requests answered with `error_status` instead of a completion
+    error_rate: float = 0.0
+    error_status: int = 500
+    # Share of extraction answers with total_tax misread (exercises
+    # validation, escalation and the TaxMath cross-check)
+    misread_rate: float = 0.0
+    # Models that never misread (the "strong" tier)
+    accurate_models: List[str] = field(default_factory=lambda: ["gpt-4o"])
+    # Streamed responses are sent in this many chunks, evenly spread over the latency
+    stream_chunks: int = 8
+    seed: Optional[int] = 0
+
+
+class FakeOpenAI:
+    def __init__(self, config: FakeOpenAIConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.requests = 0
+        self.errors = 0
+
+    def latency(self) -> float:
+        """Seconds for the next response: log-normal with the configured
+        median and p99 (z(0.99) = 2.326)."""
+        config = self.config
+        if config.p99 <= config.median:
+            return config.median
+        sigma = math.log(config.p99 / config.median) / 2.326
+        return self.random.lognormvariate(math.log(config.median), sigma)
+
+    def answer(self, request: Dict[str, Any]) -> str:
+        prompt = "\n".join(m.get("content") or "" for m in request.get("messages", []))
+        if (request.get("response_format") or {}).get("type") != "json_object":
+            return CANNED_SUMMARY
+        fields = FIELD_LINE_RE.findall(prompt) or list(CANNED_EXTRACTION)
+        data = {f: CANNED_EXTRACTION[f] for f in fields if f in CANNED_EXTRACTION}
+        misread = (
+            request.get("model") not in self.config.accurate_models
+            and self.random.random() < self.config.misread_rate
+        )
+        if misread and "total_tax" in data:
+            data["total_tax"] = round(data["total_tax"] * 1.5, 2)
+        return json.dumps(data)
+
+    async def chat_completions(self, request: Request):
+        body = await request.json()
+        self.requests += 1
+        delay = self.latency()
+        if self.random.random() < self.config.error_rate:
+            self.errors += 1
+            await asyncio.sleep(delay)
+            return JSONResponse(status_code=self.config.error_status, content={
+                "error": {"message": "Injected stand-in failure", "type": "server_error", "code": None},
+            })
+
+        content = self.answer(body)
+        model = body.get("model", "gpt-4o")
+        completion_id = f"chatcmpl-standin-{self.requests}"
+        created = int(time.time())
+        prompt_tokens = count_tokens("\n".join(m.get("content") or "" for m in body.get("messages", [])))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": count_tokens(content),
+            "total_tokens": prompt_tokens + count_tokens(content),
+        }
+        if body.get("stream"):
+            return StreamingResponse(
+                self._stream(completion_id, created, model, content, delay),
+                media_type="text/event-stream",
+            )
+
+        await asyncio.sleep(delay)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        }
+
+    async def _stream(self, completion_id: str, created: int, model: str, content: str, delay: float):
+        chunks = max(1, self.config.stream_chunks)
+        size = math.ceil(len(content) / chunks) or 1
+        pieces = [content[i:i + size] for i in range(0, len(content), size)] or [""]
+        for i, piece in enumerate(pieces):
+            await asyncio.sleep(delay / len(pieces))
+            delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+            yield _sse({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            })
+        yield _sse({
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        })
+        yield "data: [DONE]\n\n"
+
+
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def create_app(config: FakeOpenAIConfig = None) -> FastAPI:
+    stand_in = FakeOpenAI(config or FakeOpenAIConfig())
+    app = FastAPI(title="OpenAI stand-in")
+    app.state.stand_in = stand_in
+    app.post("/v1/chat/completions")(stand_in.chat_completions)
+
+    @app.get("/v1/stats")
+    def stats():
+        return {"requests": stand_in.requests, "errors": stand_in.errors}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--median", type=float, default=2.0, help="median latency, seconds")
+    parser.add_argument("--p99", type=float, default=20.0, help="99th percentile latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--misread-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    config = FakeOpenAIConfig(
+        median=args.median, p99=args.p99, error_rate=args.error_rate, error_status=args.error_status,
+        misread_rate=args.misread_rate, seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
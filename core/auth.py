@@ -1,18 +1,25 @@
 import os
+import hmac
 from datetime import datetime, timedelta, timezone
+from typing import Optional
 import bcrypt
 from jose import jwt, JWTError
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlmodel import Session, select
 from core.database import get_session
 from core.models import User
+from core.usage import set_usage_user
 
 SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# Service-wide operational data (every user's LLM usage) is for operators:
+# requests with this value in X-Operator-Token. Unset, nobody is an operator.
+OPERATOR_TOKEN = os.getenv("OPERATOR_TOKEN")
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 
 def hash_password(password: str) -> str:
@@ -33,6 +40,20 @@ def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     session: Session = Depends(get_session),
 ) -> User:
+    return _user_from_credentials(credentials, session)
+
+
+def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    session: Session = Depends(get_session),
+) -> Optional[User]:
+    """Like get_current_user, but anonymous requests get None instead of a 403."""
+    if credentials is None:
+        return None
+    return _user_from_credentials(credentials, session)
+
+
+def _user_from_credentials(credentials: HTTPAuthorizationCredentials, session: Session) -> User:
     token = credentials.credentials
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -43,4 +64,9 @@ def get_current_user(
     user = session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    set_usage_user(user.id)
     return user
+
+
+def is_operator(x_operator_token: Optional[str] = Header(default=None)) -> bool:
+    return bool(OPERATOR_TOKEN and x_operator_token) and hmac.compare_digest(x_operator_token, OPERATOR_TOKEN)
@@ -0,0 +1,13 @@
+import zlib
+from typing import Optional
+
+# Parsed PDF text stored alongside TaxRecords; 1040 text compresses ~4-5x
+TEXT_COMPRESSION_LEVEL = 6
+
+
+def compress_text(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), TEXT_COMPRESSION_LEVEL)
+
+
+def decompress_text(blob: Optional[bytes]) -> Optional[str]:
+    return zlib.decompress(blob).decode("utf-8") if blob else None
@@ -57,6 +57,8 @@ def _migrate_columns():
                         default = " DEFAULT 0.0"
                     elif str(col_type) in ("INTEGER", "BIGINT", "SMALLINT"):
                         default = " DEFAULT 0"
+                    elif str(col_type) == "BOOLEAN":
+                        default = " DEFAULT FALSE"
                     elif "VARCHAR" in str(col_type) or "TEXT" in str(col_type):
                         default = " DEFAULT ''"
                     null = "" if col.nullable else " NOT NULL"
@@ -0,0 +1,201 @@
+import json
+import time
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from core.metrics import metrics
+from core.models import ExtractionJob
+from core.usage import usage_scope
+
+logger = logging.getLogger(__name__)
+
+# Background jobs: long uploads are persisted as ExtractionJob rows and run by
+# a small in-process worker pool, so the HTTP request returns immediately.
+# Several processes may share the database: a worker claims a job with a
+# conditional UPDATE and keeps its heartbeat fresh while it runs. On startup
+# queued jobs are picked up again, and so are running jobs whose heartbeat
+# has gone stale (their process died); jobs other live processes are
+# running are left alone.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "120"))
+JOB_HEARTBEAT_SECONDS = JOB_STALE_SECONDS / 4
+MAX_JOB_ATTEMPTS = 3
+TERMINAL_STATUSES = ("succeeded", "failed")
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# handler(job, session) -> {"result": dict, "record_id": Optional[int]}
+JobHandler = Callable[[ExtractionJob, Session], Awaitable[Dict[str, Any]]]
+
+
+def _claimable(now: datetime):
+    """Queued jobs, and running jobs whose worker stopped sending heartbeats."""
+    stale = now - timedelta(seconds=JOB_STALE_SECONDS)
+    return or_(
+        ExtractionJob.status == "queued",
+        and_(
+            ExtractionJob.status == "running",
+            or_(ExtractionJob.heartbeat_at.is_(None), ExtractionJob.heartbeat_at < stale),
+        ),
+    )
+
+
+class JobQueue:
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self.handlers: Dict[str, JobHandler] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks = []
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self.handlers[kind] = handler
+
+    @property
+    def running(self) -> bool:
+        return self._queue is not None
+
+    async def start(self, engine: Engine) -> int:
+        """Start the workers on the current event loop and requeue unfinished
+        jobs from `engine`. Returns the number of jobs requeued."""
+        self._queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        return self.requeue_pending(engine)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._loop = None
+
+    async def join(self) -> None:
+        """Wait until every submitted job has been processed."""
+        await self._queue.join()
+
+    def requeue_pending(self, engine: Engine) -> int:
+        """Queue jobs nobody is working on: queued ones and running ones with a
+        stale heartbeat. Whichever process claims one first runs it."""
+        with Session(engine) as session:
+            job_ids = session.exec(
+                select(ExtractionJob.id)
+                .where(_claimable(datetime.now(timezone.utc)))
+                .order_by(ExtractionJob.id)
+            ).all()
+        for job_id in job_ids:
+            self._queue.put_nowait((job_id, engine))
+        if job_ids:
+            logger.info(f"[jobs] requeued {len(job_ids)} unfinished jobs")
+        return len(job_ids)
+
+    def submit(self, job_id: int, engine: Engine) -> None:
+        """Queue a job; callable from the event loop or from any thread (sync
+        routes run on FastAPI's threadpool). asyncio.Queue is not thread-safe
+        and a put from another thread would not wake an idle loop, so those
+        are handed to the loop with call_soon_threadsafe."""
+        if self._queue is None:
+            raise RuntimeError("Job queue is not running")
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._queue.put_nowait((job_id, engine))
+        else:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, (job_id, engine))
+        metrics.incr("jobs.submitted")
+
+    async def _worker(self) -> None:
+        while True:
+            job_id, engine = await self._queue.get()
+            try:
+                await self.run_job(job_id, engine)
+            except Exception:
+                logger.exception(f"[jobs] job {job_id} crashed the worker loop")
+            finally:
+                self._queue.task_done()
+
+    async def run_job(self, job_id: int, engine: Engine) -> None:
+        with Session(engine) as session:
+            if not self._claim(session, job_id):
+                return  # finished, missing, or running in a live process
+            job = session.get(ExtractionJob, job_id)
+            start = time.perf_counter()
+            job.attempts += 1
+            if job.attempts > MAX_JOB_ATTEMPTS:
+                self._finish(session, job, error=f"Gave up after {MAX_JOB_ATTEMPTS} attempts")
+                return
+            session.commit()
+
+            heartbeat = asyncio.create_task(self._heartbeat(job_id, engine))
+            try:
+                handler = self.handlers[job.kind]
+                with usage_scope(f"job:{job.kind}", job.user_id):
+                    outcome = await handler(job, session)
+            except Exception as e:
+                session.rollback()
+                logger.warning(f"[jobs] {job.kind} job {job_id} failed: {e}")
+                self._finish(session, job, error=str(e) or type(e).__name__)
+            else:
+                self._finish(session, job, outcome=outcome)
+            finally:
+                heartbeat.cancel()
+            metrics.observe("jobs.duration_ms", (time.perf_counter() - start) * 1000, kind=job.kind)
+
+    @staticmethod
+    def _claim(session: Session, job_id: int) -> bool:
+        """Mark the job running in this process, unless another process got to
+        it first; the conditional UPDATE makes the claim atomic."""
+        now = datetime.now(timezone.utc)
+        claimed = session.exec(
+            update(ExtractionJob)
+            .where(ExtractionJob.id == job_id, _claimable(now))
+            .values(status="running", claimed_by=WORKER_ID, started_at=now, heartbeat_at=now)
+        )
+        session.commit()
+        return claimed.rowcount == 1
+
+    @staticmethod
+    def _beat(engine: Engine, job_id: int) -> None:
+        with Session(engine) as session:
+            session.exec(
+                update(ExtractionJob)
+                .where(ExtractionJob.id == job_id, ExtractionJob.claimed_by == WORKER_ID)
+                .values(heartbeat_at=datetime.now(timezone.utc))
+            )
+            session.commit()
+
+    async def _heartbeat(self, job_id: int, engine: Engine) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                await asyncio.to_thread(self._beat, engine, job_id)
+            except Exception as e:
+                logger.warning(f"[jobs] heartbeat for job {job_id} failed: {e}")
+
+    @staticmethod
+    def _finish(session: Session, job: ExtractionJob, outcome: dict = None, error: str = None) -> None:
+        if outcome is not None:
+            job.status = "succeeded"
+            job.result = json.dumps(outcome["result"])
+            job.record_id = outcome.get("record_id")
+        else:
+            job.status = "failed"
+            job.error = error
+        job.pdf_data = None
+        job.finished_at = datetime.now(timezone.utc)
+        session.add(job)
+        session.commit()
+        metrics.incr("jobs.finished", kind=job.kind, status=job.status)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,358 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, Optional
+
+import openai
+
+from core.metrics import metrics
+from core.usage import usage_ledger
+
+logger = logging.getLogger(__name__)
+
+# Shared path for OpenAI chat completions. Completion latency is heavy-tailed
+# (p50 ~2s, p99 >20s), so a call still running after the LLM_HEDGE_PERCENTILE
+# of recent latencies for its model gets one duplicate; the first answer wins
+# and the other is cancelled. Hedges are capped at LLM_HEDGE_BUDGET of calls.
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))
+# No hedging until this many latencies have been seen for the model
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = 512
+
+# Upper bound on any single call (the client default is 10 minutes); routes
+# set tighter per-request deadlines with `with deadline(seconds):`
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+
+# Circuit breaker: over the calls of the last LLM_BREAKER_WINDOW_SECONDS, a
+# failure is an error or a call slower than LLM_BREAKER_SLOW_SECONDS. Once at
+# least LLM_BREAKER_MIN_CALLS calls are seen and the failure rate reaches
+# LLM_BREAKER_FAILURE_RATE, calls fail fast for LLM_BREAKER_COOLDOWN_SECONDS;
+# then a single probe call decides whether the circuit closes again.
+LLM_BREAKER_WINDOW_SECONDS = float(os.getenv("LLM_BREAKER_WINDOW_SECONDS", "60"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+LLM_BREAKER_SLOW_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "30"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Per-request deadlines set by the routes that wait on OpenAI
+EXTRACTION_DEADLINE_SECONDS = float(os.getenv("EXTRACTION_DEADLINE_SECONDS", "90"))
+AI_SUMMARY_DEADLINE_SECONDS = float(os.getenv("AI_SUMMARY_DEADLINE_SECONDS", "15"))
+# How often a route checks whether its client has gone away
+DISCONNECT_POLL_SECONDS = 0.5
+
+# Point every agent at an OpenAI-compatible server instead of api.openai.com,
+# e.g. the local stand-in (python -m benchmarks.fake_openai). The stand-in
+# ignores the key, so with a base URL set no OPENAI_API_KEY is required.
+LLM_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+STAND_IN_API_KEY = "local-stand-in"
+
+_clients: Dict[str, openai.AsyncOpenAI] = {}
+_http_client = None
+
+
+def configure_client(base_url: Optional[str] = None, http_client=None) -> None:
+    """Override where LLM calls go (base URL, or an httpx.AsyncClient such as
+    one on an in-process ASGI transport). Drops existing clients."""
+    global LLM_BASE_URL, _http_client
+    LLM_BASE_URL, _http_client = base_url, http_client
+    _clients.clear()
+
+
+def configured_api_key() -> Optional[str]:
+    """OPENAI_API_KEY, or a placeholder when a base URL is configured."""
+    return os.getenv("OPENAI_API_KEY") or (STAND_IN_API_KEY if LLM_BASE_URL else None)
+
+
+def get_client(api_key: str) -> openai.AsyncOpenAI:
+    """One AsyncOpenAI client (and connection pool) per API key."""
+    client = _clients.get(api_key)
+    if client is None:
+        client = _clients[api_key] = openai.AsyncOpenAI(
+            api_key=api_key, base_url=LLM_BASE_URL, http_client=_http_client, timeout=LLM_TIMEOUT_SECONDS,
+        )
+    return client
+
+
+class LLMUnavailable(RuntimeError):
+    """The call was not made or was abandoned: circuit open or deadline passed.
+    Callers fall back to their deterministic result."""
+
+
+class CircuitOpenError(LLMUnavailable):
+    pass
+
+
+class DeadlineExceeded(LLMUnavailable):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, window_seconds: float = LLM_BREAKER_WINDOW_SECONDS,
+                 min_calls: int = LLM_BREAKER_MIN_CALLS, failure_rate: float = LLM_BREAKER_FAILURE_RATE,
+                 slow_seconds: float = LLM_BREAKER_SLOW_SECONDS,
+                 cooldown_seconds: float = LLM_BREAKER_COOLDOWN_SECONDS, clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.clock = clock
+        self.outcomes: deque = deque()  # (finished_at, failed)
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at < self.cooldown_seconds:
+            return "open"
+        return "half_open"
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go out now."""
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return
+        metrics.incr("llm.short_circuited")
+        raise CircuitOpenError("OpenAI circuit is open after repeated failures; retry shortly")
+
+    def record(self, seconds: Optional[float], error: bool = False) -> None:
+        failed = error or seconds is None or seconds > self.slow_seconds
+        now = self.clock()
+        if self.opened_at is not None:
+            # The half-open probe decides
+            self.probing = False
+            if failed:
+                self.opened_at = now
+            else:
+                self.opened_at = None
+                self.outcomes.clear()
+                metrics.incr("llm.circuit_closed")
+                logger.info("[llm] circuit closed")
+            return
+
+        self.outcomes.append((now, failed))
+        while self.outcomes and now - self.outcomes[0][0] > self.window_seconds:
+            self.outcomes.popleft()
+        failures = sum(1 for _, f in self.outcomes if f)
+        if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_rate:
+            self.opened_at = now
+            metrics.incr("llm.circuit_opened")
+            logger.warning(f"[llm] circuit opened: {failures}/{len(self.outcomes)} recent calls failed or were slow")
+
+    def release(self) -> None:
+        """A call was cancelled before it finished; it says nothing about upstream."""
+        self.probing = False
+
+    def reset(self) -> None:
+        self.outcomes.clear()
+        self.opened_at = None
+        self.probing = False
+
+
+breaker = CircuitBreaker()
+
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """Bound every LLM call made inside the block (including in tasks it
+    starts) to finish within `seconds` from now. Nested deadlines keep the
+    earlier one."""
+    if seconds is None:
+        yield
+        return
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline; None without one."""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+async def until_disconnected(request, awaitable: Awaitable, poll: float = DISCONNECT_POLL_SECONDS):
+    """Await `awaitable`, cancelling it (and the LLM calls under it) when the
+    HTTP client disconnects first. Raises ClientDisconnected in that case."""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                metrics.incr("llm.cancelled_disconnects")
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+class Hedger:
+    """Recent latencies per model and the hedge budget."""
+
+    def __init__(self, percentile: float = LLM_HEDGE_PERCENTILE, budget: float = LLM_HEDGE_BUDGET,
+                 min_samples: int = LLM_HEDGE_MIN_SAMPLES, window: int = LATENCY_WINDOW):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.window = window
+        self.latencies: Dict[str, deque] = {}
+        self.calls = 0
+        self.hedges = 0
+
+    def record(self, model: str, seconds: float) -> None:
+        self.latencies.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def threshold(self, model: str) -> Optional[float]:
+        """Seconds after which a call to `model` is hedged; None while there
+        are too few samples."""
+        recent = self.latencies.get(model)
+        if not recent or len(recent) < self.min_samples:
+            return None
+        ordered = sorted(recent)
+        return ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+    def allow(self) -> bool:
+        return self.hedges + 1 <= self.budget * self.calls
+
+    def reset(self) -> None:
+        self.latencies.clear()
+        self.calls = 0
+        self.hedges = 0
+
+
+hedger = Hedger()
+
+
+async def _timed(client: openai.AsyncOpenAI, request: Dict[str, Any]):
+    start = time.perf_counter()
+    response = await client.chat.completions.create(**request)
+    return response, time.perf_counter() - start
+
+
+async def chat_completion(client: openai.AsyncOpenAI, hedge: bool = None, **request) -> Any:
+    """client.chat.completions.create(**request) behind the circuit breaker,
+    bounded by the current deadline and hedged when enabled. Each answered
+    call is added to the usage ledger, and so is the losing duplicate of a
+    hedged call (tagged hedge=True), which is billed too."""
+    left = remaining()
+    if left is not None and left <= 0:
+        metrics.incr("llm.deadline_exceeded")
+        raise DeadlineExceeded("Request deadline passed before the OpenAI call")
+    breaker.before_call()
+
+    start = time.perf_counter()
+    try:
+        if left is None:
+            response, loser = await _hedged(client, hedge, request)
+        else:
+            response, loser = await asyncio.wait_for(_hedged(client, hedge, request), timeout=left)
+    except asyncio.TimeoutError:
+        breaker.record(None, error=True)
+        metrics.incr("llm.deadline_exceeded")
+        raise DeadlineExceeded(f"OpenAI call cancelled at the request deadline ({left:.1f}s)")
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except Exception:
+        breaker.record(time.perf_counter() - start, error=True)
+        metrics.incr("llm.errors", model=request.get("model", ""))
+        raise
+    seconds = time.perf_counter() - start
+    breaker.record(seconds)
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    usage_ledger.record(
+        request.get("model", ""),
+        prompt_tokens,
+        getattr(usage, "completion_tokens", 0) or 0,
+        seconds * 1000,
+    )
+    if loser is not None:
+        # The duplicate sent the same prompt. Cancelled mid-answer, its
+        # completion tokens are unknown and recorded as 0.
+        loser_response, loser_seconds = loser
+        loser_usage = getattr(loser_response, "usage", None)
+        usage_ledger.record(
+            request.get("model", ""),
+            getattr(loser_usage, "prompt_tokens", 0) or prompt_tokens,
+            getattr(loser_usage, "completion_tokens", 0) or 0,
+            loser_seconds * 1000,
+            hedge=True,
+        )
+    return response
+
+
+async def _hedged(client: openai.AsyncOpenAI, hedge: Optional[bool], request: Dict[str, Any]):
+    """(response, loser): loser is (its response or None if cancelled,
+    seconds it ran) for the call that lost a hedge race, None otherwise. A
+    loser that failed was not billed and is not reported."""
+    hedge = LLM_HEDGE if hedge is None else hedge
+    model = request.get("model", "")
+    hedger.calls += 1
+    metrics.incr("llm.calls", model=model)
+
+    threshold = hedger.threshold(model) if hedge else None
+    primary = asyncio.ensure_future(_timed(client, request))
+    backup = loser = None
+    try:
+        if threshold is not None:
+            await asyncio.wait({primary}, timeout=threshold)
+        if primary.done() or threshold is None or not hedger.allow():
+            response, seconds = await primary
+        else:
+            hedger.hedges += 1
+            metrics.incr("llm.hedges_fired", model=model)
+            logger.info(f"[llm] {model} call still running after {threshold:.1f}s; sending a hedge")
+            backup = asyncio.ensure_future(_timed(client, request))
+            response, seconds, winner = await _first_success(primary, backup)
+            losing = primary if winner is backup else backup
+            if not losing.done() or losing.exception() is None:
+                # primary started `threshold` before backup
+                ran = seconds + threshold if winner is backup else seconds - threshold
+                loser = (losing.result()[0] if losing.done() else None, ran)
+            if winner is backup:
+                metrics.incr("llm.hedge_wins", model=model)
+                seconds += threshold
+    finally:
+        for task in (primary, backup):
+            if task is not None and not task.done():
+                task.cancel()
+    hedger.record(model, seconds)
+    metrics.observe("llm.latency_ms", seconds * 1000, model=model)
+    return response, loser
+
+
+async def _first_success(*tasks):
+    """(response, seconds, task) from the first task that succeeds; raises the
+    last error when all of them fail."""
+    pending, error = set(tasks), None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                return (*task.result(), task)
+            error = task.exception()
+    raise error
@@ -0,0 +1,159 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+# In-process metrics: counters and summaries (count/sum/min/max plus p50/p95
+# over a bounded window of recent samples), exposed as JSON on GET /metrics.
+# Per-request stage timings are collected on a StageTimer made current with
+# `with StageTimer() as timer:`; code deeper in the call stack (the extraction
+# agent, gathered LLM calls) records into it through stage()/add_count().
+
+SUMMARY_WINDOW = 1024
+
+
+def _key(name: str, labels: Dict[str, Any]) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in sorted(labels.items())) + "}"
+
+
+def _percentile(sorted_values, q: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class MetricsRegistry:
+    def __init__(self, window: int = SUMMARY_WINDOW):
+        self.window = window
+        self._counters: Dict[str, float] = {}
+        self._summaries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = {
+                    "count": 0, "sum": 0.0, "min": value, "max": value,
+                    "recent": deque(maxlen=self.window),
+                }
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["min"] = min(summary["min"], value)
+            summary["max"] = max(summary["max"], value)
+            summary["recent"].append(value)
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def summary(self, name: str, **labels) -> Optional[Dict[str, float]]:
+        with self._lock:
+            summary = self._summaries.get(_key(name, labels))
+            return self._summary_view(summary) if summary else None
+
+    @staticmethod
+    def _summary_view(summary: dict) -> Dict[str, float]:
+        recent = sorted(summary["recent"])
+        return {
+            "count": summary["count"],
+            "sum": round(summary["sum"], 3),
+            "avg": round(summary["sum"] / summary["count"], 3),
+            "min": summary["min"],
+            "max": summary["max"],
+            "p50": _percentile(recent, 0.5),
+            "p95": _percentile(recent, 0.95),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "summaries": {k: self._summary_view(s) for k, s in self._summaries.items()},
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+
+metrics = MetricsRegistry()
+
+_current_timer: ContextVar[Optional["StageTimer"]] = ContextVar("stage_timer", default=None)
+
+
+class StageTimer:
+    """Wall-clock ms per named stage plus counts (pages, bytes, tokens) for
+    one request. Repeated stages accumulate."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages_ms: Dict[str, float] = {}
+        self.counts: Dict[str, float] = {}
+        self._tokens = []
+
+    def __enter__(self) -> "StageTimer":
+        self._tokens.append(_current_timer.set(self))
+        return self
+
+    def __exit__(self, *exc) -> None:
+        _current_timer.reset(self._tokens.pop())
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stages_ms[name] = self.stages_ms.get(name, 0.0) + elapsed
+
+    def add_count(self, name: str, value: float) -> None:
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages_ms": {k: round(v, 1) for k, v in self.stages_ms.items()},
+            **self.counts,
+        }
+
+    def publish(self, prefix: str, registry: MetricsRegistry = None) -> None:
+        """Record this request's stages and counts as `<prefix>.*` summaries."""
+        registry = registry or metrics
+        registry.observe(f"{prefix}.total_ms", (time.perf_counter() - self.started) * 1000)
+        for name, ms in self.stages_ms.items():
+            registry.observe(f"{prefix}.stage_ms", ms, stage=name)
+        for name, value in self.counts.items():
+            registry.observe(f"{prefix}.{name}", value)
+
+
+def current_timer() -> Optional[StageTimer]:
+    return _current_timer.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage on the current request's StageTimer; no-op without one."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def add_count(name: str, value: float) -> None:
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add_count(name, value)
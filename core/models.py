@@ -39,6 +39,14 @@ class TaxRecord(SQLModel, table=True):
     refund_amount: float = 0.0
     owed_amount: float = 0.0
     source: str = "manual"  # "manual" or "pdf_upload"
+    # Uploads: zlib-compressed parsed PDF text and the extraction prompt version
+    # ("layout" for the deterministic reader), for re-extraction without the PDF
+    extraction_text: Optional[bytes] = None
+    prompt_version: Optional[str] = None
+    user_edited: bool = False  # set by PUT; re-extraction leaves these alone
+    # JSON caches (see routes/insights.py); keyed by TAX_PARAMS_VERSION + input hash
+    reconciliation_cache: Optional[str] = None
+    explanation_cache: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
@@ -62,3 +70,38 @@ class Scenario(SQLModel, table=True):
     balance: Optional[float] = None
     balance_type: Optional[str] = None  # "refund" or "owe"
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class ExtractionJob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    kind: str = "upload"  # "upload" or "reextract"
+    status: str = Field(default="queued", index=True)  # "queued", "running", "succeeded", "failed"
+    tax_year: Optional[int] = None  # uploads only
+    filename: Optional[str] = None
+    sha256: Optional[str] = None
+    pdf_data: Optional[bytes] = None  # dropped once the job finishes
+    params: Optional[str] = None  # JSON job arguments (re-extraction: record_ids)
+    attempts: int = 0
+    result: Optional[str] = None  # JSON, same shape as the synchronous upload response
+    error: Optional[str] = None
+    record_id: Optional[int] = Field(default=None, foreign_key="taxrecord.id")
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    claimed_by: Optional[str] = None  # "host:pid" of the worker process running it
+    heartbeat_at: Optional[datetime] = None  # refreshed while running; stale means the worker died
+
+
+class LLMUsage(SQLModel, table=True):
+    """One row per OpenAI call; append-only (see core/usage.py)."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: Optional[int] = Field(default=None, index=True)  # None for anonymous requests
+    endpoint: str = Field(index=True)  # request path, or "job:<kind>" for background jobs
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms: float = 0.0
+    cost_usd: float = 0.0
+    hedge: bool = False  # a hedged duplicate that lost the race (core/llm.py); still billed
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), index=True)
@@ -0,0 +1,222 @@
+import asyncio
+import io
+import os
+import time
+import logging
+import resource
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Dict, List, Union, BinaryIO
+
+import pdfplumber
+import pypdfium2 as pdfium
+
+logger = logging.getLogger(__name__)
+
+PdfSource = Union[bytes, BinaryIO]
+
+# pdfplumber is CPU-bound and synchronous: parse in a small dedicated pool so
+# one upload never blocks the event loop (and /health, /auth) of its worker.
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", "2"))
+_parse_executor = ThreadPoolExecutor(max_workers=PDF_PARSE_WORKERS, thread_name_prefix="pdf-parse")
+
+# Per-page parsing of big packets can run in processes instead ("process"),
+# which sidesteps the GIL at the cost of handing each worker the PDF bytes.
+PDF_PAGE_EXECUTOR = os.getenv("PDF_PAGE_EXECUTOR", "thread")
+_page_process_executor = None
+
+# Page fingerprinting: pdfium pulls a page's header text in a few ms, versus a
+# full pdfplumber layout pass. pdfium is not thread-safe (the library, not
+# just a document), so the lock is process-wide: concurrent uploads take turns
+# classifying, at most MAX_CLASSIFIED_PAGES pages each. Pages past that limit
+# are typed "unclassified" and never parsed.
+PAGE_TYPES = ("1040_p1", "1040_p2", "schedule_1", "schedule_2", "schedule_3", "w2", "other", "unclassified")
+RELEVANT_PAGE_TYPES = {"1040_p1", "1040_p2", "schedule_1", "schedule_2", "schedule_3", "w2"}
+HEADER_HEIGHT = 90.0  # points from the top of the page
+MAX_CLASSIFIED_PAGES = 60
+_pdfium_lock = threading.Lock()
+
+
+def _open_pdf(source: PdfSource, **kwargs) -> pdfplumber.PDF:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    else:
+        source.seek(0)
+    return pdfplumber.open(source, **kwargs)
+
+
+def _rss_kb() -> int:
+    """Current resident set size in KB (falls back to the process peak off Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def classify_header(header_text: str, page_text: str = "") -> str:
+    """Page type from a few header tokens (the W-2 title sits at the bottom,
+    so it is looked for in the whole page text)."""
+    header = " ".join(header_text.upper().split())
+    for n in (1, 2, 3):
+        if f"SCHEDULE {n}" in header and "1040" in header:
+            return f"schedule_{n}"
+    if "1040" in header and "PAGE 2" in header:
+        return "1040_p2"
+    if "1040" in header and ("INDIVIDUAL INCOME TAX RETURN" in header or "TAX RETURN FOR SENIORS" in header):
+        return "1040_p1"
+    page = " ".join(page_text.upper().split())
+    if "W-2" in page and "WAGE AND TAX STATEMENT" in page:
+        return "w2"
+    return "other"
+
+
+def classify_pages(source: PdfSource) -> List[str]:
+    """One PAGE_TYPES entry per page; "unclassified" after MAX_CLASSIFIED_PAGES."""
+    if not isinstance(source, (bytes, bytearray)):
+        source.seek(0)  # pdfium reads the handle in place, no bytes copy
+    types = []
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(source)
+        try:
+            for i in range(min(len(pdf), MAX_CLASSIFIED_PAGES)):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                width, height = page.get_size()
+                header = textpage.get_text_bounded(left=0, bottom=height - HEADER_HEIGHT, right=width, top=height)
+                types.append(classify_header(header, textpage.get_text_range()))
+                textpage.close()
+                page.close()
+            page_count = len(pdf)
+        finally:
+            pdf.close()
+    if page_count > MAX_CLASSIFIED_PAGES:
+        logger.warning(f"[pdf] {page_count} pages; only the first {MAX_CLASSIFIED_PAGES} were classified")
+        types += ["unclassified"] * (page_count - MAX_CLASSIFIED_PAGES)
+    return types
+
+
+class _SharedFileReader(io.RawIOBase):
+    """Independent read position over one file handle shared by parse threads."""
+
+    def __init__(self, file: BinaryIO, lock: threading.Lock):
+        self._file = file
+        self._lock = lock
+        self._pos = 0
+        with lock:
+            file.seek(0, io.SEEK_END)
+            self._size = file.tell()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = base + offset
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        with self._lock:
+            self._file.seek(self._pos)
+            data = self._file.read(len(buffer))
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def _parse_page(source: PdfSource, page_number: int, with_words: bool) -> Dict[str, Any]:
+    start = time.perf_counter()
+    with _open_pdf(source, pages=[page_number]) as pdf:
+        page = pdf.pages[0]
+        text = page.extract_text() or ""
+        words = [
+            {"text": w["text"], "x0": w["x0"], "x1": w["x1"], "top": w["top"]}
+            for w in page.extract_words()
+        ] if with_words else None
+        page.close()
+    return {
+        "text": text,
+        "words": words,
+        "parse_ms": round((time.perf_counter() - start) * 1000, 1),
+        "rss_kb": _rss_kb(),
+    }
+
+
+def _page_executor():
+    global _page_process_executor
+    if PDF_PAGE_EXECUTOR != "process":
+        return _parse_executor
+    if _page_process_executor is None:
+        _page_process_executor = ProcessPoolExecutor(
+            max_workers=PDF_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _page_process_executor
+
+
+async def extract_relevant_pages_async(
+    source: PdfSource, with_words: bool = False, fallback_pages: int = 3,
+) -> Dict[str, Any]:
+    """Classify every page cheaply, then fully parse only the relevant ones
+    (1040 pages, Schedules 1-3, W-2s) in parallel on the parse pool.
+
+    Falls back to the first `fallback_pages` pages when nothing is recognised.
+    Returns {"pages", "words", "page_numbers", "page_types", "stats"}; stats
+    carries classification time, per-page parse timings and how many pages
+    were past the classification limit.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    rss_start = _rss_kb()
+
+    types = await loop.run_in_executor(_parse_executor, classify_pages, source)
+    classify_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    wanted = [i for i, t in enumerate(types) if t in RELEVANT_PAGE_TYPES]
+    if not wanted:
+        wanted = list(range(min(fallback_pages, len(types))))
+
+    executor = _page_executor()
+    if executor is _parse_executor and not isinstance(source, (bytes, bytearray)):
+        lock = threading.Lock()
+        readers = [io.BufferedReader(_SharedFileReader(source, lock), 64 * 1024) for _ in wanted]
+    else:
+        if not isinstance(source, (bytes, bytearray)):
+            source.seek(0)
+            source = source.read()  # processes need their own copy
+        readers = [source] * len(wanted)
+
+    parsed = await asyncio.gather(*(
+        loop.run_in_executor(executor, _parse_page, reader, i + 1, with_words)
+        for reader, i in zip(readers, wanted)
+    ))
+
+    stats = {
+        "page_count": len(types),
+        "parsed_pages": len(wanted),
+        "unclassified_pages": types.count("unclassified"),
+        "classify_ms": classify_ms,
+        "parse_ms": round((time.perf_counter() - start) * 1000, 1),
+        "pages": [
+            {"page": i + 1, "type": types[i], "parse_ms": p["parse_ms"]}
+            for i, p in zip(wanted, parsed)
+        ],
+        "rss_peak_kb": max([rss_start] + [p["rss_kb"] for p in parsed]),
+    }
+    stats["rss_growth_kb"] = stats["rss_peak_kb"] - rss_start
+    logger.info(f"[pdf] classified {stats['page_count']} pages in {classify_ms}ms, parsed "
+                f"{stats['parsed_pages']} in {stats['parse_ms']}ms: "
+                + ", ".join(f"p{p['page']}={p['type']}:{p['parse_ms']}ms" for p in stats["pages"]))
+    return {
+        "pages": [p["text"] for p in parsed],
+        "words": [p["words"] for p in parsed] if with_words else None,
+        "page_numbers": [i + 1 for i in wanted],
+        "page_types": [types[i] for i in wanted],
+        "stats": stats,
+    }
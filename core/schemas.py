@@ -132,6 +132,7 @@ class TaxRecordResponse(BaseModel):
     refund_amount: float
     owed_amount: float
     source: str
+    prompt_version: Optional[str] = None
 
 
 # --- Scenario schemas ---
@@ -242,6 +243,7 @@ class RefundExplainerRequest(BaseModel):
     current_year: Optional[int] = None
     prior_data: Optional[dict] = None
     current_data: Optional[dict] = None
+    attribution_mode: str = "waterfall"  # "waterfall" or "shapley"
 
 
 class RefundChangeDriver(BaseModel):
@@ -265,4 +267,45 @@ class RefundExplainerResponse(BaseModel):
     total_change: float
     total_change_direction: str
     drivers: List[RefundChangeDriver]
+    attribution_mode: str = "waterfall"
+    evaluations: int = 0  # TaxMath reconciliations used to attribute the change
     ai_summary: Optional[str] = None
+
+
+class RefundHistoryYear(BaseModel):
+    record_id: int
+    tax_year: int
+    agi: float
+    taxable_income: float
+    total_tax: float
+    balance: float
+    balance_type: str
+
+
+class RefundHistoryResponse(BaseModel):
+    years: List[RefundHistoryYear]
+    changes: List[RefundExplainerResponse]  # one per consecutive pair of years
+    reconciliations: int  # TaxMath runs across the whole timeline
+
+
+class DraftBatchRequest(BaseModel):
+    record_ids: Optional[List[int]] = None
+    scenario_ids: Optional[List[int]] = None
+    format: str = "zip"  # "zip" (one PDF per draft) or "pdf" (one merged packet)
+
+
+class ReextractRequest(BaseModel):
+    record_ids: Optional[List[int]] = None  # default: every stale uploaded record
+
+
+class ExtractionJobResponse(BaseModel):
+    job_id: int
+    kind: str
+    status: str  # "queued", "running", "succeeded", or "failed"
+    tax_year: Optional[int] = None
+    filename: Optional[str] = None
+    record_id: Optional[int] = None
+    result: Optional[dict] = None  # once succeeded: the upload response, or the re-extraction summary
+    error: Optional[str] = None
+    created_at: Any = None
+    finished_at: Any = None
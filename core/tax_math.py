@@ -1,4 +1,8 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+
+# Bump whenever the parameters or formulas below change; results cached on
+# TaxRecord rows under an older version are recomputed.
+TAX_PARAMS_VERSION = "2025.1"
 
 # 2025 TAX PARAMETERS (IRS Rev. Proc. 2024-40)
 STANDARD_DEDUCTION = {
@@ -213,4 +217,22 @@ class TaxMath:
             "child_tax_credit": round(ctc["ctc_total"], 2),
             "balance": round(final_balance, 2),
             "type": "refund" if final_balance >= 0 else "owe",
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def memo_key(data: Dict[str, Any]) -> tuple:
+        return tuple(sorted(data.items()))
+
+    def run_reconciliation_batch(
+        self, rows: List[Dict[str, Any]], memo: Optional[Dict[tuple, Dict[str, Any]]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Reconcile many inputs in one call. Identical inputs are computed once;
+        pass a `memo` dict to share results across calls (len(memo) = evaluations)."""
+        memo = {} if memo is None else memo
+        results = []
+        for row in rows:
+            key = self.memo_key(row)
+            if key not in memo:
+                memo[key] = self.run_reconciliation(row)
+            results.append(memo[key])
+        return results
@@ -0,0 +1,169 @@
+import os
+import re
+import hashlib
+import zipfile
+import tempfile
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse
+
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = 64 * 1024
+# Slack for multipart boundaries and headers around the file part
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+# Batch uploads (/tax-records/upload-batch): whole request body, and documents per batch
+MAX_BATCH_UPLOAD_BYTES = int(float(os.getenv("MAX_BATCH_UPLOAD_MB", "500")) * 1024 * 1024)
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "100"))
+BATCH_PATH_SUFFIX = "/upload-batch"
+# Same threshold as Starlette's UploadFile spool: memory up to 1 MB, disk beyond
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+def limit_exceeded(max_bytes: int) -> str:
+    """'File exceeds the 25 MB upload limit'; KB or bytes for small limits."""
+    if max_bytes >= 1024 * 1024:
+        size = f"{max_bytes / (1024 * 1024):g} MB"
+    elif max_bytes >= 1024:
+        size = f"{max_bytes / 1024:g} KB"
+    else:
+        size = f"{max_bytes} bytes"
+    return f"File exceeds the {size} upload limit"
+
+
+class SpooledUpload:
+    """An uploaded file left in its spooled temp file (memory up to ~1 MB,
+    disk beyond), plus the size and SHA-256 computed while streaming it."""
+
+    def __init__(self, file: BinaryIO, filename: str, size: int, sha256: str):
+        self.file = file
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+
+
+async def spool_upload(file: UploadFile, max_bytes: Optional[int] = None) -> SpooledUpload:
+    """Hash an UploadFile in chunks and check its size; 413 once it passes max_bytes.
+    The parser then reads the same spooled file — no full bytes copy is made.
+
+    By the time this runs, Starlette's form parser has received the whole
+    body and spooled the file to disk, so this check bounds what is parsed,
+    not what is received. Oversized requests are only turned away before
+    their body is read when they declare a Content-Length (see
+    enforce_upload_limit); chunked uploads are received in full first."""
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=limit_exceeded(max_bytes))
+        digest.update(chunk)
+    await file.seek(0)
+    return SpooledUpload(file.file, file.filename or "upload.pdf", size, digest.hexdigest())
+
+
+def _spool_stream(stream: BinaryIO, filename: str, max_bytes: int) -> SpooledUpload:
+    """spool_upload() for a plain file object (a ZIP member); ValueError past max_bytes."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := stream.read(UPLOAD_CHUNK_BYTES):
+        size += len(chunk)
+        if size > max_bytes:
+            spool.close()
+            raise ValueError(limit_exceeded(max_bytes))
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return SpooledUpload(spool, filename, size, digest.hexdigest())
+
+
+def is_zip(upload: SpooledUpload) -> bool:
+    if upload.filename.lower().endswith(".zip"):
+        return True
+    upload.file.seek(0)
+    magic = upload.file.read(4)
+    upload.file.seek(0)
+    return magic == b"PK\x03\x04"
+
+
+def iter_batch_documents(
+    uploads: List[SpooledUpload],
+) -> Iterator[Tuple[str, Optional[SpooledUpload], Optional[str]]]:
+    """(filename, document, error) for every PDF in a batch, in upload order.
+
+    ZIP archives are read member by member from their spooled file; each PDF
+    member is streamed into its own spool, so the archive is never unpacked
+    into memory. Directories and macOS resource forks are skipped; other
+    non-PDF members, oversized members and anything past MAX_BATCH_FILES come
+    back with an error instead of a document. Every document, loose or in an
+    archive, is held to MAX_UPLOAD_BYTES.
+    """
+    count = 0
+    for upload in uploads:
+        if not is_zip(upload):
+            members = [(upload.filename, lambda u=upload: _loose_document(u))]
+        else:
+            try:
+                archive = zipfile.ZipFile(upload.file)
+            except zipfile.BadZipFile:
+                yield upload.filename, None, "Not a valid ZIP archive"
+                continue
+            members = []
+            for info in archive.infolist():
+                if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                    continue
+                members.append((info.filename, lambda a=archive, i=info: _open_member(a, i)))
+
+        for filename, open_document in members:
+            count += 1
+            if count > MAX_BATCH_FILES:
+                yield filename, None, f"Batch is limited to {MAX_BATCH_FILES} documents"
+            elif not filename.lower().endswith(".pdf"):
+                yield filename, None, "Not a PDF"
+            else:
+                try:
+                    yield filename, open_document(), None
+                except (ValueError, zipfile.BadZipFile) as e:
+                    yield filename, None, str(e)
+
+
+def _loose_document(upload: SpooledUpload) -> SpooledUpload:
+    """A PDF uploaded as-is: the batch request limit let it in, the per-document one applies."""
+    if upload.size > MAX_UPLOAD_BYTES:
+        upload.file.close()
+        raise ValueError(limit_exceeded(MAX_UPLOAD_BYTES))
+    return upload
+
+
+def _open_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> SpooledUpload:
+    if info.file_size > MAX_UPLOAD_BYTES:  # declared size; the copy enforces it too
+        raise ValueError(limit_exceeded(MAX_UPLOAD_BYTES))
+    with archive.open(info) as member:
+        return _spool_stream(member, info.filename.rsplit("/", 1)[-1], MAX_UPLOAD_BYTES)
+
+
+_YEAR_RE = re.compile(r"(?<!\d)(20\d{2})(?!\d)")
+
+
+def infer_tax_year(filename: str, default: int) -> int:
+    """Tax year from names like '2022_1040.pdf' or 'smith-1040-2021.pdf'."""
+    match = _YEAR_RE.search(filename)
+    return int(match.group(1)) if match else default
+
+
+async def enforce_upload_limit(request: Request, call_next):
+    """Reject oversized multipart bodies from Content-Length, before they are read.
+
+    Only requests that declare a Content-Length can be turned away here. A
+    chunked upload (no Content-Length) passes through; its body is received
+    and spooled in full, and spool_upload() then rejects it with the same 413."""
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        limit = MAX_BATCH_UPLOAD_BYTES if request.url.path.endswith(BATCH_PATH_SUFFIX) else MAX_UPLOAD_BYTES
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > limit + MULTIPART_OVERHEAD_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": limit_exceeded(limit)},
+            )
+    return await call_next(request)
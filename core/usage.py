@@ -0,0 +1,155 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+from core.metrics import metrics
+from core.models import LLMUsage
+
+logger = logging.getLogger(__name__)
+
+# LLM usage ledger: every OpenAI call is appended to an in-memory buffer and
+# written to the LLMUsage table by a background task, in batches, so
+# accounting never adds a database round trip to the request. The user and
+# endpoint come from the UsageScope the request (or job) runs under.
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "5"))
+USAGE_FLUSH_SIZE = 200
+# Rows kept while the database is unreachable; the oldest are dropped beyond this
+USAGE_MAX_BUFFER = 20000
+
+# USD per 1M tokens (prompt, completion)
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+@dataclass
+class UsageScope:
+    endpoint: str
+    user_id: Optional[int] = None
+
+
+_scope: ContextVar[Optional[UsageScope]] = ContextVar("usage_scope", default=None)
+
+
+@contextmanager
+def usage_scope(endpoint: str, user_id: Optional[int] = None):
+    """Attribute LLM calls made inside the block (and in tasks it starts)."""
+    token = _scope.set(UsageScope(endpoint, user_id))
+    try:
+        yield _scope.get()
+    finally:
+        _scope.reset(token)
+
+
+async def scope_request_usage(request, call_next):
+    """HTTP middleware: attribute the request's LLM calls to its path."""
+    with usage_scope(request.url.path):
+        return await call_next(request)
+
+
+def set_usage_user(user_id: int) -> None:
+    """Called once the request is authenticated. The scope object is shared
+    with the request's tasks and threads, so the user id reaches them too."""
+    scope = _scope.get()
+    if scope is not None:
+        scope.user_id = user_id
+
+
+class UsageLedger:
+    def __init__(self, flush_seconds: float = USAGE_FLUSH_SECONDS, flush_size: int = USAGE_FLUSH_SIZE,
+                 max_buffer: int = USAGE_MAX_BUFFER):
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+        self.engine: Optional[Engine] = None
+        self._buffer: deque = deque(maxlen=max_buffer)
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int, latency_ms: float,
+               hedge: bool = False) -> None:
+        """Buffer one call; never blocks or touches the database."""
+        scope = _scope.get()
+        if len(self._buffer) == self._buffer.maxlen:
+            metrics.incr("usage.dropped")
+        self._buffer.append(LLMUsage(
+            user_id=scope.user_id if scope else None,
+            endpoint=scope.endpoint if scope else "unknown",
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            latency_ms=round(latency_ms, 1),
+            cost_usd=call_cost(model, prompt_tokens, completion_tokens),
+            hedge=hedge,
+        ))
+        if self._wake is not None and len(self._buffer) >= self.flush_size:
+            self._wake.set()
+
+    async def start(self, engine: Engine) -> None:
+        self.engine = engine
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        self._wake = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Write everything buffered so far in one transaction, off the event
+        loop. Rows go back to the buffer if the write fails."""
+        if self.engine is None or not self._buffer:
+            return 0
+        lock = self._flush_lock or asyncio.Lock()
+        async with lock:
+            rows = [self._buffer.popleft() for _ in range(len(self._buffer))]
+            if not rows:
+                return 0
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except Exception as e:
+                logger.warning(f"[usage] could not write {len(rows)} usage rows: {e}")
+                metrics.incr("usage.flush_errors")
+                self._buffer.extendleft(reversed(rows))
+                return 0
+            metrics.incr("usage.rows_written", len(rows))
+            return len(rows)
+
+    def _write(self, rows) -> None:
+        with Session(self.engine) as session:
+            session.add_all(rows)
+            session.commit()
+
+
+usage_ledger = UsageLedger()
@@ -3,6 +3,8 @@ import type {
   TokenResponse,
   RefundExplainerRequest,
   RefundExplainerResponse,
+  RefundHistoryResponse,
+  AttributionMode,
   LifeEventPreset,
   LifeEventApplyRequest,
   LifeEventApplyResponse,
@@ -73,6 +75,14 @@ export async function explainRefundChange(
   });
 }
 
+export async function getRefundHistory(
+  attribution_mode: AttributionMode = "waterfall"
+): Promise<RefundHistoryResponse> {
+  return request<RefundHistoryResponse>(
+    `/insights/history?attribution_mode=${attribution_mode}`
+  );
+}
+
 // --- Life Events ---
 
 export async function getLifeEvents(): Promise<LifeEventPreset[]> {
@@ -74,9 +74,16 @@ export interface RefundChangeDriver {
   explanation: string;
 }
 
+export type AttributionMode = "waterfall" | "shapley";
+
 export interface RefundExplainerRequest {
-  prior_data: TaxData;
-  current_data: TaxData;
+  prior_data?: TaxData;
+  current_data?: TaxData;
+  prior_record_id?: number;
+  current_record_id?: number;
+  prior_year?: number;
+  current_year?: number;
+  attribution_mode?: AttributionMode;
 }
 
 export interface RefundExplainerResponse {
@@ -89,9 +96,27 @@ export interface RefundExplainerResponse {
   total_change: number;
   total_change_direction: ChangeDirection;
   drivers: RefundChangeDriver[];
+  attribution_mode: AttributionMode;
+  evaluations: number;
   ai_summary: string | null;
 }
 
+export interface RefundHistoryYear {
+  record_id: number;
+  tax_year: number;
+  agi: number;
+  taxable_income: number;
+  total_tax: number;
+  balance: number;
+  balance_type: "refund" | "owe";
+}
+
+export interface RefundHistoryResponse {
+  years: RefundHistoryYear[];
+  changes: RefundExplainerResponse[];
+  reconciliations: number;
+}
+
 // --- Life Events ---
 
 export interface LifeEventPreset {
@@ -0,0 +1,157 @@
+import re
+import asyncio
+import zipfile
+import tempfile
+from collections import deque
+from typing import Callable, Iterable, List, Tuple
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session, select
+from PyPDF2 import PdfWriter
+from core.database import get_session
+from core.models import User, TaxRecord, Scenario
+from core.auth import get_current_user
+from core.schemas import DraftBatchRequest
+from agents.drafting_agent import DRAFT_SPOOL_MAX_MEMORY, DRAFT_WORKERS, run_drafting, shared_drafter
+
+router = APIRouter(prefix="/drafts", tags=["drafts"])
+
+# A batch keeps at most DRAFT_WORKERS drafts in flight on the drafting pool,
+# so it holds that many in memory however many it contains
+MAX_BATCH_DRAFTS = 200
+DRAFT_CHUNK_BYTES = 64 * 1024
+
+
+def iter_file(file, chunk_size: int = DRAFT_CHUNK_BYTES):
+    """Yield a rewound file in chunks and close it (StreamingResponse body)."""
+    try:
+        while chunk := file.read(chunk_size):
+            yield chunk
+    finally:
+        file.close()
+
+
+def _draft_data(row) -> dict:
+    return {"filing_status": row.filing_status, "wages": row.wages or 0.0, "agi": row.agi or 0.0}
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", text).strip("_")[:40] or "scenario"
+
+
+def _batch_entries(req: DraftBatchRequest, user_id: int, session: Session) -> List[Tuple[str, dict]]:
+    """(filename, draft data) per requested row, in request order; 404 if
+    any id is missing or belongs to another user."""
+    entries = []
+    for model, ids, name in (
+        (TaxRecord, req.record_ids, lambda r: f"record_{r.id}_{r.tax_year}.pdf"),
+        (Scenario, req.scenario_ids, lambda s: f"scenario_{s.id}_{_slug(s.name)}.pdf"),
+    ):
+        if not ids:
+            continue
+        rows = session.exec(select(model).where(model.user_id == user_id, model.id.in_(ids))).all()
+        found = {row.id: row for row in rows}
+        missing = [i for i in ids if i not in found]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"{model.__name__} not found: {missing}")
+        entries += [(name(found[i]), _draft_data(found[i])) for i in ids]
+    return entries
+
+
+async def _in_order(render: Callable, items: Iterable, window: int = DRAFT_WORKERS):
+    """Run render(item) on the drafting pool, at most `window` at a time, and
+    yield the results in item order."""
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(asyncio.ensure_future(run_drafting(render, item)))
+            if len(pending) >= window:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class _ChunkSink:
+    """Write-only stream that hands out what was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+async def _zip_stream(entries: List[Tuple[str, dict]]):
+    """A ZIP of one PDF per entry, sent as each draft is finished. Members are
+    stored, not deflated: the PDFs' streams are already compressed, and
+    deflating here would run on the event loop. What is left per chunk (a
+    copy and a CRC-32) is cheap."""
+    drafter = shared_drafter()
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        filenames = iter([filename for filename, _ in entries])
+        async for draft, _ in _in_order(drafter.render, [data for _, data in entries]):
+            filename = next(filenames)
+            with draft, archive.open(filename, "w") as member:
+                while chunk := draft.read(DRAFT_CHUNK_BYTES):
+                    member.write(chunk)
+                    if data := sink.drain():
+                        yield data
+            if data := sink.drain():
+                yield data
+    if data := sink.drain():  # central directory
+        yield data
+
+
+async def _pdf_stream(entries: List[Tuple[str, dict]]):
+    """All drafts as one PDF. Pages come from the worker pool in order; the
+    template's pages and static layer are stored once in the packet, so it
+    grows by one small overlay per draft. PDF's cross-reference table comes
+    last, so bytes are sent once every page is in."""
+    drafter = shared_drafter()
+    writer = PdfWriter()
+    async for page in _in_order(drafter.draft_page, [data for _, data in entries]):
+        await run_drafting(drafter.append, writer, page)
+    packet = tempfile.SpooledTemporaryFile(max_size=DRAFT_SPOOL_MAX_MEMORY)
+    await run_drafting(writer.write, packet)
+    packet.seek(0)
+    for chunk in iter_file(packet):
+        yield chunk
+
+
+@router.post("/batch")
+async def batch_drafts(
+    req: DraftBatchRequest,
+    user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    """Drafts for many tax records and/or scenarios in one response:
+    format "zip" (one PDF per row, streamed as they are rendered) or "pdf"
+    (one merged packet, in request order)."""
+    if req.format not in ("zip", "pdf"):
+        raise HTTPException(status_code=400, detail="format must be 'zip' or 'pdf'")
+    entries = _batch_entries(req, user.id, session)
+    if not entries:
+        raise HTTPException(status_code=400, detail="Provide record_ids and/or scenario_ids")
+    if len(entries) > MAX_BATCH_DRAFTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_DRAFTS} drafts per batch")
+
+    if req.format == "zip":
+        body, media_type, filename = _zip_stream(entries), "application/zip", "Tax_Drafts.zip"
+    else:
+        body, media_type, filename = _pdf_stream(entries), "application/pdf", "Tax_Drafts.pdf"
+    return StreamingResponse(
+        body, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -1,30 +1,40 @@
-import os
-from fastapi import APIRouter, Depends, HTTPException
-from core.tax_math import TaxMath
+import json
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlmodel import Session, select
+from core.database import get_session
+from core.tax_math import TaxMath, TAX_PARAMS_VERSION
 from core.schemas import (
     OptimizationRequest, OptimizationResponse, Recommendation,
     RefundExplainerRequest, RefundExplainerResponse, RefundChangeDriver,
+    RefundHistoryYear, RefundHistoryResponse,
 )
-from core.auth import get_current_user
-from core.models import User
+from core.auth import get_current_user, get_optional_user
+from core.llm import AI_SUMMARY_DEADLINE_SECONDS, configured_api_key, deadline, until_disconnected
+from core.models import User, TaxRecord
 from agents.optimization_agent import OptimizationAgent
-from agents.refund_explainer_agent import RefundExplainerAgent
+from agents.refund_explainer_agent import RefundExplainerAgent, ATTRIBUTION_MODES
 
 router = APIRouter(prefix="/insights", tags=["insights"])
 
 math_engine = TaxMath()
-API_KEY = os.getenv("OPENAI_API_KEY")
+API_KEY = configured_api_key()
+
+# Explanations persisted per TaxRecord row (keyed by prior record + mode + inputs)
+MAX_CACHED_EXPLANATIONS = 8
 
 
 @router.post("/optimize", response_model=OptimizationResponse)
 async def optimize_taxes(
     req: OptimizationRequest,
+    request: Request,
     user: User = Depends(get_current_user),
 ):
     agent = OptimizationAgent(math_engine=math_engine, api_key=API_KEY)
 
     tax_data = req.model_dump()
-    result = await agent.analyze_with_ai_summary(tax_data)
+    with deadline(AI_SUMMARY_DEADLINE_SECONDS):
+        result = await until_disconnected(request, agent.analyze_with_ai_summary(tax_data))
 
     return OptimizationResponse(
         current_tax=result["current_tax"],
@@ -39,19 +49,113 @@ async def optimize_taxes(
 @router.post("/explain-refund-change", response_model=RefundExplainerResponse)
 async def explain_refund_change(
     req: RefundExplainerRequest,
+    request: Request,
+    user: Optional[User] = Depends(get_optional_user),
+    session: Session = Depends(get_session),
 ):
-    """Explain WHY the user's refund/owed amount changed between two tax years."""
-    if not req.prior_data or not req.current_data:
+    """Explain WHY the user's refund/owed amount changed between two tax years.
+
+    Accepts stored records (prior_record_id/current_record_id or
+    prior_year/current_year) or raw prior_data/current_data dicts.
+    """
+    agent = RefundExplainerAgent(math_engine=math_engine, api_key=API_KEY)
+
+    if req.prior_data and req.current_data:
+        try:
+            with deadline(AI_SUMMARY_DEADLINE_SECONDS):
+                result = await until_disconnected(request, agent.explain_with_ai_summary(
+                    req.prior_data, req.current_data, mode=req.attribution_mode,
+                ))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return _explainer_response(result)
+
+    if req.prior_record_id and req.current_record_id:
+        ids = [req.prior_record_id, req.current_record_id]
+        lookup = TaxRecord.id
+    elif req.prior_year and req.current_year:
+        ids = [req.prior_year, req.current_year]
+        lookup = TaxRecord.tax_year
+    else:
         raise HTTPException(
             status_code=400,
-            detail="Provide prior_data and current_data",
+            detail="Provide prior_record_id and current_record_id, prior_year and current_year, "
+                   "or prior_data and current_data",
         )
-    prior = req.prior_data
-    current = req.current_data
+    if user is None:
+        raise HTTPException(status_code=401, detail="Login required to explain stored tax records")
 
-    agent = RefundExplainerAgent(math_engine=math_engine, api_key=API_KEY)
-    result = await agent.explain_with_ai_summary(prior, current)
+    # One query for both rows, scoped to the user; latest record wins per year
+    rows = session.exec(
+        select(TaxRecord)
+        .where(TaxRecord.user_id == user.id, lookup.in_(ids))
+        .order_by(TaxRecord.id)
+    ).all()
+    found = {getattr(r, lookup.key): r for r in rows}
+    if ids[0] not in found or ids[1] not in found:
+        raise HTTPException(status_code=404, detail="Tax record not found")
+    prior, current = found[ids[0]], found[ids[1]]
+
+    if req.attribution_mode not in ATTRIBUTION_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown attribution mode '{req.attribution_mode}'")
+
+    prior_data, current_data = prior.model_dump(), current.model_dump()
+    key = _explanation_key(agent, prior, prior_data, current_data, req.attribution_mode)
+    explanations = json.loads(current.explanation_cache or "{}")
+    if key in explanations:
+        return _explainer_response(explanations[key])
+
+    prior_result = _cached_reconciliation(agent, prior, prior_data)
+    current_result = _cached_reconciliation(agent, current, current_data)
+    with deadline(AI_SUMMARY_DEADLINE_SECONDS):
+        result = await until_disconnected(request, agent.explain_with_ai_summary(
+            prior_data, current_data, mode=req.attribution_mode,
+            prior_result=prior_result, current_result=current_result,
+        ))
+
+    # Keep only the most recent explanations per row. One whose AI summary was
+    # due but failed (ai_summary None) is not stored, so the next request retries.
+    summary_failed = agent.api_key and result["drivers"] and result.get("ai_summary") is None
+    if not summary_failed:
+        explanations[key] = result
+        current.explanation_cache = json.dumps(dict(list(explanations.items())[-MAX_CACHED_EXPLANATIONS:]))
+    session.add(prior)
+    session.add(current)
+    session.commit()
+
+    return _explainer_response(result)
+
+
+def _cached_reconciliation(agent: RefundExplainerAgent, record: TaxRecord, record_data: dict) -> dict:
+    """Reconciliation stored on the row, recomputed (and re-stored, uncommitted)
+    when the tax parameters or the record's inputs changed."""
+    input_hash = agent.input_hash(record_data)
+    cached = json.loads(record.reconciliation_cache or "{}")
+    if cached.get("version") == TAX_PARAMS_VERSION and cached.get("input_hash") == input_hash:
+        return cached["result"]
+
+    result = agent.reconcile_record(record_data)
+    record.reconciliation_cache = json.dumps({
+        "version": TAX_PARAMS_VERSION,
+        "input_hash": input_hash,
+        "result": result,
+    })
+    return result
 
+
+def _explanation_key(
+    agent: RefundExplainerAgent, prior: TaxRecord, prior_data: dict, current_data: dict, mode: str,
+) -> str:
+    # The years are shown in the result (prior_year/current_year) but are not
+    # reconciliation inputs, so the input hashes do not cover them
+    return ":".join([
+        str(prior.id), mode, TAX_PARAMS_VERSION,
+        str(prior_data.get("tax_year")), str(current_data.get("tax_year")),
+        agent.input_hash(prior_data), agent.input_hash(current_data),
+    ])
+
+
+def _explainer_response(result: dict) -> RefundExplainerResponse:
     return RefundExplainerResponse(
         prior_year=result["prior_year"],
         current_year=result["current_year"],
@@ -62,5 +166,69 @@ async def explain_refund_change(
         total_change=result["total_change"],
         total_change_direction=result["total_change_direction"],
         drivers=[RefundChangeDriver(**d) for d in result["drivers"]],
+        attribution_mode=result["attribution_mode"],
+        evaluations=result["evaluations"],
         ai_summary=result.get("ai_summary"),
     )
+
+
+@router.get("/history", response_model=RefundHistoryResponse)
+def refund_history(
+    attribution_mode: str = "waterfall",
+    user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    """Multi-year timeline: every year reconciled once (or reused from the row),
+    plus the refund-change waterfall for each consecutive pair built from those
+    shared results."""
+    if attribution_mode not in ATTRIBUTION_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown attribution mode '{attribution_mode}'")
+    records = session.exec(
+        select(TaxRecord)
+        .where(TaxRecord.user_id == user.id)
+        .order_by(TaxRecord.tax_year, TaxRecord.id)
+    ).all()
+
+    # Latest record wins when a year was entered more than once
+    by_year = {r.tax_year: r for r in records}
+    rows = [by_year[year] for year in sorted(by_year)]
+    timeline = [r.model_dump() for r in rows]
+
+    agent = RefundExplainerAgent(math_engine=math_engine, api_key=API_KEY)
+    cached = [r.reconciliation_cache for r in rows]
+    results = [_cached_reconciliation(agent, r, data) for r, data in zip(rows, timeline)]
+    stale = [r for r, before in zip(rows, cached) if r.reconciliation_cache != before]
+    reconciliations = len(stale)
+
+    changes = []
+    for i in range(1, len(timeline)):
+        try:
+            explained = agent.explain(
+                timeline[i - 1], timeline[i], mode=attribution_mode,
+                prior_result=results[i - 1], current_result=results[i],
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        reconciliations += explained["evaluations"]
+        changes.append(_explainer_response(explained))
+
+    if stale:
+        session.add_all(stale)
+        session.commit()
+
+    return RefundHistoryResponse(
+        years=[
+            RefundHistoryYear(
+                record_id=r["id"],
+                tax_year=r["tax_year"],
+                agi=res["agi_2025"],
+                taxable_income=res["taxable_income_2025"],
+                total_tax=res["total_tax_2025"],
+                balance=res["balance"],
+                balance_type=res["type"],
+            )
+            for r, res in zip(timeline, results)
+        ],
+        changes=changes,
+        reconciliations=reconciliations,
+    )
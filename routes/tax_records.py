@@ -1,42 +1,46 @@
+import io
 import os
+import json
+import time
+import asyncio
 import logging
+from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request
-from sqlmodel import Session, select
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlmodel import Session, select, func, or_
 from core.database import get_session
-from core.models import User, TaxRecord
+from core.models import User, TaxRecord, ExtractionJob
 from core.auth import get_current_user
-from core.schemas import TaxRecordCreate, TaxRecordUpdate, TaxRecordResponse
+from core.schemas import (
+    TaxRecordCreate, TaxRecordUpdate, TaxRecordResponse, ExtractionJobResponse, ReextractRequest,
+)
+from core.compression import compress_text, decompress_text
+from core.uploads import spool_upload, iter_batch_documents, infer_tax_year, MAX_BATCH_UPLOAD_BYTES
+from core.metrics import StageTimer, metrics
+from core.llm import EXTRACTION_DEADLINE_SECONDS, configured_api_key, deadline, until_disconnected
+from core.jobs import job_queue, TERMINAL_STATUSES
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/tax-records", tags=["tax-records"])
 
+JOB_POLL_SECONDS = 0.5  # SSE status poll interval
 
-@router.post("/upload", response_model=dict)
-async def upload_tax_return(
-    file: UploadFile = File(...),
-    tax_year: int = 2024,
-    user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
-):
-    """Upload a 1040 PDF, extract data via AI, and save as a tax record."""
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="OPENAI_API_KEY not configured")
+# Batch upload: documents extracted at once, rows per INSERT/commit, and the
+# longest a finished document waits for its batch to fill before it is written
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_INSERT_SIZE = 10
+BATCH_FLUSH_SECONDS = 2.0
+DEFAULT_UPLOAD_TAX_YEAR = 2024
 
-    from agents.extraction_agent import ExtractionAgent
-    extractor = ExtractionAgent(api_key=api_key)
-
-    pdf_bytes = await file.read()
-    extracted = await extractor.run(pdf_bytes)
+# Re-extraction from stored text: records per batch/commit, concurrent LLM calls
+REEXTRACT_BATCH_SIZE = 20
+REEXTRACT_CONCURRENCY = int(os.getenv("REEXTRACT_CONCURRENCY", "4"))
 
-    if extracted.get("status") == "error":
-        raise HTTPException(status_code=422, detail=extracted.get("message", "Extraction failed"))
 
-    # Save to TaxRecord
-    record = TaxRecord(
-        user_id=user.id,
-        tax_year=tax_year,
+def extracted_fields(extracted: dict) -> dict:
+    """TaxRecord column values from ExtractionAgent output."""
+    return dict(
         filing_status=extracted.get("filing_status", "Single"),
         dependents_count=extracted.get("dependents_count") or 0,
         wages=extracted.get("wages") or 0,
@@ -60,21 +64,420 @@ async def upload_tax_return(
         total_tax=extracted.get("total_tax") or 0,
         refund_amount=extracted.get("refund_amount") or 0,
         owed_amount=extracted.get("owed_amount") or 0,
+    )
+
+
+def record_from_extraction(user_id: int, tax_year: int, result: dict) -> TaxRecord:
+    """TaxRecord for an uploaded return, from an ExtractionAgent.extract() result.
+    The parsed text is kept (compressed) so later prompt versions can replay it."""
+    return TaxRecord(
+        user_id=user_id,
+        tax_year=tax_year,
+        **extracted_fields(result["data"]),
         source="pdf_upload",
+        extraction_text=compress_text(result["raw_text"]) if result.get("raw_text") else None,
+        prompt_version=result.get("prompt_version"),
     )
-    session.add(record)
-    session.commit()
-    session.refresh(record)
 
+
+def _upload_response(record: TaxRecord, result: dict) -> dict:
     return {
         "status": "success",
         "record_id": record.id,
         "tax_year": record.tax_year,
-        "extracted_data": extracted,
+        "extracted_data": result["data"],
+        "cache_hit": result["cache_hit"],
+        "extraction_method": result["method"],
+        "extraction_model": result.get("model"),
+        "field_confidence": result["confidence"],
         "message": "Tax return uploaded and extracted successfully. Review the data below.",
     }
 
 
+def _extractor():
+    api_key = configured_api_key()
+    if not api_key:
+        raise HTTPException(status_code=500, detail="OPENAI_API_KEY not configured")
+    from agents.extraction_agent import ExtractionAgent
+    return ExtractionAgent(api_key=api_key)
+
+
+@router.post("/upload", response_model=dict)
+async def upload_tax_return(
+    request: Request,
+    file: UploadFile = File(...),
+    tax_year: int = 2024,
+    mode: str = "sync",
+    debug: bool = False,
+    user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    """Upload a 1040 PDF, extract data via AI, and save as a tax record.
+    With ?debug=true the response carries per-stage timings and token counts.
+
+    ?mode=job returns 202 with a job id straight away; the extraction runs on
+    the background worker pool (poll GET /tax-records/jobs/{id} or stream
+    /tax-records/jobs/{id}/events).
+
+    A synchronous upload gives the extraction EXTRACTION_DEADLINE_SECONDS and
+    cancels it if the client disconnects; 503 when OpenAI is unavailable and
+    the layout reader has nothing to fall back on."""
+    if mode not in ("sync", "job"):
+        raise HTTPException(status_code=400, detail="mode must be 'sync' or 'job'")
+    extractor = _extractor()
+
+    if mode == "job":
+        upload = await spool_upload(file)  # size cap and hash; rewinds the file
+        job = ExtractionJob(
+            user_id=user.id,
+            kind="upload",
+            tax_year=tax_year,
+            filename=upload.filename,
+            sha256=upload.sha256,
+            # UploadFile.read() reads a disk-spooled file on the threadpool
+            pdf_data=await file.read(),
+        )
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+        job_queue.submit(job.id, session.get_bind())
+        return JSONResponse(status_code=202, content={
+            "status": "queued",
+            "job_id": job.id,
+            "status_url": f"/tax-records/jobs/{job.id}",
+            "events_url": f"/tax-records/jobs/{job.id}/events",
+        })
+
+    with StageTimer() as timer:
+        try:
+            with timer.stage("spool"):
+                upload = await spool_upload(file)
+            timer.add_count("bytes", upload.size)
+            with timer.stage("extract"), deadline(EXTRACTION_DEADLINE_SECONDS):
+                result = await until_disconnected(request, extractor.extract(upload.file, sha256=upload.sha256, tax_year=tax_year))
+            extracted = result["data"]
+
+            if extracted.get("reason") == "llm_unavailable":
+                raise HTTPException(status_code=503, detail=extracted["message"])
+            if extracted.get("status") == "error":
+                raise HTTPException(status_code=422, detail=extracted.get("message", "Extraction failed"))
+
+            # Save to TaxRecord
+            with timer.stage("db_insert"):
+                record = record_from_extraction(user.id, tax_year, result)
+                session.add(record)
+                session.commit()
+                session.refresh(record)
+        finally:
+            timer.publish("upload")
+
+    response = _upload_response(record, result)
+    if debug:
+        response["timings"] = timer.as_dict()
+    return response
+
+
+@router.post("/upload-batch")
+async def upload_tax_return_batch(
+    files: List[UploadFile] = File(...),
+    tax_year: Optional[int] = None,
+    user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    """Upload many 1040 PDFs at once: any mix of PDFs and ZIP archives of PDFs.
+
+    Documents are extracted BATCH_CONCURRENCY at a time and the response is
+    streamed as NDJSON, one line per document as it finishes (index, filename,
+    status, tax_year, record_id or error), then a final {"summary": ...} line.
+    The tax year comes from each filename (e.g. "2022_1040.pdf"), falling back
+    to ?tax_year.
+    """
+    extractor = _extractor()
+    uploads = [await spool_upload(file, max_bytes=MAX_BATCH_UPLOAD_BYTES) for file in files]
+    default_year = tax_year or DEFAULT_UPLOAD_TAX_YEAR
+    return StreamingResponse(
+        _run_batch(extractor, uploads, user.id, default_year, session.get_bind()),
+        media_type="application/x-ndjson",
+    )
+
+
+async def _run_batch(extractor, uploads, user_id: int, default_year: int, bind):
+    start = time.perf_counter()
+    documents = iter_batch_documents(uploads)
+    results: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    in_flight = set()
+
+    async def extract_one(index: int, filename: str, document) -> None:
+        year = infer_tax_year(filename, default_year)
+        item = {"index": index, "filename": filename, "tax_year": year}
+        try:
+            result = await extractor.extract(document.file, sha256=document.sha256, tax_year=year)
+            extracted = result["data"]
+            if extracted.get("status") == "error":
+                item.update(status="error", error=extracted.get("message", "Extraction failed"))
+            else:
+                item.update(
+                    status="success",
+                    record=record_from_extraction(user_id, year, result),
+                    extraction_method=result["method"],
+                    cache_hit=result["cache_hit"],
+                )
+        except Exception as e:
+            item.update(status="error", error=str(e))
+        finally:
+            document.file.close()
+            slots.release()
+        await results.put(item)
+
+    async def produce() -> None:
+        # The archive is read on a thread, one document ahead of a free slot,
+        # so at most BATCH_CONCURRENCY documents are spooled at a time
+        count = 0
+        try:
+            while True:
+                await slots.acquire()
+                entry = await asyncio.to_thread(next, documents, None)
+                if entry is None:
+                    slots.release()
+                    break
+                filename, document, error = entry
+                if error:
+                    slots.release()
+                    await results.put({"index": count, "filename": filename, "status": "error", "error": error})
+                else:
+                    task = asyncio.create_task(extract_one(count, filename, document))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+                count += 1
+        finally:
+            await results.put(count)  # total, once every document is scheduled
+
+    producer = asyncio.create_task(produce())
+    total = None
+    emitted = 0
+    succeeded = 0
+    pending_rows = []
+    try:
+        while total is None or emitted < total:
+            try:
+                item = await asyncio.wait_for(results.get(), BATCH_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                item = None
+            if isinstance(item, int):
+                total = item
+            elif item is not None and item["status"] == "success":
+                pending_rows.append(item)
+            elif item is not None:
+                emitted += 1
+                metrics.incr("batch.documents", status="error")
+                yield json.dumps(item) + "\n"
+
+            done = total is not None and emitted + len(pending_rows) >= total
+            if pending_rows and (item is None or done or len(pending_rows) >= BATCH_INSERT_SIZE):
+                for line in _insert_batch(bind, pending_rows):
+                    succeeded += line["status"] == "success"
+                    metrics.incr("batch.documents", status=line["status"])
+                    yield json.dumps(line) + "\n"
+                emitted += len(pending_rows)
+                pending_rows = []
+
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        metrics.observe("batch.total_ms", elapsed_ms)
+        yield json.dumps({"summary": {
+            "documents": total, "succeeded": succeeded, "failed": total - succeeded, "elapsed_ms": elapsed_ms,
+        }}) + "\n"
+    finally:
+        # Client went away (or we are done): stop reading and extracting
+        producer.cancel()
+        for task in list(in_flight):
+            task.cancel()
+
+
+def _insert_batch(bind, items: List[dict]) -> List[dict]:
+    """Write the extracted records of `items` in one INSERT batch and commit."""
+    records = [item.pop("record") for item in items]
+    try:
+        with Session(bind, expire_on_commit=False) as session:
+            session.add_all(records)
+            session.commit()
+    except Exception as e:
+        logger.exception("[batch] insert failed")
+        return [{**item, "status": "error", "error": f"Could not save record: {e}"} for item in items]
+    return [{**item, "record_id": record.id} for item, record in zip(items, records)]
+
+
+async def _run_upload_job(job: ExtractionJob, session: Session) -> dict:
+    """Job handler: the synchronous upload path, minus the HTTP request."""
+    extractor = _extractor()
+    with StageTimer() as timer:
+        try:
+            timer.add_count("bytes", len(job.pdf_data))
+            with timer.stage("extract"):
+                result = await extractor.extract(io.BytesIO(job.pdf_data), sha256=job.sha256, tax_year=job.tax_year)
+            extracted = result["data"]
+            if extracted.get("status") == "error":
+                raise ValueError(extracted.get("message", "Extraction failed"))
+            with timer.stage("db_insert"):
+                record = record_from_extraction(job.user_id, job.tax_year, result)
+                session.add(record)
+                session.commit()
+                session.refresh(record)
+        finally:
+            timer.publish("upload_job")
+    return {"record_id": record.id, "result": _upload_response(record, result)}
+
+
+job_queue.register("upload", _run_upload_job)
+
+
+def _stale_records(user_id: int, prompt_version: str, record_ids: Optional[List[int]] = None):
+    """Uploaded records whose stored text was extracted with an older prompt.
+    Layout-read records and records the user has edited are left alone."""
+    query = select(TaxRecord).where(
+        TaxRecord.user_id == user_id,
+        TaxRecord.extraction_text.is_not(None),
+        TaxRecord.user_edited == False,  # noqa: E712
+        or_(TaxRecord.prompt_version.is_(None), TaxRecord.prompt_version.not_in(("layout", prompt_version))),
+    )
+    if record_ids is not None:
+        query = query.where(TaxRecord.id.in_(record_ids))
+    return query
+
+
+@router.post("/reextract", response_model=dict)
+def reextract_tax_records(
+    req: ReextractRequest = ReextractRequest(),
+    user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    """Queue a background job that replays the stored text of uploads
+    extracted with an older prompt version through the current one."""
+    _extractor()
+    from agents.extraction_agent import PROMPT_VERSION
+    stale = session.exec(
+        select(func.count()).select_from(_stale_records(user.id, PROMPT_VERSION, req.record_ids).subquery())
+    ).one()
+    if not stale:
+        return {"status": "up_to_date", "records": 0, "prompt_version": PROMPT_VERSION}
+
+    job = ExtractionJob(user_id=user.id, kind="reextract", params=json.dumps({"record_ids": req.record_ids}))
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    job_queue.submit(job.id, session.get_bind())
+    return JSONResponse(status_code=202, content={
+        "status": "queued",
+        "job_id": job.id,
+        "records": stale,
+        "prompt_version": PROMPT_VERSION,
+        "status_url": f"/tax-records/jobs/{job.id}",
+        "events_url": f"/tax-records/jobs/{job.id}/events",
+    })
+
+
+async def _run_reextract_job(job: ExtractionJob, session: Session) -> dict:
+    """Job handler: stored text -> current prompt, REEXTRACT_BATCH_SIZE records
+    per batch (one commit each), REEXTRACT_CONCURRENCY LLM calls at a time.
+    PDFs are never re-parsed."""
+    from agents.extraction_agent import PROMPT_VERSION
+    extractor = _extractor()
+    record_ids = json.loads(job.params or "{}").get("record_ids")
+    slots = asyncio.Semaphore(REEXTRACT_CONCURRENCY)
+    summary = {"prompt_version": PROMPT_VERSION, "records": 0, "updated": 0, "failed": []}
+
+    async def replay(record: TaxRecord) -> dict:
+        async with slots:
+            return await extractor.extract_from_text(decompress_text(record.extraction_text), record.tax_year)
+
+    after_id = 0
+    while True:
+        records = session.exec(
+            _stale_records(job.user_id, PROMPT_VERSION, record_ids)
+            .where(TaxRecord.id > after_id)
+            .order_by(TaxRecord.id)
+            .limit(REEXTRACT_BATCH_SIZE)
+        ).all()
+        if not records:
+            break
+        after_id = records[-1].id
+        results = await asyncio.gather(*(replay(r) for r in records), return_exceptions=True)
+        for record, result in zip(records, results):
+            summary["records"] += 1
+            if isinstance(result, Exception) or result["data"].get("status") == "error":
+                summary["failed"].append(record.id)
+                continue
+            for field, value in extracted_fields(result["data"]).items():
+                setattr(record, field, value)
+            record.prompt_version = result["prompt_version"]
+            summary["updated"] += 1
+        session.commit()
+        metrics.incr("reextract.records", len(records))
+
+    return {"result": summary, "record_id": None}
+
+
+job_queue.register("reextract", _run_reextract_job)
+
+
+def _job_response(job: ExtractionJob) -> dict:
+    return ExtractionJobResponse(
+        job_id=job.id,
+        kind=job.kind,
+        status=job.status,
+        tax_year=job.tax_year,
+        filename=job.filename,
+        record_id=job.record_id,
+        result=json.loads(job.result) if job.result else None,
+        error=job.error,
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+    ).model_dump(mode="json")
+
+
+def _get_job(session: Session, job_id: int, user: User) -> ExtractionJob:
+    job = session.get(ExtractionJob, job_id)
+    if not job or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=ExtractionJobResponse)
+def get_job(
+    job_id: int,
+    user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    """Status of a background upload; `result` is the upload response once it succeeds."""
+    return _job_response(_get_job(session, job_id, user))
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(
+    job_id: int,
+    user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    """Server-sent events: one `status` event per status change, ending once
+    the job has succeeded or failed."""
+    _get_job(session, job_id, user)
+    bind = session.get_bind()
+
+    async def events():
+        last_status = None
+        while True:
+            with Session(bind) as poll_session:
+                payload = _job_response(poll_session.get(ExtractionJob, job_id))
+            if payload["status"] != last_status:
+                last_status = payload["status"]
+                yield f"event: status\ndata: {json.dumps(payload)}\n\n"
+            if last_status in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 @router.post("", response_model=TaxRecordResponse)
 def create_tax_record(
     req: TaxRecordCreate,
@@ -174,6 +577,7 @@ def update_tax_record(
     update_data = req.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         setattr(record, field, value)
+    record.user_edited = True
 
     session.add(record)
     session.commit()
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import case
+from sqlmodel import Session, select, func
+from core.database import get_session
+from core.models import LLMUsage, User
+from core.auth import get_optional_user, is_operator
+from core.usage import usage_ledger
+
+router = APIRouter(prefix="/usage", tags=["usage"])
+
+GROUP_COLUMNS = {
+    "user": LLMUsage.user_id,
+    "endpoint": LLMUsage.endpoint,
+    "model": LLMUsage.model,
+    "day": func.date(LLMUsage.created_at),
+}
+
+
+@router.get("/summary")
+async def usage_summary(
+    group_by: List[str] = Query(default=["user", "endpoint", "day"]),
+    days: int = Query(default=30, ge=1),
+    user_id: Optional[int] = None,
+    operator: bool = Depends(is_operator),
+    user: Optional[User] = Depends(get_optional_user),
+    session: Session = Depends(get_session),
+):
+    """OpenAI calls (hedge_calls of them losing hedge duplicates), tokens,
+    cost and latency totals over the last `days`, grouped by any of user,
+    endpoint, model and day; buffered ledger rows are flushed first. Operators (X-Operator-Token) see every user; a signed-in
+    user sees only their own usage."""
+    if not operator:
+        if user is None:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        if user_id is not None and user_id != user.id:
+            raise HTTPException(status_code=403, detail="Usage of other users requires an operator token")
+        user_id = user.id
+    unknown = [g for g in group_by if g not in GROUP_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by {unknown}; use {list(GROUP_COLUMNS)}")
+    await usage_ledger.flush()
+
+    columns = [GROUP_COLUMNS[g].label(g) for g in group_by]
+    totals = [
+        func.count(LLMUsage.id).label("calls"),
+        func.sum(case((LLMUsage.hedge == True, 1), else_=0)).label("hedge_calls"),  # noqa: E712
+        func.sum(LLMUsage.prompt_tokens).label("prompt_tokens"),
+        func.sum(LLMUsage.completion_tokens).label("completion_tokens"),
+        func.sum(LLMUsage.cost_usd).label("cost_usd"),
+        func.avg(LLMUsage.latency_ms).label("avg_latency_ms"),
+    ]
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    query = select(*columns, *totals).where(LLMUsage.created_at >= since)
+    if user_id is not None:
+        query = query.where(LLMUsage.user_id == user_id)
+    if columns:
+        query = query.group_by(*columns).order_by(*columns)
+
+    rows = []
+    for row in session.exec(query).all():
+        entry = dict(row._mapping)
+        if "day" in entry:
+            entry["day"] = str(entry["day"])
+        entry["cost_usd"] = round(entry["cost_usd"] or 0.0, 6)
+        entry["avg_latency_ms"] = round(entry["avg_latency_ms"] or 0.0, 1)
+        rows.append(entry)
+    return {
+        "since": since.isoformat(),
+        "group_by": group_by,
+        "rows": rows,
+        "total_calls": sum(r["calls"] for r in rows),
+        "total_cost_usd": round(sum(r["cost_usd"] for r in rows), 6),
+    }
@@ -3,8 +3,8 @@ from fastapi.testclient import TestClient
 from sqlmodel import SQLModel, Session, create_engine
 from sqlalchemy.pool import StaticPool
 
+from core import database
 from core.database import get_session
-from app import app
 
 # Use in-memory SQLite with StaticPool so all connections share the same DB
 TEST_ENGINE = create_engine(
@@ -13,6 +13,11 @@ TEST_ENGINE = create_engine(
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
+# Before the app is imported: its lifespan (create_db, job queue, usage
+# ledger) must run on the test database, not ./tax_prep.db
+database.engine = TEST_ENGINE
+
+from app import app  # noqa: E402
 
 
 def get_test_session():
@@ -28,6 +33,15 @@ def setup_db():
     SQLModel.metadata.drop_all(TEST_ENGINE)
 
 
+@pytest.fixture(autouse=True)
+def reset_llm_breaker():
+    """Failed LLM calls in one test must not open the circuit for the next."""
+    from core.llm import breaker
+    breaker.reset()
+    yield
+    breaker.reset()
+
+
 @pytest.fixture
 def client():
     app.dependency_overrides[get_session] = get_test_session
@@ -0,0 +1,105 @@
+"""
+Synthetic "e-filed" 1040 PDFs for extraction tests: amounts are typed into
+the line boxes of data/f1040_template.pdf (2025 revision), the way tax
+software prints them.
+"""
+
+import io
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from PyPDF2 import PdfReader, PdfWriter
+from agents.layout_extractor import LAYOUT_MAPS
+
+TEMPLATE_PDF = "data/f1040_template.pdf"
+PAGE_HEIGHT = 792.0
+
+# Label rows on the 2025 template (pdfplumber `top` of each line-number label)
+LABEL_TOPS_2025 = {
+    0: {"1z": 561.5, "2a": 573.5, "2b": 573.5, "3b": 585.5, "7a": 693.5, "8": 717.5, "9": 729.5,
+        "10": 741.5, "11a": 753.5},
+    1: {"12e": 99.5, "13a": 111.5, "15": 147.5, "17": 171.5, "19": 195.5, "20": 207.5,
+        "23": 243.5, "24": 255.5, "25a": 279.5, "25b": 291.5, "26": 327.5, "34": 483.5, "37": 555.5},
+}
+FILING_STATUS_TOPS = {"Single": 207.4, "Married filing jointly": 219.4, "Head of household": 207.4}
+FILING_STATUS_X = {"Single": 100.0, "Married filing jointly": 100.0, "Head of household": 352.0}
+# Dependents grid: one column per dependent; rows (1) first name, (2) last name, (3) SSN
+DEPENDENT_COLUMNS_X = (160.0, 268.0, 376.0, 484.0)
+DEPENDENT_ROW_TOPS = (311.6, 323.6, 335.6)
+
+
+def _baseline(top: float) -> float:
+    return PAGE_HEIGHT - top - 7.0
+
+
+def efiled_1040(values: dict, filing_status: str = "Single", dependents=(),
+                amount_format: str = "{:,.0f}.") -> bytes:
+    """`dependents`: (first name, last name, SSN as printed) per dependent;
+    `amount_format` is how the software prints amounts ("72,000." by default)."""
+    layout = LAYOUT_MAPS["2025"]
+    overlays = []
+    for page_index in (0, 1):
+        packet = io.BytesIO()
+        can = canvas.Canvas(packet, pagesize=letter)
+        can.setFont("Helvetica", 9)
+        if page_index == 0 and filing_status:
+            can.drawString(FILING_STATUS_X[filing_status], _baseline(FILING_STATUS_TOPS[filing_status]), "X")
+        if page_index == 0:
+            for x, dependent in zip(DEPENDENT_COLUMNS_X, dependents):
+                for top, text in zip(DEPENDENT_ROW_TOPS, dependent):
+                    can.drawString(x, _baseline(top), text)
+        for field, amount in values.items():
+            page, label, column = layout[field]
+            if page != page_index or not amount:
+                continue
+            x = column["amount_x"][0] + 8
+            can.drawString(x, _baseline(LABEL_TOPS_2025[page][label]), amount_format.format(amount))
+        can.showPage()
+        can.save()
+        packet.seek(0)
+        overlays.append(PdfReader(packet).pages[0])
+
+    template = PdfReader(TEMPLATE_PDF)
+    writer = PdfWriter()
+    for page, overlay in zip(template.pages, overlays):
+        page.merge_page(overlay)
+        writer.add_page(page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def _text_page(lines):
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=letter)
+    y = PAGE_HEIGHT - 40
+    for line in lines:
+        can.drawString(40, y, line)
+        y -= 14
+    can.showPage()
+    can.save()
+    packet.seek(0)
+    return PdfReader(packet).pages[0]
+
+
+def multi_form_packet(values: dict, filing_status: str = "Single") -> bytes:
+    """Preparer-style packet: cover page, 1040 (2 pages), Schedule 1,
+    an instructions page and a W-2."""
+    writer = PdfWriter()
+    writer.add_page(_text_page(["Client Organizer", "Prepared for review"]))
+    for page in PdfReader(io.BytesIO(efiled_1040(values, filing_status))).pages:
+        writer.add_page(page)
+    writer.add_page(_text_page(["SCHEDULE 1 (Form 1040) 2025", "Additional Income and Adjustments to Income"]))
+    writer.add_page(_text_page(["General Instructions", "Future developments"]))
+    writer.add_page(_text_page(["1 Wages, tips, other compensation", "", "Form W-2 Wage and Tax Statement 2025"]))
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def unrecognised_pages(count: int) -> bytes:
+    writer = PdfWriter()
+    for _ in range(count):
+        writer.add_page(_text_page(["Supporting statement"]))
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
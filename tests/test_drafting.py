@@ -0,0 +1,165 @@
+import pypdfium2
+
+from agents.drafting_agent import DraftingAgent
+
+TEMPLATE = "data/f1040_template.pdf"
+
+
+def _page_text(pdf_bytes: bytes, index: int = 0) -> str:
+    return pypdfium2.PdfDocument(pdf_bytes)[index].get_textpage().get_text_range()
+
+
+def test_shared_agent_drafts_do_not_leak_between_returns(tmp_path):
+    agent = DraftingAgent(TEMPLATE)
+    texts = []
+    for wages in (12345, 67890):
+        path = tmp_path / f"draft_{wages}.pdf"
+        agent.generate({"filing_status": "Single", "wages": wages, "agi": wages}, str(path))
+        texts.append(_page_text(path.read_bytes()))
+        assert len(pypdfium2.PdfDocument(path.read_bytes())) == 2
+
+    assert "12,345" in texts[0] and "67,890" not in texts[0]
+    assert "67,890" in texts[1] and "12,345" not in texts[1]
+    assert all("DRAFT - NOT FOR FILING" in text for text in texts)
+    assert "Individual Income Tax Return" in texts[1]
+
+
+def test_render_to_spooled_buffer():
+    draft, size = DraftingAgent(TEMPLATE).render({"filing_status": "Single", "wages": 41000, "agi": 40000})
+    with draft:
+        content = draft.read()
+    assert len(content) == size and content.startswith(b"%PDF")
+    assert "41,000" in _page_text(content)
+
+
+def test_generate_draft_endpoint(client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the route must not write into the working directory
+    resp = client.post("/generate-draft", json={"filing_status": "Single", "wages": 52000, "agi": 50000})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/pdf"
+    assert int(resp.headers["content-length"]) == len(resp.content)
+    assert "Your_Tax_Assistant_Draft.pdf" in resp.headers["content-disposition"]
+    assert "52,000" in _page_text(resp.content)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_draft_key_follows_what_is_drawn():
+    agent = DraftingAgent(TEMPLATE)
+    data = {"filing_status": "Single", "wages": 41000, "agi": 40000}
+    # Same drawn values, same key; drafts are byte-for-byte reproducible
+    assert agent.draft_key(data) == agent.draft_key({**data, "wages": 41000.2, "total_tax": 99})
+    assert agent.draft_key(data) != agent.draft_key({**data, "agi": 40001})
+    first, second = agent.render(data)[0], agent.render(data)[0]
+    with first, second:
+        assert first.read() == second.read()
+
+
+def test_generate_draft_etag_and_cache(client, monkeypatch):
+    import app as app_module
+    from agents.drafting_agent import draft_cache
+    draft_cache.clear()
+    payload = {"filing_status": "Single", "wages": 58000, "agi": 56000}
+    first = client.post("/generate-draft", json=payload)
+    etag = first.headers["etag"]
+    assert etag.startswith('"') and first.headers["cache-control"] == "private, no-cache"
+
+    def no_render(data):
+        raise AssertionError("draft should not be rendered again")
+
+    monkeypatch.setattr(app_module.drafter, "render", no_render)
+    revalidated = client.post("/generate-draft", json=payload, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304 and revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+
+    cached = client.post("/generate-draft", json=payload)
+    assert cached.status_code == 200 and cached.content == first.content
+    assert cached.headers["etag"] == etag
+    assert draft_cache.stats()["hits"] == 1
+
+
+def test_drafting_runs_off_the_event_loop():
+    import time
+    import asyncio
+    from agents.drafting_agent import run_drafting
+    from core.metrics import metrics
+
+    def slow_build():
+        time.sleep(0.2)
+        return "built"
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        result = await run_drafting(slow_build)
+        ticker.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(run())
+    assert result == "built" and ticks >= 10
+    assert metrics.summary("draft.queue_wait_ms", op="slow_build")["count"] == 1
+    assert metrics.summary("draft.build_ms", op="slow_build")["max"] >= 200
+
+
+def _batch_rows(client, auth_header):
+    record = client.post("/tax-records", json={
+        "tax_year": 2024, "filing_status": "Single", "wages": 61000, "w2_withholding": 7000,
+    }, headers=auth_header).json()
+    scenario = client.post("/scenarios", json={
+        "name": "Side gig", "filing_status": "Single", "wages": 83000, "w2_withholding": 9000,
+    }, headers=auth_header).json()
+    return record["id"], scenario["id"]
+
+
+def test_batch_drafts_zip(client, auth_header):
+    import io
+    import zipfile
+    record_id, scenario_id = _batch_rows(client, auth_header)
+    resp = client.post("/drafts/batch", json={
+        "record_ids": [record_id], "scenario_ids": [scenario_id], "format": "zip",
+    }, headers=auth_header)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/zip"
+
+    archive = zipfile.ZipFile(io.BytesIO(resp.content))
+    assert archive.namelist() == [f"record_{record_id}_2024.pdf", f"scenario_{scenario_id}_Side_gig.pdf"]
+    assert "61,000" in _page_text(archive.read(archive.namelist()[0]))
+    assert "83,000" in _page_text(archive.read(archive.namelist()[1]))
+    assert all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist())
+
+
+def test_zip_stream_yields_no_empty_chunks():
+    import asyncio
+    from routes.drafts import _zip_stream
+
+    async def collect():
+        entries = [("a.pdf", {"filing_status": "Single", "wages": 1000.0, "agi": 1000.0})]
+        return [chunk async for chunk in _zip_stream(entries)]
+
+    chunks = asyncio.run(collect())
+    assert chunks and all(chunks)
+
+
+def test_batch_drafts_merged_pdf(client, auth_header):
+    record_id, scenario_id = _batch_rows(client, auth_header)
+    resp = client.post("/drafts/batch", json={
+        "record_ids": [record_id], "scenario_ids": [scenario_id], "format": "pdf",
+    }, headers=auth_header)
+    assert resp.status_code == 200
+    assert len(pypdfium2.PdfDocument(resp.content)) == 4  # two pages per draft
+    assert "61,000" in _page_text(resp.content, 0)
+    assert "83,000" in _page_text(resp.content, 2)
+    assert "DRAFT - NOT FOR FILING" in _page_text(resp.content, 2)
+
+
+def test_batch_drafts_rejects_unknown_rows(client, auth_header):
+    record_id, _ = _batch_rows(client, auth_header)
+    resp = client.post("/drafts/batch", json={"record_ids": [record_id, 9999]}, headers=auth_header)
+    assert resp.status_code == 404
+    assert client.post("/drafts/batch", json={}, headers=auth_header).status_code == 400
@@ -0,0 +1,592 @@
+import asyncio
+import tempfile
+import time
+
+from agents import extraction_agent
+from agents.extraction_agent import ExtractionAgent
+from agents.layout_extractor import CONFIDENCE_THRESHOLD, LAYOUT_MAPS, LayoutExtractor, parse_amount
+from agents.prompt_compaction import compact_text, count_tokens, label_amounts
+from core.cache import SizedLRUCache
+from core import pdf_utils
+from core.pdf_utils import extract_relevant_pages_async, classify_header, classify_pages
+from tests.pdf_fixtures import efiled_1040, multi_form_packet, unrecognised_pages
+
+TEMPLATE_PDF = "data/f1040_template.pdf"
+
+
+def _template_bytes() -> bytes:
+    with open(TEMPLATE_PDF, "rb") as f:
+        return f.read()
+
+
+def _page_words(pdf_bytes: bytes):
+    return asyncio.run(extract_relevant_pages_async(pdf_bytes, with_words=True))["words"]
+
+
+def test_extract_relevant_pages_from_bytes():
+    parsed = asyncio.run(extract_relevant_pages_async(_template_bytes()))
+    assert len(parsed["pages"]) == 2
+    assert "Form" in parsed["pages"][0] or "1040" in parsed["pages"][0]
+    stats = parsed["stats"]
+    assert stats["page_count"] == 2 and stats["unclassified_pages"] == 0
+    assert stats["parse_ms"] > 0
+    assert stats["rss_peak_kb"] > 0
+
+
+def test_pages_past_the_classification_limit_are_reported(monkeypatch):
+    monkeypatch.setattr(pdf_utils, "MAX_CLASSIFIED_PAGES", 2)
+    assert classify_pages(unrecognised_pages(4)) == ["other", "other", "unclassified", "unclassified"]
+    parsed = asyncio.run(extract_relevant_pages_async(unrecognised_pages(4)))
+    assert parsed["stats"]["page_count"] == 4 and parsed["stats"]["unclassified_pages"] == 2
+
+
+def test_parse_does_not_block_event_loop():
+    """While a parse runs on the pool, other coroutines keep getting scheduled."""
+    pdf_bytes = _template_bytes()
+
+    async def scenario():
+        gaps = []
+        done = asyncio.Event()
+
+        async def ticker():
+            last = time.perf_counter()
+            while not done.is_set():
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        tick = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        await extract_relevant_pages_async(pdf_bytes)
+        elapsed = time.perf_counter() - start
+        done.set()
+        await tick
+        return elapsed, gaps
+
+    elapsed, gaps = asyncio.run(scenario())
+    assert len(gaps) > 3
+    assert max(gaps) < max(0.25, elapsed / 2)
+
+
+# --- Extraction cache ---
+
+def _counting_agent(monkeypatch):
+    calls = {"structure": 0}
+
+    async def fake_structure(self, raw_text, model=None):
+        calls["structure"] += 1
+        return {"filing_status": "Single", "wages": 50000.0}
+
+    monkeypatch.setattr(ExtractionAgent, "_structure", fake_structure)
+    extraction_agent.extraction_cache.clear()
+    return ExtractionAgent(api_key="test-key", routing=False, verify=False), calls
+
+
+def test_extract_cache_hit_on_same_hash(monkeypatch):
+    agent, calls = _counting_agent(monkeypatch)
+    pdf_bytes = _template_bytes()
+
+    first = asyncio.run(agent.extract(pdf_bytes, sha256="abc"))
+    assert first["cache_hit"] is False
+    first["data"]["wages"] = 1.0  # callers mutating results must not poison the cache
+
+    second = asyncio.run(agent.extract(pdf_bytes, sha256="abc"))
+    assert second["cache_hit"] is True
+    assert second["data"] == {"filing_status": "Single", "wages": 50000.0}
+    assert second["raw_text"] == first["raw_text"]
+    assert calls["structure"] == 1
+
+
+def test_extract_prompt_bump_reuses_parsed_text(monkeypatch):
+    agent, calls = _counting_agent(monkeypatch)
+    asyncio.run(agent.extract(_template_bytes(), sha256="abc"))
+
+    monkeypatch.setattr(extraction_agent, "PROMPT_VERSION", "1040-test")
+    # Unparseable source: only the cached text can satisfy this call
+    result = asyncio.run(agent.extract(b"not a pdf", sha256="abc"))
+    assert result["cache_hit"] is False
+    assert calls["structure"] == 2
+    assert "status" not in result["data"]
+
+
+def test_extract_prompt_bump_reuses_layout_read(monkeypatch):
+    agent, calls = _counting_agent(monkeypatch)
+    first = asyncio.run(agent.extract(efiled_1040(EFILED_VALUES), sha256="efiled"))
+    assert first["method"] == "layout"
+    first["data"]["wages"] = 1.0
+
+    monkeypatch.setattr(extraction_agent, "PROMPT_VERSION", "1040-test")
+    result = asyncio.run(agent.extract(b"not a pdf", sha256="efiled"))
+    assert result["cache_hit"] is False and result["parse_stats"] is None
+    assert result["method"] == "layout" and result["data"]["wages"] == 72000
+    assert calls["structure"] == 0
+
+
+def test_extract_without_hash_skips_cache(monkeypatch):
+    agent, calls = _counting_agent(monkeypatch)
+    asyncio.run(agent.extract(_template_bytes()))
+    asyncio.run(agent.extract(_template_bytes()))
+    assert calls["structure"] == 2
+    assert extraction_agent.extraction_cache.stats()["entries"] == 0
+
+
+def test_sized_lru_cache_evicts_by_bytes():
+    cache = SizedLRUCache(max_bytes=100)
+    cache.put("a", "A", 40)
+    cache.put("b", "B", 40)
+    assert cache.get("a") == "A"  # a is now most recently used
+    cache.put("c", "C", 40)
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    assert cache.put("huge", "X", 500) is False
+    stats = cache.stats()
+    assert stats["bytes"] == 80 and stats["evictions"] == 1
+
+
+# --- Layout-based extraction ---
+
+EFILED_VALUES = {
+    "wages": 72000,
+    "taxable_interest": 185,
+    "capital_gain_or_loss": -3000,
+    "total_income": 69185,
+    "agi": 69185,
+    "total_deductions": 15750,
+    "taxable_income": 53435,
+    "total_tax": 6041,
+    "w2_withholding": 10800,
+    "refund_amount": 4759,
+}
+
+
+def test_parse_amount():
+    assert parse_amount(["72,000."]) == 72000.0
+    assert parse_amount(["(3,000)"]) == -3000.0
+    assert parse_amount(["-1,234.56"]) == -1234.56
+    assert parse_amount(["see", "attached"]) is None
+
+
+def test_layout_extractor_reads_efiled_return():
+    result = LayoutExtractor().extract(_page_words(efiled_1040(EFILED_VALUES)))
+
+    assert result["revision"] == "2025"
+    assert result["confident"] is True
+    data = result["data"]
+    for field, value in EFILED_VALUES.items():
+        assert data[field] == value, field
+    assert data["filing_status"] == "Single"
+    assert data["deduction_type"] == "Standard"
+    assert data["ordinary_dividends"] == 0.0
+    assert data["self_employment_tax"] is None  # same null convention as the LLM path
+    assert data["adjustments_to_income"] == 0.0
+    assert set(data) == set(extraction_agent.ALL_FIELDS)  # same shape as the LLM path
+    assert result["confidence"]["wages"] >= 0.9
+
+
+def test_layout_extractor_is_not_confident_without_amounts():
+    """A checked filing-status box over empty (or misaligned) amount boxes is
+    not a confident read of a return with zero income."""
+    result = LayoutExtractor().extract(_page_words(efiled_1040({}, filing_status="Single")))
+    assert result["data"]["filing_status"] == "Single"
+    assert result["confident"] is False
+    assert result["confidence"]["wages"] < CONFIDENCE_THRESHOLD
+    assert result["confidence"]["ordinary_dividends"] >= CONFIDENCE_THRESHOLD  # optional lines may be blank
+
+
+def test_layout_extractor_reads_dependents():
+    dependents = [("Ann", "Smith", "123-45-6789"), ("Ben", "Smith", "987 65 4321")]
+    pdf = efiled_1040(EFILED_VALUES, filing_status="Married filing jointly", dependents=dependents)
+    result = LayoutExtractor().extract(_page_words(pdf))
+    assert result["data"]["dependents_count"] == 2
+    assert result["confidence"]["dependents_count"] >= 0.9 and result["confident"] is True
+
+    words = _page_words(efiled_1040(EFILED_VALUES))
+    plain = LayoutExtractor().extract(words)
+    assert plain["data"]["dependents_count"] == 0 and plain["confident"] is True
+
+    # "More than four dependents" checked: the grid is incomplete, so the LLM reads it
+    words[0].append({"text": "X", "x0": 81.0, "x1": 87.0, "top": 369.0, "bottom": 377.0})
+    assert LayoutExtractor().extract(words)["confident"] is False
+
+
+def test_layout_extractor_blank_form_not_confident():
+    result = LayoutExtractor().extract(_page_words(_template_bytes()))
+    assert result["confident"] is False
+    assert result["confidence"]["filing_status"] == 0.0
+
+
+def test_extract_uses_layout_without_llm(monkeypatch):
+    agent, calls = _counting_agent(monkeypatch)
+    result = asyncio.run(agent.extract(efiled_1040(EFILED_VALUES, filing_status="Married filing jointly")))
+    assert result["method"] == "layout"
+    assert result["data"]["filing_status"] == "Married filing jointly"
+    assert result["data"]["deduction_type"] == "Itemized"
+    assert calls["structure"] == 0
+
+
+def test_extract_falls_back_to_llm(monkeypatch):
+    agent, calls = _counting_agent(monkeypatch)
+    result = asyncio.run(agent.extract(_template_bytes()))
+    assert result["method"] == "llm"
+    assert result["data"] == {"filing_status": "Single", "wages": 50000.0}
+    assert calls["structure"] == 1
+
+
+# --- Page classification ---
+
+def test_classify_header():
+    assert classify_header("Form 1040 U.S. Individual Income Tax Return 2025") == "1040_p1"
+    assert classify_header("Form 1040-SR U.S. Tax Return for Seniors 2024") == "1040_p1"
+    assert classify_header("Form 1040 (2024) Page 2") == "1040_p2"
+    assert classify_header("SCHEDULE 2 (Form 1040) 2024 Additional Taxes") == "schedule_2"
+    assert classify_header("", "Form W-2 Wage and Tax Statement") == "w2"
+    assert classify_header("Client Organizer") == "other"
+
+
+def test_classify_packet_pages():
+    types = classify_pages(multi_form_packet(EFILED_VALUES))
+    assert types == ["other", "1040_p1", "1040_p2", "schedule_1", "other", "w2"]
+
+
+def test_relevant_pages_parsed_from_spooled_file():
+    spool = tempfile.SpooledTemporaryFile(max_size=1024)  # forces a disk-backed handle
+    spool.write(multi_form_packet(EFILED_VALUES))
+
+    parsed = asyncio.run(extract_relevant_pages_async(spool, with_words=True))
+    assert parsed["page_numbers"] == [2, 3, 4, 6]
+    assert parsed["page_types"] == ["1040_p1", "1040_p2", "schedule_1", "w2"]
+    assert "SCHEDULE 1" in parsed["pages"][2]
+    stats = parsed["stats"]
+    assert stats["page_count"] == 6 and stats["parsed_pages"] == 4
+    assert [p["page"] for p in stats["pages"]] == [2, 3, 4, 6]
+    assert all(p["parse_ms"] > 0 for p in stats["pages"])
+
+
+def test_relevant_pages_fall_back_to_first_pages():
+    parsed = asyncio.run(extract_relevant_pages_async(efiled_1040({}), fallback_pages=1))
+    assert parsed["page_types"] == ["1040_p1", "1040_p2"]
+
+    parsed = asyncio.run(extract_relevant_pages_async(unrecognised_pages(4), fallback_pages=3))
+    assert parsed["page_numbers"] == [1, 2, 3]
+
+
+def test_relevant_pages_in_process_pool(monkeypatch):
+    monkeypatch.setattr(pdf_utils, "PDF_PAGE_EXECUTOR", "process")
+    try:
+        parsed = asyncio.run(extract_relevant_pages_async(multi_form_packet(EFILED_VALUES)))
+        assert parsed["page_types"] == ["1040_p1", "1040_p2", "schedule_1", "w2"]
+    finally:
+        if pdf_utils._page_process_executor is not None:
+            pdf_utils._page_process_executor.shutdown()
+            monkeypatch.setattr(pdf_utils, "_page_process_executor", None)
+
+
+def test_extract_packet_uses_layout(monkeypatch):
+    agent, calls = _counting_agent(monkeypatch)
+    result = asyncio.run(agent.extract(multi_form_packet(EFILED_VALUES)))
+    assert result["method"] == "layout"
+    assert result["data"]["wages"] == 72000
+    assert result["parse_stats"]["parsed_pages"] == 4
+    assert calls["structure"] == 0
+
+
+def _sectioned_agent(monkeypatch, responses, delay=0.05):
+    """Agent whose LLM call answers per section (matched on a field in the prompt)."""
+    seen = []
+
+    async def fake_complete(self, prompt, model=None):
+        seen.append(prompt)
+        await asyncio.sleep(delay)
+        for marker, response in responses.items():
+            if f"- {marker}:" in prompt:
+                if isinstance(response, Exception):
+                    raise response
+                return dict(response)
+        return {}
+
+    monkeypatch.setattr(ExtractionAgent, "_complete_json", fake_complete)
+    return ExtractionAgent(api_key="test-key", sectioned=True), seen
+
+
+def test_sectioned_extraction_runs_concurrently(monkeypatch):
+    agent, seen = _sectioned_agent(monkeypatch, {
+        "filing_status": {"filing_status": "Married filing jointly", "dependents_count": 2},
+        "wages": {"wages": 90000.0, "agi": 91000.0},
+        "total_tax": {"total_tax": 8000.0, "qbi_deduction": 0.0, "schedule_2_total": 0.0},
+        "w2_withholding": {"w2_withholding": 9000.0, "refund_amount": 1000.0},
+    }, delay=0.2)
+
+    start = time.perf_counter()
+    data = asyncio.run(agent._structure("[PAGE 1: 1040_p1]\nForm 1040\n--- PAGE BREAK ---\n"))
+    assert time.perf_counter() - start < 0.6  # four 0.2s calls, gathered
+
+    assert len(seen) == len(extraction_agent.EXTRACTION_SECTIONS)
+    assert data["filing_status"] == "Married filing jointly"
+    assert data["agi"] == 91000.0 and data["refund_amount"] == 1000.0
+    assert set(extraction_agent.ALL_FIELDS) <= set(data)
+    # null convention for conditional UI fields survives the merge
+    assert data["qbi_deduction"] is None and data["schedule_2_total"] is None
+
+
+def test_sectioned_merge_prefers_owner_section():
+    merged = extraction_agent._merge_sections({
+        "household": {"filing_status": "Single"},
+        "income": {"agi": 50000.0, "total_tax": 1.0, "wages": 0.0},
+        "deductions_tax": {"total_tax": 4000.0, "wages": 48000.0},
+        "payments": {"bogus_field": 5},
+    })
+    assert merged["total_tax"] == 4000.0  # owner wins a conflict
+    assert merged["wages"] == 48000.0  # owner empty: another section fills it
+    assert "bogus_field" not in merged
+
+
+def test_sectioned_extraction_failure_is_reported(monkeypatch):
+    agent, _ = _sectioned_agent(monkeypatch, {
+        "filing_status": {"filing_status": "Single"},
+        "wages": RuntimeError("rate limited"),
+    }, delay=0)
+    data = asyncio.run(agent._structure("text"))
+    assert data["status"] == "error" and data["reason"] == "llm_extraction_failed"
+    assert "income: rate limited" in data["message"]
+
+
+def test_section_text_selects_page_types():
+    raw = ("[PAGE 1: 1040_p1]\npage one\n--- PAGE BREAK ---\n"
+           "[PAGE 4: w2]\nwage statement\n--- PAGE BREAK ---\n")
+    assert "wage statement" not in extraction_agent._section_text(raw, {"1040_p1"})
+    assert "page one" not in extraction_agent._section_text(raw, {"w2"})
+    assert extraction_agent._section_text(raw, {"schedule_3"}) == raw
+
+
+# --- Prompt compaction ---
+
+def _packet_text(values, filing_status="Single"):
+    agent = ExtractionAgent(api_key="test-key")
+    return asyncio.run(agent._parse(multi_form_packet(values, filing_status)))["raw_text"]
+
+
+def test_label_amounts():
+    assert label_amounts("z Add lines 1a through 1h 1z 72,000.") == ["1z 72,000."]
+    assert label_amounts("2a Tax-exempt interest 2a b Taxable interest 2b 185.") == ["2b 185."]
+    assert label_amounts("8 Additional income from Schedule 1, line 10 8") == []
+    assert label_amounts("7a Capital gain or (loss) 7a (3,000)") == ["7a (3,000)"]
+    # Bare integers, as some software prints them, but not line references
+    assert label_amounts("1z 72000") == ["1z 72000"]
+    assert label_amounts("2a Tax-exempt interest 2a b Taxable interest 2b 450") == ["2b 450"]
+    assert label_amounts("13b 14") == []
+
+
+def test_compaction_keeps_bare_integer_amounts():
+    agent = ExtractionAgent(api_key="test-key")
+    pdf = efiled_1040(EFILED_VALUES, amount_format="{:.0f}")
+    raw = asyncio.run(agent._parse(pdf))["raw_text"]
+    compact = compact_text(raw)
+
+    layout = LAYOUT_MAPS["2025"]
+    for field, value in EFILED_VALUES.items():
+        _, label, _ = layout[field]
+        assert f"{label} {value:.0f}" in compact, field
+    assert count_tokens(compact) < count_tokens(raw) * 0.25
+
+
+def test_compaction_falls_back_to_raw_text_without_amounts():
+    raw = "[PAGE 1: 1040_p1]\nWages see statement attached\n--- PAGE BREAK ---\n"
+    assert compact_text(raw) == raw
+
+
+def test_compaction_keeps_every_amount_on_fixture():
+    raw = _packet_text(EFILED_VALUES, "Married filing jointly")
+    compact = compact_text(raw)
+
+    layout = LAYOUT_MAPS["2025"]
+    for field, value in EFILED_VALUES.items():
+        _, label, _ = layout[field]
+        assert f"{label} {value:,.0f}." in compact, field
+    assert "X Married filing jointly" in compact
+    assert "itemized deductions" in compact
+    assert "[PAGE 3: 1040_p2]" in compact and "[PAGE 6: w2]" in compact
+    assert "Under penalties of perjury" not in compact
+    assert count_tokens(compact) < count_tokens(raw) * 0.25
+
+
+def test_compacted_text_still_splits_into_sections():
+    compact = compact_text(_packet_text(EFILED_VALUES))
+    payments = extraction_agent._section_text(compact, {"1040_p2"})
+    assert "25a 10,800." in payments and "1z 72,000." not in payments
+
+
+def test_compaction_of_untyped_text():
+    raw = "Form W-2 Wage and Tax Statement\n1 Wages, tips  50,000.00\nOMB No. 1545-0008 12 1,000.\nSee instructions. . . ."
+    assert compact_text(raw).strip().splitlines() == ["1 Wages, tips 50,000.00", "--- PAGE BREAK ---"]
+
+
+def test_count_tokens():
+    assert count_tokens("") == 0
+    assert 0 < count_tokens("1z 72,000.") < count_tokens("1z 72,000. " * 50)
+
+
+def test_extract_sends_compacted_text(monkeypatch):
+    prompts = []
+
+    async def fake_structure(self, raw_text, model=None):
+        prompts.append(raw_text)
+        return {"filing_status": "Single"}
+
+    monkeypatch.setattr(ExtractionAgent, "_structure", fake_structure)
+    agent = ExtractionAgent(api_key="test-key", use_layout=False, routing=False, verify=False)
+    result = asyncio.run(agent.extract(efiled_1040(EFILED_VALUES)))
+
+    assert prompts[0] == compact_text(result["raw_text"])
+    stats = result["prompt_stats"]
+    assert stats["prompt_tokens"] < stats["raw_tokens"]
+
+    agent = ExtractionAgent(api_key="test-key", use_layout=False, compact=False, routing=False, verify=False)
+    asyncio.run(agent.extract(efiled_1040(EFILED_VALUES)))
+    assert prompts[1] == result["raw_text"]
+
+
+# --- Tiered model routing ---
+
+VALID_LLM_DATA = {
+    "filing_status": "Single", "dependents_count": 0, "wages": 72000.0, "tax_exempt_interest": 0.0,
+    "taxable_interest": 185.0, "ordinary_dividends": 0.0, "capital_gain_or_loss": -3000.0,
+    "total_income": 69185.0, "adjustments_to_income": 0.0, "agi": 69185.0,
+    "deduction_type": "Standard", "total_deductions": 15750.0, "taxable_income": 53435.0,
+    "child_tax_credit": 0.0, "total_tax": 6041.0, "refund_amount": 4759.0, "owed_amount": 0.0,
+    "other_income": 0.0, "other_income_description": None, "qbi_deduction": 0.0,
+    "self_employment_tax": 0.0, "schedule_2_total": 0.0, "schedule_3_total": 0.0,
+    "w2_withholding": 10800.0, "withholding_1099": 0.0, "estimated_tax_payments": 0.0,
+}
+
+
+def test_validate_extraction():
+    from agents.extraction_validation import validate_extraction
+    fields = extraction_agent.ALL_FIELDS
+    assert validate_extraction(dict(VALID_LLM_DATA), fields) == []
+
+    bad = {**VALID_LLM_DATA, "taxable_income": 63435.0, "wages": "72k", "filing_status": "Divorced"}
+    checks = {(p["check"], tuple(p["fields"])[0]) for p in validate_extraction(bad, fields)}
+    assert checks == {("schema", "wages"), ("schema", "filing_status"), ("taxable_income", "taxable_income")}
+
+    missing = {k: v for k, v in VALID_LLM_DATA.items() if k != "agi"}
+    assert any(p["message"] == "agi is missing" for p in validate_extraction(missing, fields))
+    assert validate_extraction({"status": "error", "message": "boom"}, fields)[0]["check"] == "error"
+
+
+def _tiered_agent(monkeypatch, answers):
+    calls = []
+
+    async def fake_complete(self, prompt, model=None):
+        calls.append(model)
+        return dict(answers[model])
+
+    monkeypatch.setattr(ExtractionAgent, "_complete_json", fake_complete)
+    return ExtractionAgent(api_key="test-key", use_layout=False, routing=True), calls
+
+
+def test_routing_keeps_valid_fast_answer(monkeypatch):
+    from core.metrics import metrics
+    agent, calls = _tiered_agent(monkeypatch, {"gpt-4o-mini": VALID_LLM_DATA})
+    before = metrics.counter("extraction.escalations", model="gpt-4o-mini")
+
+    result = asyncio.run(agent.extract(efiled_1040(EFILED_VALUES)))
+    assert calls == ["gpt-4o-mini"]
+    assert result["model"] == "gpt-4o-mini" and result["validation"] == []
+    assert metrics.counter("extraction.escalations", model="gpt-4o-mini") == before
+    assert "llm:gpt-4o-mini" in result["timings"]["stages_ms"]
+
+
+def test_routing_escalates_on_arithmetic_failure(monkeypatch):
+    from core.metrics import metrics
+    agent, calls = _tiered_agent(monkeypatch, {
+        "gpt-4o-mini": {**VALID_LLM_DATA, "agi": 96185.0},  # misread line 11
+        "gpt-4o": VALID_LLM_DATA,
+    })
+    before = metrics.counter("extraction.escalations", model="gpt-4o-mini")
+
+    result = asyncio.run(agent.extract(efiled_1040(EFILED_VALUES)))
+    assert calls == ["gpt-4o-mini", "gpt-4o"]
+    assert result["model"] == "gpt-4o" and result["data"]["agi"] == 69185.0
+    assert metrics.counter("extraction.escalations", model="gpt-4o-mini") == before + 1
+    assert metrics.summary("extraction.tier_ms", model="gpt-4o")["count"] >= 1
+
+
+# --- TaxMath verification ---
+
+def test_taxmath_checks_flag_inconsistent_lines():
+    from agents.extraction_validation import taxmath_checks
+    from core.tax_math import TaxMath
+    checks = taxmath_checks(dict(VALID_LLM_DATA), TaxMath(), 2025)
+    assert all(check["ok"] for check in checks.values())
+
+    checks = taxmath_checks({**VALID_LLM_DATA, "total_tax": 16041.0}, TaxMath(), 2025)
+    assert [line for line, check in checks.items() if not check["ok"]] == ["total_tax"]
+
+    # No parameters for the year: only the year-independent AGI check runs
+    assert list(taxmath_checks(dict(VALID_LLM_DATA), TaxMath(), 2019)) == ["agi"]
+
+
+def test_taxmath_checks_use_the_returns_year():
+    """Correct 2024 returns pass on 2024's standard deduction; total tax,
+    on 2025 brackets, is not checked for them."""
+    from agents.extraction_validation import taxmath_checks
+    from core.tax_math import TaxMath
+    single = {"filing_status": "Single", "wages": 30000.0, "agi": 30000.0,
+              "total_deductions": 14600.0, "taxable_income": 15400.0, "total_tax": 1690.0}
+    joint = {"filing_status": "Married filing jointly", "wages": 60000.0, "agi": 60000.0,
+             "total_deductions": 29200.0, "taxable_income": 30800.0, "total_tax": 3380.0}
+    for data in (single, joint):
+        checks = taxmath_checks(data, TaxMath(), 2024)
+        assert set(checks) == {"agi", "taxable_income"}
+        assert all(check["ok"] for check in checks.values()), checks
+
+    # A 2024 form is checked as 2024 even when the record says otherwise
+    from agents.extraction_validation import form_tax_year
+    assert form_tax_year("Form 1040 U.S. Individual Income Tax Return 2024 Department") == 2024
+    assert form_tax_year("For the year Jan. 1–Dec. 31, 2024, or other tax year") == 2024
+    assert form_tax_year("no header here") is None
+
+
+def test_verification_requeries_only_inconsistent_fields(monkeypatch):
+    from core.metrics import add_count
+    prompts = []
+
+    async def fake_complete(self, prompt, model=None):
+        prompts.append(prompt)
+        if len(prompts) == 1:
+            return {**VALID_LLM_DATA, "total_tax": 16041.0}  # misread line 24
+        add_count("prompt_tokens", 120)
+        add_count("completion_tokens", 30)
+        return {"total_tax": 6041.0, "child_tax_credit": 0.0}
+
+    monkeypatch.setattr(ExtractionAgent, "_complete_json", fake_complete)
+    agent = ExtractionAgent(api_key="test-key", use_layout=False, routing=False, sectioned=False)
+    result = asyncio.run(agent.extract(efiled_1040(EFILED_VALUES)))
+
+    verification = result["verification"]
+    assert len(prompts) == 2
+    assert verification["requeried_fields"] == extraction_agent.TAXMATH_CHECK_FIELDS["total_tax"]
+    assert "- total_tax:" in prompts[1] and "- wages:" not in prompts[1]
+    assert "imply" not in prompts[1]  # the recomputed figure is not suggested
+    assert verification["corrected"] == {"total_tax": {"from": 16041.0, "to": 6041.0}}
+    assert verification["consistent"] and result["data"]["total_tax"] == 6041.0
+    assert verification["extra_prompt_tokens"] == 120
+    assert verification["extra_completion_tokens"] == 30
+    assert result["timings"]["prompt_tokens"] == 120
+
+
+def test_verification_skips_requery_when_consistent(monkeypatch):
+    prompts = []
+
+    async def fake_complete(self, prompt, model=None):
+        prompts.append(prompt)
+        return dict(VALID_LLM_DATA)
+
+    monkeypatch.setattr(ExtractionAgent, "_complete_json", fake_complete)
+    agent = ExtractionAgent(api_key="test-key", use_layout=False, routing=False, sectioned=False)
+    result = asyncio.run(agent.extract(efiled_1040(EFILED_VALUES)))
+
+    assert len(prompts) == 1
+    assert result["verification"]["consistent"]
+    assert result["verification"]["requeried_fields"] == []
@@ -0,0 +1,78 @@
+import asyncio
+
+import httpx
+import pytest
+
+from agents import extraction_agent
+from agents.extraction_agent import ExtractionAgent
+from benchmarks.fake_openai import CANNED_EXTRACTION, FakeOpenAIConfig, create_app
+from core import llm
+from tests.pdf_fixtures import efiled_1040
+from tests.test_extraction import EFILED_VALUES
+
+
+@pytest.fixture
+def stand_in():
+    """Route core.llm clients to an in-process stand-in built from a config."""
+    def use(config):
+        app = create_app(config)
+        http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app))
+        llm.configure_client("http://stand-in/v1", http_client)
+        return app
+
+    yield use
+    llm.configure_client(None, None)
+
+
+def test_extraction_through_stand_in(stand_in, monkeypatch):
+    app = stand_in(FakeOpenAIConfig(median=0.001, p99=0.002, misread_rate=1.0))
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    extraction_agent.extraction_cache.clear()
+
+    agent = ExtractionAgent(use_layout=False, routing=True)
+    assert agent.api_key == llm.STAND_IN_API_KEY
+    result = asyncio.run(agent.extract(efiled_1040(EFILED_VALUES)))
+
+    # The fast tier always misreads line 24; the TaxMath cross-check re-reads it from gpt-4o
+    assert result["model"] == "gpt-4o-mini"
+    assert result["verification"]["corrected"]["total_tax"]["to"] == CANNED_EXTRACTION["total_tax"]
+    assert result["data"]["wages"] == CANNED_EXTRACTION["wages"]
+    assert result["timings"]["prompt_tokens"] > 0
+    assert app.state.stand_in.requests == 2
+
+
+def test_stand_in_injects_errors(stand_in):
+    stand_in(FakeOpenAIConfig(median=0.001, p99=0.002, error_rate=1.0, error_status=503))
+    client = llm.get_client("key").with_options(max_retries=0)
+
+    async def call():
+        return await llm.chat_completion(client, model="gpt-4o", messages=[{"role": "user", "content": "hi"}])
+
+    with pytest.raises(Exception) as error:
+        asyncio.run(call())
+    assert getattr(error.value, "status_code", None) == 503
+
+
+def test_stand_in_streams_summary(stand_in):
+    stand_in(FakeOpenAIConfig(median=0.01, p99=0.02, stream_chunks=4))
+
+    async def stream():
+        response = await llm.get_client("key").chat.completions.create(
+            model="gpt-4o-mini", messages=[{"role": "user", "content": "Explain"}], stream=True,
+        )
+        return [chunk.choices[0].delta.content async for chunk in response]
+
+    pieces = asyncio.run(stream())
+    assert len([p for p in pieces if p]) == 4
+    assert "".join(p for p in pieces if p).startswith("Your refund changed")
+
+
+def test_stand_in_latency_distribution():
+    from benchmarks.fake_openai import FakeOpenAI
+    stand_in = FakeOpenAI(FakeOpenAIConfig(median=2.0, p99=20.0, seed=1))
+    samples = sorted(stand_in.latency() for _ in range(4000))
+    assert 1.7 < samples[2000] < 2.3
+    assert 12 < samples[3960] < 30
+    # Same seed, same sequence
+    first, second = (FakeOpenAI(FakeOpenAIConfig(seed=7)) for _ in range(2))
+    assert [first.latency() for _ in range(5)] == [second.latency() for _ in range(5)]
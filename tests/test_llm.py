@@ -0,0 +1,184 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from core import llm
+from core.llm import Hedger, chat_completion
+from core.metrics import metrics
+
+
+class FakeCompletions:
+    """Answers after the next delay in `delays`; each answer names its call."""
+
+    def __init__(self, delays):
+        self.delays = list(delays)
+        self.started = 0
+        self.cancelled = 0
+
+    async def create(self, **request):
+        call = self.started
+        self.started += 1
+        try:
+            await asyncio.sleep(self.delays[call])
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"call-{call}"
+
+
+def _client(delays):
+    completions = FakeCompletions(delays)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions)), completions
+
+
+@pytest.fixture
+def hedger(monkeypatch):
+    hedger = Hedger(percentile=0.9, budget=0.5, min_samples=5)
+    for _ in range(10):
+        hedger.record("m", 0.02)
+    hedger.calls = 10
+    monkeypatch.setattr(llm, "hedger", hedger)
+    return hedger
+
+
+def test_hedge_wins_when_primary_is_slow(hedger):
+    client, completions = _client([1.0, 0.01])
+    before = metrics.counter("llm.hedge_wins", model="m")
+
+    response = asyncio.run(chat_completion(client, hedge=True, model="m"))
+    assert response == "call-1"
+    assert completions.started == 2 and completions.cancelled == 1
+    assert hedger.hedges == 1
+    assert metrics.counter("llm.hedge_wins", model="m") == before + 1
+
+
+def test_hedge_loser_is_recorded_in_the_usage_ledger(hedger, monkeypatch):
+    recorded = []
+
+    class Ledger:
+        def record(self, model, prompt_tokens, completion_tokens, latency_ms, hedge=False):
+            recorded.append((prompt_tokens, completion_tokens, hedge))
+
+    class Billed(FakeCompletions):
+        async def create(self, **request):
+            await super().create(**request)
+            return SimpleNamespace(usage=SimpleNamespace(prompt_tokens=100, completion_tokens=10))
+
+    monkeypatch.setattr(llm, "usage_ledger", Ledger())
+    completions = Billed([1.0, 0.01])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    asyncio.run(chat_completion(client, hedge=True, model="m"))
+    # The cancelled primary is billed for the same prompt
+    assert recorded == [(100, 10, False), (100, 0, True)]
+
+
+def test_no_hedge_when_primary_is_fast(hedger):
+    client, completions = _client([0.001])
+    assert asyncio.run(chat_completion(client, hedge=True, model="m")) == "call-0"
+    assert completions.started == 1 and hedger.hedges == 0
+
+
+def test_hedge_budget_and_warmup(hedger):
+    hedger.budget = 0.0
+    client, completions = _client([0.1])
+    assert asyncio.run(chat_completion(client, hedge=True, model="m")) == "call-0"
+    assert completions.started == 1
+
+    # A model without enough samples is never hedged
+    client, completions = _client([0.1])
+    assert asyncio.run(chat_completion(client, hedge=True, model="new")) == "call-0"
+    assert completions.started == 1
+    assert hedger.threshold("new") is None
+
+
+def test_hedge_survives_one_failed_call(hedger):
+    class Flaky(FakeCompletions):
+        async def create(self, **request):
+            if self.started == 0:
+                self.started += 1
+                await asyncio.sleep(0.05)
+                raise RuntimeError("upstream 500")
+            return await super().create(**request)
+
+    completions = Flaky([None, 0.1])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    assert asyncio.run(chat_completion(client, hedge=True, model="m")) == "call-1"
+
+
+# --- Circuit breaker and deadlines ---
+
+def test_breaker_opens_on_failures_and_probes_after_cooldown():
+    from core.llm import CircuitBreaker, CircuitOpenError
+    now = {"t": 0.0}
+    breaker = CircuitBreaker(window_seconds=60, min_calls=4, failure_rate=0.5, slow_seconds=5,
+                             cooldown_seconds=30, clock=lambda: now["t"])
+    breaker.record(1.0)
+    breaker.record(1.0, error=True)
+    breaker.record(9.0)  # slow counts as a failure
+    assert breaker.state == "closed"
+    breaker.record(1.0, error=True)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    now["t"] = 31.0
+    breaker.before_call()  # the probe goes out
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # everyone else still fails fast
+    breaker.record(1.0)
+    assert breaker.state == "closed"
+
+
+def test_chat_completion_fails_fast_while_open(monkeypatch):
+    from core.llm import CircuitBreaker, CircuitOpenError
+    breaker = CircuitBreaker(min_calls=2, failure_rate=0.5)
+    monkeypatch.setattr(llm, "breaker", breaker)
+
+    class Down(FakeCompletions):
+        async def create(self, **request):
+            self.started += 1
+            raise RuntimeError("upstream 503")
+
+    completions = Down([])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            asyncio.run(chat_completion(client, model="m"))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(chat_completion(client, model="m"))
+    assert completions.started == 2
+
+
+def test_deadline_cancels_the_upstream_call():
+    from core.llm import DeadlineExceeded, deadline
+    client, completions = _client([5.0])
+
+    async def run():
+        with deadline(0.05):
+            return await chat_completion(client, model="m")
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert completions.cancelled == 1
+
+    async def expired():
+        with deadline(-1):
+            return await chat_completion(client, model="m")
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(expired())
+    assert completions.started == 1
+
+
+def test_until_disconnected_cancels_work():
+    from core.llm import ClientDisconnected, until_disconnected
+    client, completions = _client([5.0])
+
+    class GoneRequest:
+        async def is_disconnected(self):
+            return True
+
+    with pytest.raises(ClientDisconnected):
+        asyncio.run(until_disconnected(GoneRequest(), chat_completion(client, model="m"), poll=0.01))
+    assert completions.cancelled == 1
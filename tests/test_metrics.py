@@ -0,0 +1,75 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from agents.extraction_agent import ExtractionAgent
+from core.metrics import MetricsRegistry, StageTimer, add_count, metrics, stage
+
+
+def test_registry_counters_and_summaries():
+    registry = MetricsRegistry(window=10)
+    registry.incr("uploads", method="llm")
+    registry.incr("uploads", 2, method="llm")
+    for value in range(1, 21):
+        registry.observe("latency_ms", value)
+
+    assert registry.counter("uploads", method="llm") == 3
+    summary = registry.summary("latency_ms")
+    assert summary["count"] == 20 and summary["min"] == 1 and summary["max"] == 20
+    assert summary["p50"] in (15, 16)  # over the last 10 samples only
+    assert "uploads{method=llm}" in registry.snapshot()["counters"]
+
+
+def test_stage_timer_collects_nested_calls():
+    async def work():
+        with stage("llm"):
+            await asyncio.sleep(0.01)
+        add_count("prompt_tokens", 100)
+
+    async def run():
+        with StageTimer() as timer:
+            await asyncio.gather(work(), work())
+        return timer
+
+    timer = asyncio.run(run())
+    result = timer.as_dict()
+    assert result["prompt_tokens"] == 200
+    assert result["stages_ms"]["llm"] >= 20  # accumulated across both calls
+
+    # Outside a timer the helpers are no-ops
+    with stage("ignored"):
+        add_count("ignored", 1)
+
+
+def test_stage_timer_publish():
+    registry = MetricsRegistry()
+    timer = StageTimer()
+    with timer.stage("parse"):
+        pass
+    timer.add_count("pages", 3)
+    timer.publish("upload", registry)
+    assert registry.summary("upload.stage_ms", stage="parse")["count"] == 1
+    assert registry.summary("upload.pages")["sum"] == 3
+
+
+def test_llm_usage_recorded(monkeypatch):
+    class FakeCompletions:
+        async def create(self, **kwargs):
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps({"wages": 1.0})))],
+                usage=SimpleNamespace(prompt_tokens=120, completion_tokens=30),
+            )
+
+    agent = ExtractionAgent(api_key="test-key")
+    agent.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    before = metrics.counter("llm.prompt_tokens", model="gpt-4o")
+
+    async def run():
+        with StageTimer() as timer:
+            await agent._structure("1z 1.")
+        return timer
+
+    timings = asyncio.run(run()).as_dict()
+    assert timings["prompt_tokens"] == 120 and timings["completion_tokens"] == 30
+    assert timings["llm_calls"] == 1 and "json_parse" in timings["stages_ms"]
+    assert metrics.counter("llm.prompt_tokens", model="gpt-4o") == before + 120
@@ -1,3 +1,4 @@
+import pytest
 from agents.refund_explainer_agent import RefundExplainerAgent
 from core.tax_math import TaxMath
 
@@ -205,3 +206,175 @@ def test_endpoint_user_isolation(client, auth_header):
         "current_record_id": prior_id,
     }, headers=header_b)
     assert resp.status_code == 404
+
+
+# --- Shapley attribution ---
+
+def test_explain_waterfall_reports_evaluations():
+    agent = RefundExplainerAgent(math_engine=TaxMath())
+    result = agent.explain(PRIOR_YEAR, CURRENT_YEAR)
+    assert result["attribution_mode"] == "waterfall"
+    # 2 endpoints + one step per changed field (wages, w2_withholding)
+    assert result["evaluations"] == 4
+
+
+def test_explain_shapley_sums_exactly_to_total():
+    agent = RefundExplainerAgent(math_engine=TaxMath())
+    current = {
+        **PRIOR_YEAR,
+        "tax_year": 2024,
+        "wages": 120000,
+        "w2_withholding": 20000,
+        "schedule_1_income": 5000,
+        "dependents_count": 2,
+    }
+    result = agent.explain(PRIOR_YEAR, current, mode="shapley")
+    assert result["attribution_mode"] == "shapley"
+    assert all(d["field"] != "_interaction" for d in result["drivers"])
+    driver_sum = sum(d["impact_on_balance"] for d in result["drivers"])
+    assert abs(driver_sum - result["total_change"]) < 0.05
+    assert result["evaluations"] <= 2 ** 4
+
+
+def test_explain_shapley_matches_waterfall_for_additive_change():
+    """Withholding is purely additive, so both modes agree on it."""
+    agent = RefundExplainerAgent(math_engine=TaxMath())
+    current = {**PRIOR_YEAR, "tax_year": 2024, "w2_withholding": 12500}
+    waterfall = agent.explain(PRIOR_YEAR, current)
+    shapley = agent.explain(PRIOR_YEAR, current, mode="shapley")
+    assert shapley["drivers"][0]["impact_on_balance"] == waterfall["drivers"][0]["impact_on_balance"] == 1500
+
+
+def test_explain_unknown_mode_raises():
+    agent = RefundExplainerAgent(math_engine=TaxMath())
+    with pytest.raises(ValueError):
+        agent.explain(PRIOR_YEAR, CURRENT_YEAR, mode="banzhaf")
+
+
+def test_endpoint_shapley_mode(client, auth_header):
+    resp = client.post("/insights/explain-refund-change", json={
+        "prior_data": PRIOR_YEAR,
+        "current_data": CURRENT_YEAR,
+        "attribution_mode": "shapley",
+    }, headers=auth_header)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["attribution_mode"] == "shapley"
+    assert data["evaluations"] == 4
+
+
+# --- Multi-year history dashboard ---
+
+def test_history_timeline(client, auth_header):
+    _create_record(client, auth_header, {"tax_year": 2022, "wages": 60000})
+    _create_record(client, auth_header, {"tax_year": 2023, "wages": 70000})
+    _create_record(client, auth_header, {"tax_year": 2024, "wages": 85000, "w2_withholding": 14000})
+
+    resp = client.get("/insights/history", headers=auth_header)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert [y["tax_year"] for y in data["years"]] == [2022, 2023, 2024]
+    assert [(c["prior_year"], c["current_year"]) for c in data["changes"]] == [(2022, 2023), (2023, 2024)]
+    # 3 years reconciled once + 1 waterfall step (wages) + 2 steps (wages, withholding)
+    assert data["reconciliations"] == 3 + 1 + 2
+
+    for change, prior, current in zip(data["changes"], data["years"], data["years"][1:]):
+        assert change["prior_balance"] == prior["balance"]
+        assert change["current_balance"] == current["balance"]
+
+
+def test_history_matches_pairwise_explainer(client, auth_header):
+    _create_record(client, auth_header, {"tax_year": 2023, "wages": 70000})
+    _create_record(client, auth_header, {"tax_year": 2024, "wages": 85000, "w2_withholding": 14000})
+
+    history = client.get("/insights/history", headers=auth_header).json()
+    pairwise = RefundExplainerAgent(math_engine=TaxMath()).explain(
+        {**PRIOR_YEAR, "tax_year": 2023, "wages": 70000},
+        {**PRIOR_YEAR, "tax_year": 2024, "wages": 85000, "w2_withholding": 14000},
+    )
+    assert history["changes"][0]["drivers"] == pairwise["drivers"]
+
+
+def test_history_empty(client, auth_header):
+    resp = client.get("/insights/history", headers=auth_header)
+    assert resp.status_code == 200
+    assert resp.json() == {"years": [], "changes": [], "reconciliations": 0}
+
+
+def test_history_rejects_unknown_mode_without_pairs(client, auth_header):
+    resp = client.get("/insights/history?attribution_mode=bogus", headers=auth_header)
+    assert resp.status_code == 400
+    _create_record(client, auth_header, {"tax_year": 2024})
+    resp = client.get("/insights/history?attribution_mode=bogus", headers=auth_header)
+    assert resp.status_code == 400
+
+
+def test_endpoint_by_record_ids_persists_explanation(client, auth_header):
+    from core.models import TaxRecord
+    from tests.conftest import TEST_ENGINE
+    from sqlmodel import Session
+
+    prior_id = _create_record(client, auth_header, {"tax_year": 2023, "wages": 70000})
+    current_id = _create_record(client, auth_header, {"tax_year": 2024, "wages": 85000})
+    body = {"prior_record_id": prior_id, "current_record_id": current_id}
+
+    first = client.post("/insights/explain-refund-change", json=body, headers=auth_header).json()
+    with Session(TEST_ENGINE) as session:
+        prior = session.get(TaxRecord, prior_id)
+        current = session.get(TaxRecord, current_id)
+        assert prior.reconciliation_cache and current.reconciliation_cache
+        assert current.explanation_cache
+
+    second = client.post("/insights/explain-refund-change", json=body, headers=auth_header).json()
+    assert second == first
+
+    # Editing a record invalidates the stored explanation
+    client.put(f"/tax-records/{current_id}", json={"wages": 95000}, headers=auth_header)
+    third = client.post("/insights/explain-refund-change", json=body, headers=auth_header).json()
+    assert third["current_balance"] < first["current_balance"]
+
+    # So does changing only a record's year
+    client.put(f"/tax-records/{current_id}", json={"tax_year": 2025}, headers=auth_header)
+    fourth = client.post("/insights/explain-refund-change", json=body, headers=auth_header).json()
+    assert fourth["current_year"] == 2025
+
+
+def test_failed_ai_summary_is_not_cached(client, auth_header, monkeypatch):
+    from types import SimpleNamespace
+    from core import llm
+    from routes import insights
+
+    prior_id = _create_record(client, auth_header, {"tax_year": 2023, "wages": 70000})
+    current_id = _create_record(client, auth_header, {"tax_year": 2024, "wages": 85000})
+    body = {"prior_record_id": prior_id, "current_record_id": current_id}
+    calls = []
+
+    async def failing(client, **kwargs):
+        calls.append(kwargs)
+        raise RuntimeError("upstream timeout")
+
+    async def answering(client, **kwargs):
+        calls.append(kwargs)
+        message = SimpleNamespace(content="Your refund went down because wages rose.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    monkeypatch.setattr(insights, "API_KEY", "test-key")
+    monkeypatch.setattr(llm, "chat_completion", failing)
+    for _ in range(2):
+        resp = client.post("/insights/explain-refund-change", json=body, headers=auth_header)
+        assert resp.json()["ai_summary"] is None
+    assert len(calls) == 2  # the failure was not served from the cache
+
+    monkeypatch.setattr(llm, "chat_completion", answering)
+    for _ in range(2):
+        resp = client.post("/insights/explain-refund-change", json=body, headers=auth_header)
+        assert resp.json()["ai_summary"] == "Your refund went down because wages rose."
+    assert len(calls) == 3
+
+
+def test_endpoint_record_ids_require_login(client):
+    resp = client.post("/insights/explain-refund-change", json={
+        "prior_record_id": 1,
+        "current_record_id": 2,
+    })
+    assert resp.status_code == 401
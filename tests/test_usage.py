@@ -0,0 +1,77 @@
+import asyncio
+
+import httpx
+
+from benchmarks.fake_openai import FakeOpenAIConfig, create_app
+from core import llm
+from core.usage import UsageLedger, call_cost, usage_scope
+from tests.conftest import TEST_ENGINE
+
+
+def test_ledger_buffers_and_flushes_in_batches():
+    from sqlmodel import Session, select
+    from core.models import LLMUsage
+
+    async def scenario():
+        ledger = UsageLedger(flush_seconds=60, flush_size=3)
+        await ledger.start(TEST_ENGINE)
+        with usage_scope("/insights/optimize", user_id=7):
+            ledger.record("gpt-4o-mini", 1000, 100, 850.0)
+            ledger.record("gpt-4o-mini", 1000, 100, 900.0)
+        assert ledger.pending == 2  # nothing written on the request path
+        ledger.record("gpt-4o", 2000, 50, 2100.0)
+        await asyncio.sleep(0.1)  # the third row reaches flush_size and wakes the writer
+        pending = ledger.pending
+        await ledger.stop()
+        return pending
+
+    assert asyncio.run(scenario()) == 0
+    with Session(TEST_ENGINE) as session:
+        rows = session.exec(select(LLMUsage).order_by(LLMUsage.id)).all()
+    assert [(r.user_id, r.endpoint) for r in rows] == [(7, "/insights/optimize")] * 2 + [(None, "unknown")]
+    assert rows[0].cost_usd == call_cost("gpt-4o-mini", 1000, 100) == 0.00021
+
+
+def test_usage_summary_by_user_and_endpoint(client, auth_header, monkeypatch):
+    from routes import insights
+
+    app = create_app(FakeOpenAIConfig(median=0.001, p99=0.002))
+    llm.configure_client("http://stand-in/v1", httpx.AsyncClient(transport=httpx.ASGITransport(app=app)))
+    monkeypatch.setattr(insights, "API_KEY", "test-key")
+    try:
+        for _ in range(2):
+            resp = client.post("/insights/optimize", json={
+                "filing_status": "Single", "wages": 75000, "w2_withholding": 12000,
+            }, headers=auth_header)
+            assert resp.json()["ai_summary"].startswith("Your refund changed")
+    finally:
+        llm.configure_client(None, None)
+
+    user_id = client.get("/auth/me", headers=auth_header).json()["id"]
+    summary = client.get("/usage/summary?group_by=user&group_by=endpoint", headers=auth_header).json()
+    row = next(r for r in summary["rows"] if r["endpoint"] == "/insights/optimize")
+    assert row["user"] == user_id and row["calls"] == 2 and row["hedge_calls"] == 0
+    assert row["prompt_tokens"] > 0 and row["cost_usd"] > 0
+
+    by_day = client.get("/usage/summary?group_by=day", headers=auth_header).json()
+    assert by_day["total_calls"] >= 2 and len(by_day["rows"][0]["day"]) == 10
+    assert client.get("/usage/summary?group_by=planet", headers=auth_header).status_code == 400
+    assert client.get("/usage/summary?days=0", headers=auth_header).status_code == 422
+
+
+def test_usage_summary_access(client, auth_header, monkeypatch):
+    from core import auth
+    from core.usage import usage_ledger
+
+    with usage_scope("/insights/optimize", user_id=999):
+        usage_ledger.record("gpt-4o-mini", 1000, 100, 850.0)
+    monkeypatch.setattr(auth, "OPERATOR_TOKEN", "ops-secret")
+
+    assert client.get("/usage/summary").status_code == 401
+    assert client.get("/usage/summary?user_id=999", headers=auth_header).status_code == 403
+    own = client.get("/usage/summary?group_by=user", headers=auth_header).json()
+    assert own["total_calls"] == 0  # another user's calls are not visible
+
+    assert client.get("/usage/summary", headers={"X-Operator-Token": "wrong"}).status_code == 401
+    everyone = client.get("/usage/summary?group_by=user", headers={"X-Operator-Token": "ops-secret"}).json()
+    assert any(row["user"] == 999 for row in everyone["rows"])